@@ -1,73 +1,469 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Annotated
 
-import pandas as pd
 import uvicorn
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
 
+from keima.backend.admission.limits import Admission
 from keima.backend.app_class.app_class import (
     BuyTicketRequest,
     RaceState,
     RaceStateService,
     SetCoinsRequest,
 )
-from keima.backend.coins.get_coins import get_team_coins
-from keima.backend.coins.set_coins import set_team_coins
-from keima.backend.race_result.load_result import load_result
-from keima.backend.race_result.save_result import save_result
+from keima.backend.broadcast.broadcaster import EVICTED, Broadcaster, format_event
+from keima.backend.broadcast.notifier import ChangeNotifier, long_poll
+from keima.backend.checkpoint.checkpoint import CHECKPOINT_FILE, Checkpointer
+from keima.backend.idempotency.cache import ADMIN_IDEMPOTENCY_FILE, IdempotencyCache
+from keima.backend.locks.team_lock import TeamLockManager
+from keima.backend.metrics.metrics import metrics
+from keima.backend.metrics.middleware import MetricsMiddleware
+from keima.backend.odds.odds import OddsBook, RaceOdds
+from keima.backend.race_state.factory import create_race_state_service
+from keima.backend.race_state.partition import RacePartition
+from keima.backend.race_state.sqlite_race_state import SqliteRaceStateService
 from keima.backend.reward.reward import Reward
+from keima.backend.settlement.jobs import SettlementJobQueue
+from keima.backend.settlement.parallel import (
+    create_settle_executor,
+    settle_tickets_parallel,
+)
+from keima.backend.settlement.settle import settle_tickets
+from keima.backend.storage.executor import storage_executor
+from keima.backend.storage.factory import create_storage
+from keima.backend.tickets.outcome_pool import OutcomePool
+from keima.backend.tickets.ticket_batch import TicketBatch
+from keima.myexception.backend import (
+    IdempotencyKeyReusedError,
+    SettlementJobExistsError,
+    TicketBuyClosedError,
+)
+
+DIR_PATH = os.getenv("KEIMA_DIR_PATH", str(Path(__file__).parent.parent / "data"))
+
+storage = create_storage(DIR_PATH)
+
+# 同じチームの購入・支払いだけを直列化する。複数ワーカーでは "file" にする
+team_locks = TeamLockManager(
+    os.getenv("KEIMA_TEAM_LOCK", "process"), f"{DIR_PATH}/locks"
+)
+
+
+# メモリ上の状態のチェックポイントを書き出す間隔 [秒]。0のときは書き出さない
+CHECKPOINT_INTERVAL = float(os.getenv("KEIMA_CHECKPOINT_INTERVAL", "60"))
+checkpointer = (
+    Checkpointer(
+        os.getenv("KEIMA_CHECKPOINT_PATH", f"{DIR_PATH}/{CHECKPOINT_FILE}"), DIR_PATH
+    )
+    if CHECKPOINT_INTERVAL > 0
+    else None
+)
+startup_seconds = metrics.gauge(
+    "keima_startup_seconds", "Time from startup until ready to serve."
+)
+logger = logging.getLogger("uvicorn.error")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start = time.perf_counter()
+    restored = {}
+    if checkpointer is not None:
+        # recover の前に読み込み、recover で追記された分は差分として読む
+        restored = await storage_executor.run(
+            checkpointer.restore, memory_race_state_service()
+        )
+    # 前回中断された coin の一括更新があれば完了させてから受け付ける
+    await storage_executor.run(storage.recover)
+    watcher = None
+    if isinstance(race_state_service, SqliteRaceStateService):
+        # 他のワーカーでの set_race_state も、このワーカーの購読者に配信する
+        watcher = asyncio.create_task(watch_race_state())
+    checkpoint_task = None
+    if checkpointer is not None:
+        checkpoint_task = asyncio.create_task(save_checkpoint_periodically())
+    elapsed = time.perf_counter() - start
+    startup_seconds.set(elapsed)
+    logger.info("Keima ready in %.3fs (checkpoint: %s)", elapsed, restored or "none")
+    yield
+    for task in [watcher, checkpoint_task]:
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+    if checkpointer is not None:
+        await save_checkpoint()
+    if settle_executor is not None:
+        settle_executor.shutdown()
+    await storage_executor.run(storage.close)
 
-DIR_PATH = str(Path(__file__).parent.parent / "data")
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+# KEIMA_METRICS=0 のときはミドルウェアも入れない
+if metrics.enabled:
+    app.add_middleware(MetricsMiddleware, metrics=metrics, routes=app.routes)
 
 reward_cls = Reward()
+# 報酬の計算方法: "fixed" (固定倍率) または "odds" (締め切り時の最終オッズ)
+REWARD_MODE = os.getenv("KEIMA_REWARD_MODE", "fixed")
+
+# 精算でチケットを読み直して計算するプロセスの数。0のときは購入時の集計から精算する
+SETTLE_WORKERS = int(os.getenv("KEIMA_SETTLE_WORKERS", "0"))
+# 1回に精算のプロセスに渡すteamの数
+SETTLE_CHUNK_SIZE = int(os.getenv("KEIMA_SETTLE_CHUNK_SIZE", "64"))
+settle_executor = create_settle_executor(SETTLE_WORKERS) if SETTLE_WORKERS > 1 else None
+
+# Idempotency-Key ごとに保存する結果の数と、保存しておく秒数
+IDEMPOTENCY_SIZE = int(os.getenv("KEIMA_IDEMPOTENCY_SIZE", "10000"))
+IDEMPOTENCY_TTL = float(os.getenv("KEIMA_IDEMPOTENCY_TTL", "600"))
+# 購入の結果はプロセスごとのメモリ上だけに持つ。複数ワーカーでは、
+# 再送が別のワーカーに届くと購入し直すため、同じワーカーに送ること
+# 管理者の操作の結果はファイルにも保存し、再起動後の再送にも同じ結果を返す
+ADMIN_IDEMPOTENCY_TTL = float(os.getenv("KEIMA_ADMIN_IDEMPOTENCY_TTL", "86400"))
+buy_idempotency = IdempotencyCache("buy_ticket", IDEMPOTENCY_SIZE, IDEMPOTENCY_TTL)
+admin_idempotency = IdempotencyCache(
+    "admin",
+    IDEMPOTENCY_SIZE,
+    ADMIN_IDEMPOTENCY_TTL,
+    f"{DIR_PATH}/{ADMIN_IDEMPOTENCY_FILE}",
+    storage_executor.run,
+)
+
+
+# エンドポイントごとのレート制限と、ストレージを使う処理の同時実行数の制限
+admission = Admission.from_env()
+# 同時実行数の上限で503を返すときの Retry-After [秒]
+OVERLOAD_RETRY_AFTER = int(os.getenv("KEIMA_OVERLOAD_RETRY_AFTER", "1"))
+
+
+def check_rate(endpoint: str, key: str) -> None:
+    """エンドポイントのレート制限を超えていれば429を返す
+
+    Parameters
+    ----------
+    endpoint : str
+        エンドポイントの名前
+    key : str
+        レート制限の単位 (team_name やクライアントのアドレス)
+    """
+    retry_after = admission.check_rate(endpoint, key)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+def client_key(request: Request) -> str:
+    """teamを指定しないエンドポイントのレート制限の単位 (クライアントのアドレス)"""
+    return request.client.host if request.client is not None else "unknown"
+
+
+@asynccontextmanager
+async def storage_slot(endpoint: str, admin: bool = False):
+    """ストレージを使う処理の枠を使う。空きがなければ待たずに503を返す
+
+    Parameters
+    ----------
+    endpoint : str
+        エンドポイントの名前
+    admin : bool, optional
+        /admin/* のリクエストかどうか。Trueのときは予約された枠も使える,
+        by default False
+    """
+    if not admission.acquire(endpoint, admin):
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy.",
+            headers={"Retry-After": str(OVERLOAD_RETRY_AFTER)},
+        )
+    try:
+        yield
+    finally:
+        admission.release()
+
+
+async def idempotent(
+    cache: IdempotencyCache,
+    idempotency_key: str | None,
+    owner: str,
+    request: Request,
+    fingerprint: str,
+    response: Response,
+    func: Callable[[], Awaitable[dict]],
+) -> dict:
+    """Idempotency-Key があれば、同じキーの最初の結果を返す
 
+    キーは (owner, メソッド, パス) ごとに分けて保存するため、別のteamや
+    別のエンドポイントが同じキーを使っても、互いの結果は返さない。
 
-race_state_service = RaceStateService()
+    Parameters
+    ----------
+    cache : IdempotencyCache
+        結果の保存先
+    idempotency_key : str | None
+        Idempotency-Key ヘッダー。Noneのときは毎回 func を実行する
+    owner : str
+        キーの持ち主。teamの名前、管理者の操作では "admin"
+    request : Request
+        キーを分けるメソッドとパスを取り出すリクエスト
+    fingerprint : str
+        リクエストの内容。同じキーで異なる内容のときは422を返す
+    response : Response
+        保存していた結果を返すときに Idempotent-Replayed ヘッダーを付ける
+    func : Callable[[], Awaitable[dict]]
+        リクエストを処理する関数
+
+    Returns
+    -------
+    dict
+        func の結果
+    """
+    if idempotency_key is None:
+        return await func()
+    try:
+        result, replayed = await cache.run(
+            f"{owner}:{request.method}:{request.url.path}:{idempotency_key}",
+            fingerprint,
+            func,
+        )
+    except IdempotencyKeyReusedError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+async def load_race_pool(game_id: int) -> OutcomePool:
+    """game_idの全チームのチケットの集計を1つにまとめて読み込む"""
+    pools = await storage_executor.run(storage.load_pools, game_id)
+    race_pool = OutcomePool()
+    for pool in pools.values():
+        race_pool.merge(pool)
+    return race_pool
+
+
+odds_book = OddsBook(load_race_pool, float(os.getenv("KEIMA_ODDS_TAKEOUT", "0")))
+
+
+# 複数ワーカーで動かすときは KEIMA_RACE_STATE=sqlite で全ワーカーの状態を共有する
+race_state_service = create_race_state_service(DIR_PATH)
 
 
 def get_race_state_service():
     return race_state_service
 
 
+# 複数のサーバーでレースを分担するときの、このサーバーの担当
+race_partition = RacePartition.from_env()
+
+
+def memory_race_state_service() -> RaceStateService | None:
+    """チェックポイントに含める、メモリ上のレースの状態を返す
+
+    SqliteRaceStateService のときは状態がデータベースに残るためNoneを返す。
+    """
+    if isinstance(race_state_service, SqliteRaceStateService):
+        return None
+    return race_state_service
+
+
+async def save_checkpoint() -> None:
+    """メモリ上の状態のチェックポイントを書き出す"""
+    service = memory_race_state_service()
+    # レースの状態はイベントループ上で更新されるため、ここで取り出してから渡す
+    races = None if service is None else checkpointer.capture_races(service)
+    await storage_executor.run(checkpointer.save, races)
+
+
+async def save_checkpoint_periodically() -> None:
+    while True:
+        await asyncio.sleep(CHECKPOINT_INTERVAL)
+        await save_checkpoint()
+
+
+def check_partition(game_id: int) -> None:
+    """game_idのレースを担当していなければ421を返す"""
+    if not race_partition.owns(game_id):
+        raise HTTPException(
+            status_code=421, detail=f"Race {game_id} is handled by another server."
+        )
+
+
+def race_state_of(game_id: int) -> RaceState:
+    """game_idのレースの状態を返す。状態が設定されていないレースは404を返す"""
+    check_partition(game_id)
+    race_state = race_state_service.get(game_id)
+    if race_state is None:
+        raise HTTPException(status_code=404, detail=f"Race {game_id} is not found.")
+    return race_state
+
+
+def check_ticket_buy_closed(game_id: int) -> None:
+    """game_idのレースがチケット購入受付中なら403を返す"""
+    check_partition(game_id)
+    race_state = race_state_service.get(game_id)
+    if race_state is not None and race_state.ticket_buy:
+        raise HTTPException(status_code=403, detail="Ticket purchasing is still open.")
+
+
+race_state_broadcaster = Broadcaster(int(os.getenv("KEIMA_STREAM_QUEUE_SIZE", "16")))
+# 購読者の切断を検知するため、変更がなくても送るコメントの間隔 [秒]
+STREAM_HEARTBEAT = float(os.getenv("KEIMA_STREAM_HEARTBEAT", "15"))
+
+
+# ロングポーリング (?wait=) の最大の待ち時間 [秒]
+LONG_POLL_MAX = float(os.getenv("KEIMA_LONG_POLL_MAX", "60"))
+# ロングポーリング中に、他のワーカーでの変更を確認する間隔 [秒]
+LONG_POLL_RECHECK = float(os.getenv("KEIMA_LONG_POLL_RECHECK", "1"))
+# このプロセスでの変更を、ロングポーリング中のリクエストにすぐ知らせる
+race_state_notifier = ChangeNotifier()
+coin_notifier = ChangeNotifier()
+
+
+def race_state_etag(service: RaceStateService) -> str:
+    """レースの状態のversionから作るETag"""
+    return f'"race-state-{service.load()[1]}"'
+
+
+def format_coins_etag(version: str | None, game_id: int) -> str | None:
+    """teamのcoinのversionとレース番号から作るETag。coinがないときはNone"""
+    return None if version is None else f'"coins-{version}-{game_id}"'
+
+
+async def coins_etag(team_name: str, game_id: int) -> str | None:
+    """teamのcoinのETag。キャッシュになければ保存先に問い合わせる"""
+    cached = storage.get_cached_coins(team_name, game_id)
+    if cached is not None:
+        return format_coins_etag(cached[1], game_id)
+    version = await storage_executor.run(storage.get_coins_version, team_name)
+    return format_coins_etag(version, game_id)
+
+
+def race_state_event(race_state: RaceState, version: int) -> str:
+    """レースの状態を Server-Sent Events の1イベントにする"""
+    return format_event("race_state", json.dumps(race_state.model_dump()), version)
+
+
+def publish_race_state() -> None:
+    """現在のレースの状態を購読者に配信する。配信済みのversionなら何もしない"""
+    race_state, version = race_state_service.load()
+    if version > race_state_broadcaster.version:
+        race_state_broadcaster.publish(version, race_state_event(race_state, version))
+        race_state_notifier.notify("race_state")
+
+
+async def watch_race_state() -> None:
+    """共有されたレースの状態のversionを監視し、変わったら配信する"""
+    interval = float(os.getenv("KEIMA_RACE_STATE_POLL_INTERVAL", "0.05"))
+    while True:
+        publish_race_state()
+        await asyncio.sleep(interval)
+
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"Hello Keima"}
 
 
 @app.post("/admin/set_coins")
-def set_coins(req: SetCoinsRequest) -> dict:
+async def set_coins(req: SetCoinsRequest) -> dict:
     """各チームのcoinを設定する"""
-    set_team_coins(req.team_name, req.coins, DIR_PATH, req.game_id)
+    async with storage_slot("set_coins", admin=True), team_locks.lock(req.team_name):
+        await storage_executor.run(
+            storage.set_team_coins, req.team_name, req.coins, req.game_id
+        )
+    coin_notifier.notify(req.team_name)
     return {"team_name": req.team_name, "added_coin": req.coins}
 
 
-@app.get("/get_coins")
-def get_coins(team_name: str, game_id: int) -> dict:
+@app.get("/get_coins", response_model=None)
+async def get_coins(
+    team_name: str,
+    game_id: int,
+    response: Response,
+    wait: float = 0,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> dict | Response:
     """各チームのcoinをgetする
 
+    レスポンスにはteamのcoinのversionとgame_idから作るETagを付ける。
+    If-None-Match が現在のETagと同じときは、coinを読まずに304を返す。
+    coinがキャッシュにあるときは、ETagの計算もディスクI/Oを待たない。
+    waitを指定すると、304を返す前にcoinが変わるまで最大wait秒待つ。
+
     Parameters
     ----------
     team_name : str
         teamの名前
     game_id : int
         レース番号
+    wait : float, optional
+        ロングポーリングの最大の待ち時間 [秒], by default 0
+    if_none_match : str | None, optional
+        If-None-Match ヘッダー, by default None
 
     Returns
     -------
-    dict
-        team_nameとcoin数の辞書
+    dict | Response
+        team_nameとcoin数の辞書。変更がないときは304のレスポンス
     """
-    coins = get_team_coins(team_name, DIR_PATH, game_id)
+    check_rate("get_coins", team_name)
+    # キャッシュにあればディスクI/Oを待たずに、ETagもcoinもイベントループ上で返す
+    cached = storage.get_cached_coins(team_name, game_id)
+    if cached is not None:
+        coins, version = cached
+        etag = format_coins_etag(version, game_id)
+    else:
+        coins = None
+        etag = await coins_etag(team_name, game_id)
+    if etag is not None and if_none_match == etag and wait > 0:
+        etag = await long_poll(
+            coin_notifier,
+            team_name,
+            etag,
+            lambda: coins_etag(team_name, game_id),
+            min(wait, LONG_POLL_MAX),
+            LONG_POLL_RECHECK,
+        )
+        # 待っている間に変わったcoinは読み直す
+        coins = None
+    if etag is not None and if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if coins is None:
+        cached = storage.get_cached_coins(team_name, game_id)
+        coins = None if cached is None else cached[0]
+    if coins is None:
+        async with storage_slot("get_coins"):
+            coins = await storage_executor.run(
+                storage.get_team_coins, team_name, game_id
+            )
+    if etag is not None:
+        response.headers["ETag"] = etag
     return {"team_name": team_name, "coins": int(coins)}
 
 
 @app.post("/admin/set_race_state")
-def set_race_state(
+async def set_race_state(
     race_state: RaceState, service: RaceStateService = Depends(get_race_state_service)
 ) -> dict:
     """レースの状態を設定する
 
+    レースの状態はgame_idごとに持ち、他のレースの状態は変えない。
+    設定したレースが現在のレースになる。
+
     Parameters
     ----------
     race_state : RaceState
@@ -78,7 +474,26 @@ def set_race_state(
     dict
         レースの状態
     """
-    service.race_state = race_state
+    check_partition(race_state.game_id)
+    if service is memory_race_state_service():
+        previous = service.update(race_state)
+    else:
+        # BEGIN IMMEDIATE で他のワーカーの更新を待つことがあるため、
+        # イベントループを止めないようにスレッドで実行する
+        previous = await storage_executor.run(service.update, race_state)
+    publish_race_state()
+    if checkpointer is not None and service is memory_race_state_service():
+        await storage_executor.run(
+            checkpointer.record_race_state, race_state, service.version
+        )
+    if race_state.ticket_buy:
+        odds_book.open(race_state.game_id)
+    if previous.ticket_buy and not race_state.ticket_buy:
+        # 締め切った時点のオッズを、受付中だった購入を含めて確定させる
+        final = await odds_book.close(race_state.game_id)
+        await storage_executor.run(
+            storage.save_final_odds, race_state.game_id, final.to_dict()
+        )
     return {
         "game_id": race_state.game_id,
         "ticket_buy": race_state.ticket_buy,
@@ -86,16 +501,90 @@ def set_race_state(
     }
 
 
-def current_race_state() -> dict:
-    """内部呼び出し用: メモリ上の race_state_service から現在の状態を返す"""
-    rs = race_state_service.race_state
-    return {"game_id": rs.game_id, "ticket_buy": rs.ticket_buy}
+@app.get("/stream/race_state")
+async def stream_race_state() -> StreamingResponse:
+    """レースの状態が変わるたびに Server-Sent Events で送る
+
+    接続直後に現在の状態を送り、以降は /admin/set_race_state で
+    状態が変わるたびに "race_state" イベントを送る。
+    イベントIDは状態のversion。受信が追いつかずに追い出されたときは
+    接続を閉じるので、再接続して最新の状態を受け取り直す。
+
+    Returns
+    -------
+    StreamingResponse
+        text/event-stream のレスポンス
+    """
+    queue = race_state_broadcaster.subscribe()
+    race_state, version = race_state_service.load()
+
+    async def events():
+        last_version = version
+        try:
+            yield race_state_event(race_state, version)
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT)
+                except TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if message is EVICTED:
+                    return
+                message_version, event = message
+                if message_version > last_version:
+                    last_version = message_version
+                    yield event
+        finally:
+            race_state_broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/get_race_state", response_model=None)
+async def get_race_state(
+    request: Request,
+    response: Response,
+    wait: float = 0,
+    if_none_match: Annotated[str | None, Header()] = None,
+    service: RaceStateService = Depends(get_race_state_service),
+    game_id: int | None = None,
+) -> dict | Response:
+    """HTTP エンドポイント: DI でサービスを受け取り現在の race_state を返す
 
+    game_idを指定したときは、現在のレースではなくそのレースの状態を返す。
+    レスポンスにはレースの状態のversionから作るETagを付ける。
+    If-None-Match が現在のETagと同じときは304を返す。
+    waitを指定すると、304を返す前に状態が変わるまで最大wait秒待つ。
+    """
+    check_rate("get_race_state", client_key(request))
+    etag = race_state_etag(service)
+    if if_none_match == etag and wait > 0:
+
+        async def load_etag() -> str:
+            return race_state_etag(service)
+
+        etag = await long_poll(
+            race_state_notifier,
+            "race_state",
+            etag,
+            load_etag,
+            min(wait, LONG_POLL_MAX),
+            LONG_POLL_RECHECK,
+        )
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
 
-@app.get("/get_race_state")
-def get_race_state(service: RaceStateService = Depends(get_race_state_service)) -> dict:
-    """HTTP エンドポイント: DI でサービスを受け取り現在の race_state を返す"""
-    rs = service.race_state
+    if game_id is None:
+        rs = service.race_state
+    else:
+        rs = service.get(game_id)
+        if rs is None:
+            raise HTTPException(status_code=404, detail=f"Race {game_id} is not found.")
+    response.headers["ETag"] = race_state_etag(service)
     return {
         "game_id": rs.game_id,
         "ticket_buy": rs.ticket_buy,
@@ -103,116 +592,561 @@ def get_race_state(service: RaceStateService = Depends(get_race_state_service))
     }
 
 
+async def get_final_odds(game_id: int) -> RaceOdds | None:
+    """締め切り時の最終オッズを返す
+
+    メモリになければ保存先から読み込む。最終オッズは set_race_state で
+    購入を締め切ったときにだけ作るため、ここでは作らない。
+
+    Parameters
+    ----------
+    game_id : int
+        レース番号
+
+    Returns
+    -------
+    RaceOdds | None
+        最終オッズ。購入を締め切ったことのないレースはNone
+    """
+    odds = odds_book.final(game_id)
+    if odds is not None:
+        return odds
+    stored = await storage_executor.run(storage.load_final_odds, game_id)
+    if stored is None:
+        return None
+    odds = RaceOdds.from_dict(stored)
+    odds_book.set_final(game_id, odds)
+    return odds
+
+
+async def final_odds_of(game_id: int) -> RaceOdds:
+    """精算に使う最終オッズを返す。最終オッズがないレースは409を返す"""
+    odds = await get_final_odds(game_id)
+    if odds is None:
+        raise HTTPException(
+            status_code=409, detail=f"Final odds of race {game_id} are not available."
+        )
+    return odds
+
+
+@app.get("/get_odds")
+async def get_odds(request: Request, game_id: int | None = None) -> dict:
+    """オッズを返す
+
+    購入受付中のレースは購入のたびに更新されるオッズを、
+    締め切り後のレースは最終オッズを返す。チケットは読み直さない。
+    状態が設定されていないレースは404を返す。
+
+    Parameters
+    ----------
+    game_id : int | None, optional
+        レース番号。Noneのときは現在のレース, by default None
+
+    Returns
+    -------
+    dict
+        レース番号、最終オッズかどうか、ticket_typeごとのunitの合計と
+        的中条件ごとのunitとオッズの辞書
+    """
+    check_rate("get_odds", client_key(request))
+    if game_id is None:
+        game_id = race_state_service.race_state.game_id
+    race_state = race_state_of(game_id)
+    final_odds = None if race_state.ticket_buy else await get_final_odds(game_id)
+    if final_odds is None:
+        # 受付中のレースと、購入を受け付けないまま締め切ったレースは現在の集計で返す
+        odds, final = await odds_book.odds(game_id)
+    else:
+        odds, final = final_odds, True
+    return {"game_id": game_id, "final": final, **odds.to_dict()}
+
+
 @app.post("/buy_ticket")
-def buy_ticket(req: BuyTicketRequest) -> dict:
+async def buy_ticket(
+    req: BuyTicketRequest,
+    request: Request,
+    response: Response,
+    idempotency_key: Annotated[str | None, Header()] = None,
+) -> dict:
     """チケットを購入する
 
+    req.game_id のレースがチケット購入受付中のときだけ購入できる。
+    coinは、同時に購入受付中の他のレースで購入済みのunitも含めて確認する。
+    Idempotency-Key を付けて再送したときは、購入し直さずに最初の結果を返す。
+
     Parameters
     ----------
     team_name : str
         teamの名前
     request : BuyTicketRequest
         チケット情報のリスト
+    idempotency_key : str | None, optional
+        Idempotency-Key ヘッダー, by default None
     Returns
     -------
     dict
         team_nameと購入したチケット数の辞書
     """
-    race_state = current_race_state()
-    game_id = race_state["game_id"]
-    ticket_buy = race_state["ticket_buy"]
-    if not ticket_buy:
+    return await idempotent(
+        buy_idempotency,
+        idempotency_key,
+        req.team_name,
+        request,
+        req.model_dump_json(),
+        response,
+        lambda: purchase_tickets(req),
+    )
+
+
+async def purchase_tickets(req: BuyTicketRequest) -> dict:
+    """チケットを購入する。buy_ticket の本体"""
+    check_rate("buy_ticket", req.team_name)
+    game_id = req.game_id
+    if not race_state_of(game_id).ticket_buy:
         raise HTTPException(
             status_code=403, detail="Ticket purchasing is currently closed."
         )
 
-    # チケット情報を DataFrame に変換
-    ticket_df = pd.DataFrame([t.model_dump() for t in req.tickets])
-    num_coins = ticket_df["unit"].sum()
+    tickets = TicketBatch.from_tickets(req.tickets)
     team_name = req.team_name
-    team_coin = get_team_coins(team_name, DIR_PATH)
-    if team_coin < num_coins:
+    try:
+        # 締め切り時の最終オッズは、ここで受付中の購入が終わるのを待ってから作る
+        async with storage_slot("buy_ticket"), odds_book.purchase(game_id):
+            # coinの確認とチケットの保存の間に、同じチームの購入や支払いを割り込ませない
+            async with team_locks.lock(team_name):
+                # 締め切り後でも支払いを精算する前のレースの購入済みunitは含める
+                other_game_ids = [g for g in race_state_service.races if g != game_id]
+                reserved = await storage_executor.run(
+                    storage.reserve_tickets,
+                    team_name,
+                    game_id,
+                    tickets,
+                    other_game_ids,
+                )
+            if reserved:
+                odds_book.add(game_id, tickets)
+    except TicketBuyClosedError as e:
+        raise HTTPException(
+            status_code=403, detail="Ticket purchasing is currently closed."
+        ) from e
+    if not reserved:
         return {"error": "Not enough coins to purchase tickets."}
 
-    ticket_df.to_csv(f"{DIR_PATH}/{team_name}_{game_id}_tickets.csv", index=False)
-    return {"team_name": team_name, "purchased_tickets_coins": int(num_coins)}
+    return {"team_name": team_name, "purchased_tickets_coins": tickets.units}
+
+
+# /buy_tickets で1回に受け付ける購入の数の上限
+BULK_BUY_MAX = int(os.getenv("KEIMA_BULK_BUY_MAX", "1000"))
+
+
+@app.post("/buy_tickets")
+async def buy_tickets(
+    reqs: Annotated[list[dict], Body()],
+    request: Request,
+    response: Response,
+    idempotency_key: Annotated[str | None, Header()] = None,
+) -> dict:
+    """複数チームのチケットをまとめて購入する
+
+    購入ごとに BuyTicketRequest として検証し、buy_ticket と同じ条件
+    (teamごとのレート制限を含む) で確認して、受け付けたかどうかを
+    リクエストと同じ順に返す。検証に失敗した購入は、その購入だけを断る。
+    coinの確認とチケットの保存はレースごとにまとめて1回で行い、
+    あるレースの保存に失敗しても、それまでに保存したレースの結果は返す。
+    同じteamの購入が複数あるときは前から順に確認する。
+    Idempotency-Key を付けて再送したときは、購入し直さずに最初の結果を返す。
+
+    Parameters
+    ----------
+    reqs : list[dict]
+        チケット購入リクエスト (BuyTicketRequest) のリスト
+    idempotency_key : str | None, optional
+        Idempotency-Key ヘッダー, by default None
+
+    Returns
+    -------
+    dict
+        受け付けた購入の数と、購入ごとの結果のリスト
+    """
+    if len(reqs) > BULK_BUY_MAX:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Too many purchases: {len(reqs)} > {BULK_BUY_MAX}.",
+        )
+    return await idempotent(
+        buy_idempotency,
+        idempotency_key,
+        client_key(request),
+        request,
+        json.dumps(reqs, sort_keys=True),
+        response,
+        lambda: purchase_teams_tickets(reqs, client_key(request)),
+    )
+
+
+def validation_error(e: ValidationError) -> str:
+    """検証エラーを "場所: 内容" の1行にまとめる"""
+    return "; ".join(
+        f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()
+    )
+
+
+async def purchase_teams_tickets(items: list[dict], client: str) -> dict:
+    """複数チームのチケットを購入する。buy_tickets の本体"""
+    check_rate("buy_tickets", client)
+    results: list[dict] = [
+        {
+            "team_name": item.get("team_name"),
+            "game_id": item.get("game_id"),
+            "accepted": False,
+        }
+        for item in items
+    ]
+    # 検証に失敗した購入と購入受付中でないレースの購入は、保存先に問い合わせずに断る
+    game_purchases: dict[int, list[tuple[int, str, TicketBatch]]] = {}
+    for i, item in enumerate(items):
+        try:
+            req = BuyTicketRequest.model_validate(item)
+        except ValidationError as e:
+            results[i]["error"] = validation_error(e)
+            continue
+        try:
+            check_rate("buy_ticket", req.team_name)
+            ticket_buy = race_state_of(req.game_id).ticket_buy
+        except HTTPException as e:
+            results[i]["error"] = e.detail
+            continue
+        if not ticket_buy:
+            results[i]["error"] = "Ticket purchasing is currently closed."
+            continue
+        game_purchases.setdefault(req.game_id, []).append(
+            (i, req.team_name, TicketBatch.from_tickets(req.tickets))
+        )
+
+    async with storage_slot("buy_tickets"):
+        for game_id, indexed in game_purchases.items():
+            purchases = [(team_name, tickets) for _, team_name, tickets in indexed]
+            try:
+                accepted = await reserve_game_purchases(game_id, purchases)
+            except TicketBuyClosedError:
+                for i, _, _ in indexed:
+                    results[i]["error"] = "Ticket purchasing is currently closed."
+                continue
+            except Exception as e:
+                # 保存済みのレースの結果を返すため、このレースの購入だけを断る
+                logger.exception("Failed to buy tickets for game %s", game_id)
+                for i, _, _ in indexed:
+                    results[i]["error"] = f"Failed to save tickets: {type(e).__name__}"
+                continue
+            for (i, _, tickets), ok in zip(indexed, accepted):
+                if ok:
+                    results[i].update(
+                        accepted=True, purchased_tickets_coins=tickets.units
+                    )
+                else:
+                    results[i]["error"] = "Not enough coins to purchase tickets."
+
+    return {
+        "accepted": sum(result["accepted"] for result in results),
+        "results": results,
+    }
+
+
+async def reserve_game_purchases(
+    game_id: int, purchases: list[tuple[str, TicketBatch]]
+) -> list[bool]:
+    """1つのレースの購入をまとめて確認・保存し、オッズに反映する"""
+    async with odds_book.purchase(game_id):
+        async with team_locks.lock_many(t for t, _ in purchases):
+            other_game_ids = [g for g in race_state_service.races if g != game_id]
+            accepted = await storage_executor.run(
+                storage.reserve_teams_tickets, game_id, purchases, other_game_ids
+            )
+        odds_book.add(
+            game_id,
+            TicketBatch.concat(
+                tickets for (_, tickets), ok in zip(purchases, accepted) if ok
+            ),
+        )
+    return accepted
 
 
 @app.post("/admin/pay_tickets")
-def pay_tickets(
+async def pay_tickets(
     team_name: str,
     game_id: int,
+    request: Request,
+    response: Response,
+    idempotency_key: Annotated[str | None, Header()] = None,
 ) -> dict:
     """チームのチケットの支払いを行う
+
+    Idempotency-Key を付けて再送したときは、支払い直さずに最初の結果を返す。
+
     Parameters
     ----------
     team_name : str
         teamの名前
     game_id : int
         レース番号
+    idempotency_key : str | None, optional
+        Idempotency-Key ヘッダー, by default None
 
     Returns
     -------
     dict
         team_nameと支払ったチケット数の辞書
     """
-    race_state = current_race_state()
-    game_id_state = race_state["game_id"]
-    ticket_buy = race_state["ticket_buy"]
-    if (game_id == game_id_state) and (ticket_buy is True):
-        raise HTTPException(status_code=403, detail="Ticket purchasing is still open.")
+    return await idempotent(
+        admin_idempotency,
+        idempotency_key,
+        "admin",
+        request,
+        f"{team_name}:{game_id}",
+        response,
+        lambda: pay_team_tickets(team_name, game_id),
+    )
 
-    ticket_df = pd.read_csv(f"{DIR_PATH}/{team_name}_{game_id}_tickets.csv")
-    # This is a placeholder implementation.
-    pay_coins = ticket_df["unit"].sum()
-    team_coins = get_team_coins(team_name, DIR_PATH)
-    set_team_coins(team_name, team_coins - pay_coins, DIR_PATH)
-    return {"team_name": team_name, "team_coins": int(team_coins - pay_coins)}
+
+async def pay_team_tickets(team_name: str, game_id: int) -> dict:
+    """チームのチケットの支払いを行う。pay_tickets の本体"""
+    check_ticket_buy_closed(game_id)
+
+    async with storage_slot("pay_tickets", admin=True), team_locks.lock(team_name):
+        pay_coins = await storage_executor.run(
+            storage.get_reserved_coins, team_name, game_id
+        )
+        # 精算済みとして記録するため、settle_race やジョブで二重に支払わない
+        team_coins = await storage_executor.run(
+            storage.settle_team_part, team_name, game_id, pay_coins, None
+        )
+    if team_coins is None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Tickets of {team_name} for game {game_id} are already paid.",
+        )
+    coin_notifier.notify(team_name)
+    return {"team_name": team_name, "team_coins": int(team_coins)}
 
 
 @app.post("/admin/save_race_result")
-def save_race_result(result: list[int]) -> dict:
+async def save_race_result(result: list[int], game_id: int | None = None) -> dict:
     """レースの結果を保存する
 
     Parameters
     ----------
     result : list[int]
         レースの結果
+    game_id : int | None, optional
+        レース番号。Noneのときは現在のレース, by default None
 
     Returns
     -------
     dict
         レース番号とレース結果の辞書
     """
-    game_id = current_race_state()["game_id"]
-    save_result(game_id, result, DIR_PATH)
+    if game_id is None:
+        game_id = race_state_service.race_state.game_id
+    if race_state_of(game_id).ticket_buy:
+        raise HTTPException(status_code=403, detail="Ticket purchasing is still open.")
+    async with storage_slot("save_race_result", admin=True):
+        await storage_executor.run(storage.save_result, game_id, result)
     return {"game_id": game_id, "result": result}
 
 
 @app.post("/admin/reward_tickets/{team_name}")
-def reward_tickets(team_name: str) -> dict:
+async def reward_tickets(
+    team_name: str,
+    request: Request,
+    response: Response,
+    game_id: int | None = None,
+    idempotency_key: Annotated[str | None, Header()] = None,
+) -> dict:
     """チームのチケットの報酬を行う
+
+    Idempotency-Key を付けて再送したときは、報酬を払い直さずに最初の結果を返す。
+
     Parameters
     ----------
     team_name : str
         teamの名前
+    game_id : int | None, optional
+        レース番号。Noneのときは現在のレース, by default None
+    idempotency_key : str | None, optional
+        Idempotency-Key ヘッダー, by default None
 
     Returns
     -------
     dict
         team_nameと報酬したチケット数の辞書
     """
-    race_state = current_race_state()
-    game_id = race_state["game_id"]
-    ticket_buy = race_state["ticket_buy"]
-    if ticket_buy:
+    if game_id is None:
+        game_id = race_state_service.race_state.game_id
+    return await idempotent(
+        admin_idempotency,
+        idempotency_key,
+        "admin",
+        request,
+        f"{team_name}:{game_id}",
+        response,
+        lambda: reward_team_tickets(team_name, game_id),
+    )
+
+
+async def reward_team_tickets(team_name: str, game_id: int) -> dict:
+    """チームのチケットの報酬を行う。reward_tickets の本体"""
+    check_partition(game_id)
+    race_state = race_state_service.get(game_id)
+    if race_state is not None and race_state.ticket_buy:
         return {"error": "Ticket purchasing is still open."}
-    ticket_df = pd.read_csv(f"{DIR_PATH}/{team_name}_{game_id}_tickets.csv")
-    result = load_result(game_id, DIR_PATH)
-    reward_coins = reward_cls.reward_point(ticket_df, result)
-    team_coins = get_team_coins(team_name, DIR_PATH)
-    set_team_coins(team_name, team_coins + reward_coins, DIR_PATH)
-    return {"team_name": team_name, "team_coins": int(team_coins + reward_coins)}
+    async with storage_slot("reward_tickets", admin=True):
+        result = await storage_executor.run(storage.load_result, game_id)
+        odds = await final_odds_of(game_id) if REWARD_MODE == "odds" else None
+        async with team_locks.lock(team_name):
+            pool = await storage_executor.run(storage.load_pool, team_name, game_id)
+            reward_coins = reward_cls.reward_pool(pool, result, odds)
+            # 精算済みとして記録するため、settle_race やジョブで二重に払わない
+            team_coins = await storage_executor.run(
+                storage.settle_team_part, team_name, game_id, None, reward_coins
+            )
+    if team_coins is None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Tickets of {team_name} for game {game_id} are already rewarded.",
+        )
+    coin_notifier.notify(team_name)
+    return {"team_name": team_name, "team_coins": int(team_coins)}
+
+
+@app.post("/admin/settle_race")
+async def settle_race(game_id: int) -> dict:
+    """レースの全チームのチケットの支払いと報酬をまとめて行う
+
+    KEIMA_SETTLE_WORKERS が1以上のときは、購入時の集計ではなく
+    チケットを読み直し、teamを分けて複数のプロセスで計算する。
+    /admin/pay_tickets や /admin/reward_tickets で精算したteamは飛ばす。
+    同じレースの精算のジョブが待機中か実行中のときは409を返す。
+
+    Parameters
+    ----------
+    game_id : int
+        レース番号
+
+    Returns
+    -------
+    dict
+        レース番号と、team_nameごとの支払い・報酬・精算後coin数の辞書
+    """
+    check_ticket_buy_closed(game_id)
+    if settlement_jobs.active(game_id):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Settlement job for game {game_id} is queued or running.",
+        )
+
+    async with storage_slot("settle_race", admin=True):
+        odds = await final_odds_of(game_id) if REWARD_MODE == "odds" else None
+        team_names = await storage_executor.run(storage.game_teams, game_id)
+        async with team_locks.lock_many(team_names):
+            settlement = await settle_game(game_id, odds)
+    for team_name in settlement:
+        coin_notifier.notify(team_name)
+    return {"game_id": game_id, "teams": settlement}
+
+
+async def settle_game(game_id: int, odds: RaceOdds | None) -> dict:
+    """レースの全チームを精算する。settle_race の本体"""
+    if SETTLE_WORKERS > 0:
+        return await storage_executor.run(
+            settle_tickets_parallel,
+            game_id,
+            storage,
+            reward_cls,
+            odds,
+            SETTLE_WORKERS,
+            SETTLE_CHUNK_SIZE,
+            settle_executor,
+        )
+    return await storage_executor.run(
+        settle_tickets, game_id, storage, reward_cls, odds
+    )
+
+
+def notify_settled(settlement: dict[str, dict[str, int]]) -> None:
+    """精算したteamのcoinを、ロングポーリング中のリクエストに知らせる"""
+    for team_name in settlement:
+        coin_notifier.notify(team_name)
+
+
+settlement_jobs = SettlementJobQueue(
+    storage_executor.run, SETTLE_CHUNK_SIZE, on_settled=notify_settled, locks=team_locks
+)
+
+
+@app.post("/admin/settlement_jobs", status_code=202)
+async def submit_settlement_job(game_id: int) -> dict:
+    """レースの全チームの精算をバックグラウンドのジョブとして投入する
+
+    ジョブIDをすぐに返し、精算は /admin/settlement_jobs/{job_id} で進捗を確認する。
+    途中で止まったレースは、投入し直すと精算済みのteamを飛ばして再開する。
+
+    Parameters
+    ----------
+    game_id : int
+        レース番号
+
+    Returns
+    -------
+    dict
+        ジョブの進捗
+    """
+    check_ticket_buy_closed(game_id)
+    odds = await final_odds_of(game_id) if REWARD_MODE == "odds" else None
+    try:
+        job = settlement_jobs.submit(game_id, storage, reward_cls, odds)
+    except SettlementJobExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    return job.to_dict()
+
+
+@app.get("/admin/settlement_jobs/{job_id}")
+async def get_settlement_job(job_id: str) -> dict:
+    """精算のジョブの進捗を返す
+
+    Parameters
+    ----------
+    job_id : str
+        ジョブID
+
+    Returns
+    -------
+    dict
+        ジョブの状態 ("queued", "running", "done", "failed")、精算したteamの数、
+        支払いcoinと報酬coinの合計
+    """
+    job = settlement_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} is not found.")
+    return job.to_dict()
+
+
+@app.get("/admin/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    """Prometheus のテキスト形式でメトリクスを返す
+
+    エンドポイントごとの処理時間・処理中のリクエスト数・ステータスと、
+    coin・レース結果・チケットの読み書きの処理時間・行数・バイト数を含む。
+
+    Returns
+    -------
+    PlainTextResponse
+        text/plain; version=0.0.4 のメトリクス
+    """
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 if __name__ == "__main__":
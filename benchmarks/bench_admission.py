@@ -0,0 +1,141 @@
+"""購入が集中したときの、同時実行数の制限の有無による処理時間の比較
+
+synthetic.py の合成シーズンに対して、--clients 個の /buy_ticket を同時に
+送り続けながら /admin/set_coins を1回ずつ送り、以下を計測する。
+503を受け取った購入は Retry-After の秒数だけ待ってから送り直す。
+制限なし (KEIMA_MAX_CONCURRENT=0) と、--max-concurrent の制限ありを比べる。
+
+- ok / 503: 受け付けた購入と、503で断った購入の数
+- ok/s: 1秒あたりに受け付けた購入の数
+- p50 / p99: 受け付けた購入の処理時間
+- admin: /admin/set_coins の処理時間の中央値
+
+実行例::
+
+    python benchmarks/bench_admission.py --clients 200 --max-concurrent 8
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from keima.backend.admission.limits import Admission
+from keima.backend.storage.factory import create_storage
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from synthetic import generate_season, team_names
+
+
+async def flood(
+    client: httpx.AsyncClient, names: list[str], game_id: int, args
+) -> tuple[list[float], int, list[float], float]:
+    """購入を送り続けながら管理者の操作を送り、処理時間を返す"""
+    ok_times: list[float] = []
+    admin_times: list[float] = []
+    rejected = 0
+    stop = False
+
+    async def buyer(i: int) -> None:
+        nonlocal rejected
+        while not stop:
+            tickets = [{"ticket_type": "win", "one": i % 4 + 1, "unit": 1}]
+            start = time.perf_counter()
+            response = await client.post(
+                "/buy_ticket",
+                json={
+                    "team_name": names[i % len(names)],
+                    "game_id": game_id,
+                    "tickets": tickets,
+                },
+            )
+            if response.status_code == 503:
+                rejected += 1
+                await asyncio.sleep(float(response.headers["Retry-After"]))
+            else:
+                ok_times.append(time.perf_counter() - start)
+
+    buyers = [asyncio.create_task(buyer(i)) for i in range(args.clients)]
+    start_all = time.perf_counter()
+    for i in range(args.admin):
+        await asyncio.sleep(0.01)
+        start = time.perf_counter()
+        response = await client.post(
+            "/admin/set_coins",
+            json={"team_name": names[i % len(names)], "coins": 10**9},
+        )
+        response.raise_for_status()
+        admin_times.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - start_all
+    stop = True
+    await asyncio.gather(*buyers)
+    return ok_times, rejected, admin_times, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--races", type=int, default=1)
+    parser.add_argument("--tickets", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--admin", type=int, default=50)
+    parser.add_argument("--max-concurrent", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        os.environ["KEIMA_DIR_PATH"] = dir_path
+        storage = create_storage(dir_path)
+        generate_season(storage, args.teams, args.races, args.tickets)
+        storage.close()
+        names = team_names(args.teams)
+        game_id = args.races
+
+        # KEIMA_DIR_PATH を設定した後に読み込む
+        import app.app as app_module
+
+        async def run(admission: Admission):
+            app_module.admission = admission
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://bench"
+            ) as client:
+                response = await client.post(
+                    "/admin/set_race_state",
+                    json={"game_id": game_id, "ticket_buy": True, "ticket_paid": False},
+                )
+                response.raise_for_status()
+                return await flood(client, names, game_id, args)
+
+        print(f"clients={args.clients} teams={args.teams}")
+        print(
+            f"{'max':>5} {'ok':>7} {'503':>7} {'ok/s':>7} {'p50[ms]':>8} {'p99[ms]':>8}"
+            f" {'admin[ms]':>10}"
+        )
+        for max_concurrent in [0, args.max_concurrent]:
+            admission = Admission(
+                max_concurrent=max_concurrent,
+                admin_reserved=max(1, max_concurrent // 8) if max_concurrent else 0,
+            )
+            ok_times, rejected, admin_times, elapsed = asyncio.run(run(admission))
+            p50, p99 = np.percentile(ok_times, [50, 99]) * 1000
+            admin = np.median(admin_times) * 1000
+            print(
+                f"{max_concurrent:>5} {len(ok_times):>7} {rejected:>7}"
+                f" {len(ok_times) / elapsed:>7.0f}"
+                f" {p50:>8.2f} {p99:>8.2f} {admin:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
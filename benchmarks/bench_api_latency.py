@@ -0,0 +1,182 @@
+"""APIの負荷試験
+
+多数のクライアントが同時に /get_race_state をポーリングしながら、
+一部のクライアントが /buy_ticket、/get_coins、/admin/set_coins を呼び出す状況で、
+エンドポイントごとのレイテンシ (p50/p99) を計測する。
+
+--url を省略すると、一時ディレクトリを KEIMA_DIR_PATH にして
+uvicorn を起動してから計測する。
+変更前のサーバーと比較するときは、そのサーバーを起動して --url で指定する。
+--server-cpus を指定すると、起動したサーバーをそのCPUに固定し、
+負荷をかける側を残りのCPUに固定する。
+
+実行例::
+
+    python benchmarks/bench_api_latency.py --clients 1000 --duration 10 --server-cpus 0
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+ROOT = Path(__file__).parent.parent
+
+
+async def client_loop(
+    client: httpx.AsyncClient,
+    client_id: int,
+    num_teams: int,
+    deadline: float,
+    latencies: dict[str, list[float]],
+    errors: dict[str, int],
+) -> None:
+    rng = random.Random(client_id)
+    team_name = f"team{client_id % num_teams}"
+    while time.perf_counter() < deadline:
+        r = rng.random()
+        if r < 0.80:
+            name, request = "get_race_state", client.get("/get_race_state")
+        elif r < 0.90:
+            name, request = (
+                "get_coins",
+                client.get("/get_coins", params={"team_name": team_name, "game_id": 0}),
+            )
+        elif r < 0.98:
+            name, request = (
+                "buy_ticket",
+                client.post(
+                    "/buy_ticket",
+                    json={
+                        "team_name": team_name,
+                        "game_id": 0,
+                        "tickets": [{"ticket_type": "win", "one": 1, "unit": 1}],
+                    },
+                ),
+            )
+        else:
+            name, request = (
+                "set_coins",
+                client.post(
+                    "/admin/set_coins",
+                    json={"team_name": team_name, "coins": 1000},
+                ),
+            )
+        start = time.perf_counter()
+        try:
+            response = await request
+            if response.status_code >= 400:
+                errors[name] += 1
+        except httpx.HTTPError:
+            errors[name] += 1
+            continue
+        latencies[name].append(time.perf_counter() - start)
+
+
+async def run(url: str, clients: int, teams: int, duration: float) -> None:
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        for i in range(teams):
+            await client.post(
+                "/admin/set_coins",
+                json={"team_name": f"team{i}", "coins": 1000, "game_id": 0},
+            )
+        await client.post(
+            "/admin/set_race_state",
+            json={"game_id": 0, "ticket_buy": True, "ticket_paid": False},
+        )
+
+        latencies: dict[str, list[float]] = defaultdict(list)
+        errors: dict[str, int] = defaultdict(int)
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(
+            *(
+                client_loop(client, i, teams, deadline, latencies, errors)
+                for i in range(clients)
+            )
+        )
+
+    print(f"{'endpoint':>16} {'count':>8} {'err':>6} {'p50[ms]':>9} {'p99[ms]':>9}")
+    for name in ["get_race_state", "get_coins", "buy_ticket", "set_coins"]:
+        values = np.array(latencies[name]) * 1000
+        if values.size == 0:
+            continue
+        p50, p99 = np.percentile(values, [50, 99])
+        print(f"{name:>16} {values.size:>8} {errors[name]:>6} {p50:>9.1f} {p99:>9.1f}")
+
+
+def wait_for_server(url: str, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(f"{url}/")
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not start: {url}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="計測するサーバーのURL")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--server-cpus",
+        type=lambda value: {int(cpu) for cpu in value.split(",")},
+        help="起動したサーバーを固定するCPU番号 (カンマ区切り)",
+    )
+    args = parser.parse_args()
+
+    server_cpus = args.server_cpus
+    if server_cpus is not None:
+        client_cpus = os.sched_getaffinity(0) - server_cpus
+        if not client_cpus:
+            parser.error("負荷をかける側に割り当てるCPUが残っていない")
+        os.sched_setaffinity(0, client_cpus)
+
+    if args.url:
+        asyncio.run(run(args.url, args.clients, args.teams, args.duration))
+        return
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        url = f"http://127.0.0.1:{args.port}"
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app.app:app",
+                "--port",
+                str(args.port),
+                "--log-level",
+                "warning",
+                "--backlog",
+                str(args.clients * 2),
+            ],
+            cwd=ROOT,
+            env={**os.environ, "KEIMA_DIR_PATH": dir_path},
+        )
+        if server_cpus is not None:
+            os.sched_setaffinity(server.pid, server_cpus)
+        try:
+            wait_for_server(url)
+            asyncio.run(run(url, args.clients, args.teams, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
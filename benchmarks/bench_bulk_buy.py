@@ -0,0 +1,107 @@
+"""1件ずつの購入と、まとめた購入の処理時間の比較
+
+N チームがそれぞれ1回ずつ購入するとき、以下の合計の処理時間を
+保存先 (csv, sqlite) ごとに計測する。
+
+- single: N 回の /buy_ticket
+- bulk: N 件をまとめた1回の /buy_tickets
+
+実行例::
+
+    python benchmarks/bench_bulk_buy.py --teams 500 --rounds 3
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from keima.backend.coins.cache import coin_cache
+from keima.backend.storage.factory import create_storage
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from synthetic import team_names
+
+
+def purchases(names: list[str], game_id: int) -> list[dict]:
+    """teamごとに1回分の購入リクエストを作る"""
+    return [
+        {
+            "team_name": team_name,
+            "game_id": game_id,
+            "tickets": [{"ticket_type": "win", "one": i % 4 + 1, "unit": 1}],
+        }
+        for i, team_name in enumerate(names)
+    ]
+
+
+async def bench(app_module, names: list[str], rounds: int) -> tuple[float, float]:
+    """1件ずつとまとめた購入の、1ラウンドあたりの処理時間 [ms]"""
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        single = bulk = 0.0
+        for game_id in range(rounds):
+            response = await client.post(
+                "/admin/set_race_state",
+                json={"game_id": game_id, "ticket_buy": True, "ticket_paid": False},
+            )
+            response.raise_for_status()
+            reqs = purchases(names, game_id)
+
+            start = time.perf_counter()
+            for req in reqs:
+                response = await client.post("/buy_ticket", json=req)
+                assert "purchased_tickets_coins" in response.json()
+            single += time.perf_counter() - start
+
+            start = time.perf_counter()
+            response = await client.post("/buy_tickets", json=reqs)
+            assert response.json()["accepted"] == len(reqs)
+            bulk += time.perf_counter() - start
+    return single / rounds * 1000, bulk / rounds * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--teams", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    names = team_names(args.teams)
+    print(f"teams={args.teams} rounds={args.rounds}")
+    print(f"{'storage':>8} {'single[ms]':>11} {'bulk[ms]':>9} {'ratio':>7}")
+    with tempfile.TemporaryDirectory() as root:
+        os.environ["KEIMA_DIR_PATH"] = root
+        # KEIMA_DIR_PATH を設定した後に読み込む
+        import app.app as app_module
+
+        for kind in ["csv", "sqlite"]:
+            os.environ["KEIMA_STORAGE"] = kind
+            dir_path = f"{root}/{kind}"
+            os.makedirs(dir_path)
+            coin_cache.clear()
+            storage = create_storage(dir_path)
+            storage.set_teams_coins({team_name: 10**6 for team_name in names})
+            # 保存先ごとに差し替える
+            app_module.storage = storage
+            try:
+                single, bulk = asyncio.run(bench(app_module, names, args.rounds))
+            finally:
+                storage.close()
+            print(f"{kind:>8} {single:>11.1f} {bulk:>9.1f} {single / bulk:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
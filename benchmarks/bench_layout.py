@@ -0,0 +1,75 @@
+"""flat と sharded のファイル配置の比較
+
+一時ディレクトリに N チーム × M レース分のチケットファイルと coin 設定ファイルを
+空のファイルとして作り、以下の1回あたりの処理時間を配置ごとに計測する。
+
+- game_ticket_paths: 1レースの全チームのチケットファイルを列挙する
+- stat: 1チームのcoin設定ファイルとチケットファイルを stat する
+
+実行例::
+
+    python benchmarks/bench_layout.py --teams 1000 --races 100
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from keima.backend.storage.layout import (
+    coins_path,
+    game_ticket_paths,
+    register_ticket_file,
+    ticket_path,
+)
+
+
+def create_files(dir_path: str, teams: int, races: int) -> None:
+    """現在の KEIMA_LAYOUT の配置で、空のファイルを作る"""
+    for i in range(teams):
+        team_name = f"team{i:05d}"
+        open(coins_path(team_name, dir_path, create=True), "w").close()
+        for game_id in range(races):
+            register_ticket_file(team_name, game_id, dir_path)
+            open(ticket_path(team_name, game_id, dir_path), "w").close()
+
+
+def time_per_call(func, repeat: int) -> float:
+    """func(i) の1回あたりの処理時間 [us]"""
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--teams", type=int, default=1000)
+    parser.add_argument("--races", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"teams={args.teams} races={args.races}")
+    print(f"{'layout':>8} {'list[ms]':>10} {'stat[us]':>10}")
+    for layout in ["flat", "sharded"]:
+        os.environ["KEIMA_LAYOUT"] = layout
+        with tempfile.TemporaryDirectory() as dir_path:
+            create_files(dir_path, args.teams, args.races)
+
+            def list_game(i: int, dir_path=dir_path) -> None:
+                assert len(game_ticket_paths(i % args.races, dir_path)) == args.teams
+
+            def stat_team(i: int, dir_path=dir_path) -> None:
+                team_name = f"team{i % args.teams:05d}"
+                os.stat(coins_path(team_name, dir_path))
+                os.stat(ticket_path(team_name, i % args.races, dir_path))
+
+            list_us = time_per_call(list_game, args.repeat)
+            stat_us = time_per_call(stat_team, args.repeat * 100)
+        print(f"{layout:>8} {list_us / 1000:>10.2f} {stat_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""メトリクスの記録による処理時間の増加
+
+synthetic.py の合成シーズンに対して、計測を有効にしたときと
+無効にしたとき (metrics.enabled = False、KEIMA_METRICS=0 と同じ) の
+1回あたりの処理時間の中央値を交互に計測して比べる。
+
+実行例::
+
+    python benchmarks/bench_metrics_overhead.py --repeat 2000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from keima.backend.metrics.metrics import metrics
+from keima.backend.reward.reward import Reward
+from keima.backend.storage.factory import create_storage
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from synthetic import generate_season, team_names
+
+
+def median_us(func, repeat: int) -> float:
+    """func(i) を repeat 回呼び出した処理時間の中央値 [us]"""
+    func(0)
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times) * 1e6)
+
+
+async def async_median_us(func, repeat: int) -> float:
+    """await func(i) を repeat 回呼び出した処理時間の中央値 [us]"""
+    await func(0)
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        await func(i)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times) * 1e6)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--teams", type=int, default=20)
+    parser.add_argument("--races", type=int, default=3)
+    parser.add_argument("--tickets", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        os.environ["KEIMA_DIR_PATH"] = dir_path
+        storage = create_storage(dir_path)
+        generate_season(storage, args.teams, args.races, args.tickets)
+        names = team_names(args.teams)
+        reward = Reward()
+        df = storage.load_tickets(names[0], 0)
+        result = storage.load_result(0)
+
+        # KEIMA_DIR_PATH を設定した後に読み込む
+        import app.app as app_module
+
+        async def bench_api(enabled: bool) -> float:
+            metrics.enabled = enabled
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://bench"
+            ) as client:
+                return await async_median_us(
+                    lambda i: client.get("/get_race_state"), args.repeat
+                )
+
+        cases = {
+            "get_team_coins": lambda i: storage.get_team_coins(names[i % len(names)]),
+            "load_result": lambda i: storage.load_result(i % args.races),
+            "reward_point": lambda i: reward.reward_point(df, result),
+        }
+        print(f"{'name':>16} {'off[us]':>9} {'on[us]':>9} {'diff[us]':>9}")
+        try:
+            for name, func in cases.items():
+                metrics.enabled = False
+                off = median_us(func, args.repeat)
+                metrics.enabled = True
+                on = median_us(func, args.repeat)
+                print(f"{name:>16} {off:>9.2f} {on:>9.2f} {on - off:>9.2f}")
+            off = asyncio.run(bench_api(False))
+            on = asyncio.run(bench_api(True))
+            print(f"{'api.race_state':>16} {off:>9.2f} {on:>9.2f} {on - off:>9.2f}")
+        finally:
+            metrics.enabled = True
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
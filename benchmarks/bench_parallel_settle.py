@@ -0,0 +1,96 @@
+"""チケットを読み直すレース精算の、プロセス数ごとの処理時間
+
+一時ディレクトリの CsvStorage に全チーム分のランダムなチケットを保存し、
+settle_tickets_parallel をワーカーの数を 1 から --max-workers まで変えて実行する。
+各精算の支払い・報酬が購入時の集計から精算する settle_tickets と
+一致することも確かめる。
+
+実行例::
+
+    python benchmarks/bench_parallel_settle.py --tickets 2000000 --teams 200
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from keima.backend.reward.reward import Reward
+from keima.backend.settlement.parallel import (
+    create_settle_executor,
+    settle_tickets_parallel,
+)
+from keima.backend.settlement.settle import settle_tickets
+from keima.backend.storage.csv_storage import CsvStorage
+from keima.backend.tickets.ticket_batch import TICKET_DTYPE, TicketBatch
+
+GAME_ID = 1
+RESULT = [2, 1, 3, 4]
+
+
+def make_batch(rng: np.random.Generator, size: int) -> TicketBatch:
+    """1チーム分のランダムなチケットを生成する"""
+    array = np.zeros(size, dtype=TICKET_DTYPE)
+    array["ticket_type"] = rng.integers(0, 3, size)
+    picks = np.argsort(rng.random((size, 4)), axis=1)[:, :3] + 1
+    array["one"] = picks[:, 0]
+    array["two"] = np.where(array["ticket_type"] >= 1, picks[:, 1], 0)
+    array["three"] = np.where(array["ticket_type"] == 2, picks[:, 2], 0)
+    array["unit"] = rng.integers(1, 5, size)
+    return TicketBatch(array)
+
+
+def scores(settlement: dict) -> dict:
+    """精算結果から支払いと報酬だけを取り出す"""
+    return {team: (s["paid"], s["reward"]) for team, s in settlement.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tickets", type=int, default=1_000_000)
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    reward = Reward()
+    with tempfile.TemporaryDirectory() as dir_path:
+        storage = CsvStorage(dir_path)
+        team_names = [f"team{i}" for i in range(args.teams)]
+        storage.set_teams_coins(dict.fromkeys(team_names, 10**9))
+        for team_name in team_names:
+            batch = make_batch(rng, args.tickets // args.teams)
+            storage.append_tickets(team_name, GAME_ID, batch)
+        storage.save_result(GAME_ID, RESULT)
+
+        start = time.perf_counter()
+        expected = scores(settle_tickets(GAME_ID, storage, reward))
+        pool_time = time.perf_counter() - start
+        print(f"tickets={args.tickets} teams={args.teams}")
+        print(f"settle_tickets (集計から): {pool_time * 1000:.1f}ms")
+
+        print(f"{'workers':>8} {'time[s]':>8} {'speedup':>8}")
+        baseline = None
+        for workers in range(1, args.max_workers + 1):
+            with create_settle_executor(workers) as executor:
+                # ワーカーの起動時間を含めないよう、先に全ワーカーを起動しておく
+                list(executor.map(abs, range(workers)))
+                start = time.perf_counter()
+                settlement = settle_tickets_parallel(
+                    GAME_ID,
+                    storage,
+                    reward,
+                    chunk_size=args.chunk_size,
+                    executor=executor,
+                )
+                elapsed = time.perf_counter() - start
+            assert scores(settlement) == expected
+            baseline = baseline or elapsed
+            print(f"{workers:>8} {elapsed:>8.2f} {baseline / elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Reward の精算ベンチマーク
+
+iterrows による従来実装と、ベクトル化した Reward.reward_point を
+チームごとに呼び出して比較する。
+
+実行例::
+
+    python benchmarks/bench_reward.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from keima.backend.reward.reward import Reward
+
+TICKET_TYPES = np.array(["win", "exacta", "trifecta"])
+
+
+def make_tickets(num_tickets: int, num_teams: int, seed: int = 0) -> pd.DataFrame:
+    """全チーム分のランダムなチケットDataFrameを生成する"""
+    rng = np.random.default_rng(seed)
+    picks = np.array([rng.permutation(4)[:3] + 1 for _ in range(24)])
+    chosen = picks[rng.integers(0, len(picks), num_tickets)]
+    ticket_type = TICKET_TYPES[rng.integers(0, 3, num_tickets)]
+    two = np.where(ticket_type == "win", np.nan, chosen[:, 1])
+    three = np.where(ticket_type == "trifecta", chosen[:, 2], np.nan)
+    return pd.DataFrame(
+        {
+            "team_name": [f"team{i}" for i in rng.integers(0, num_teams, num_tickets)],
+            "game_id": 1,
+            "ticket_type": ticket_type,
+            "unit": rng.integers(1, 5, num_tickets),
+            "one": chosen[:, 0],
+            "two": two,
+            "three": three,
+        }
+    )
+
+
+def legacy_reward_point(reward: Reward, df: pd.DataFrame, result: list[int]) -> int:
+    """ベクトル化前の iterrows による実装"""
+    single_tickets = df[df["ticket_type"] == "win"]
+    exacta_tickets = df[df["ticket_type"] == "exacta"]
+    trifecta_tickets = df[df["ticket_type"] == "trifecta"]
+
+    point = 0
+
+    for _, ticket in single_tickets.iterrows():
+        if ticket["one"] == result[0]:
+            point += reward.single_rate * ticket["unit"]
+
+    for _, ticket in exacta_tickets.iterrows():
+        if ticket["one"] == result[0] and ticket["two"] == result[1]:
+            point += reward.exacta_rate * ticket["unit"]
+
+    for _, ticket in trifecta_tickets.iterrows():
+        if (
+            ticket["one"] == result[0]
+            and ticket["two"] == result[1]
+            and ticket["three"] == result[2]
+        ):
+            point += reward.trifecta_rate * ticket["unit"]
+
+    return int(point)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--teams", type=int, default=1_000)
+    parser.add_argument(
+        "--legacy-max",
+        type=int,
+        default=1_000_000,
+        help="これより大きいサイズでは従来実装の計測を省略する",
+    )
+    args = parser.parse_args()
+
+    reward = Reward()
+    result = [2, 1, 3, 4]
+    print(f"{'tickets':>10} {'legacy[s]':>10} {'vector[s]':>10} {'speedup':>8}")
+    for size in args.sizes:
+        df = make_tickets(size, args.teams)
+
+        start = time.perf_counter()
+        batch = {
+            team: reward.reward_point(team_df, result, 1)
+            for team, team_df in df.groupby("team_name")
+        }
+        batch_time = time.perf_counter() - start
+
+        if size > args.legacy_max:
+            print(f"{size:>10} {'-':>10} {batch_time:>10.4f} {'-':>8}")
+            continue
+
+        start = time.perf_counter()
+        legacy = {
+            team: legacy_reward_point(reward, team_df, result)
+            for team, team_df in df.groupby("team_name")
+        }
+        legacy_time = time.perf_counter() - start
+
+        assert legacy == batch, "vectorized totals differ from legacy totals"
+        speedup = legacy_time / batch_time
+        print(f"{size:>10} {legacy_time:>10.4f} {batch_time:>10.4f} {speedup:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""/stream/race_state の配信遅延の計測
+
+多数のクライアントが /stream/race_state を購読している状態で
+/admin/set_race_state を呼び出し、各クライアントが新しい状態を受信するまでの
+時間 (p50/p99/max) を計測する。
+
+--url を省略すると、一時ディレクトリを KEIMA_DIR_PATH にして
+uvicorn を起動してから計測する。
+
+実行例::
+
+    python benchmarks/bench_stream_race_state.py --clients 1000 --rounds 5
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(Path(__file__).parent))
+
+from bench_api_latency import wait_for_server
+
+
+async def subscriber(
+    client: httpx.AsyncClient,
+    ready: asyncio.Event,
+    connected: list[int],
+    num_clients: int,
+    received: dict[int, list[float]],
+    rounds: int,
+) -> None:
+    async with client.stream("GET", "/stream/race_state") as response:
+        seen = 0
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            if seen == 0:
+                connected[0] += 1
+                if connected[0] == num_clients:
+                    ready.set()
+            else:
+                received[seen].append(time.perf_counter())
+            seen += 1
+            if seen > rounds:
+                return
+
+
+async def run(url: str, clients: int, rounds: int) -> None:
+    limits = httpx.Limits(max_connections=clients + 1)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        ready = asyncio.Event()
+        connected = [0]
+        received: dict[int, list[float]] = {i + 1: [] for i in range(rounds)}
+        tasks = [
+            asyncio.create_task(
+                subscriber(client, ready, connected, clients, received, rounds)
+            )
+            for _ in range(clients)
+        ]
+        await ready.wait()
+
+        sent = {}
+        for i in range(rounds):
+            sent[i + 1] = time.perf_counter()
+            await client.post(
+                "/admin/set_race_state",
+                json={"game_id": i + 1, "ticket_buy": True, "ticket_paid": False},
+            )
+            while len(received[i + 1]) < clients:
+                await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+
+    delays = np.concatenate(
+        [np.array(times) - sent[round_id] for round_id, times in received.items()]
+    )
+    p50, p99 = np.percentile(delays * 1000, [50, 99])
+    print(f"clients={clients} rounds={rounds}")
+    print(f"p50={p50:.1f}ms p99={p99:.1f}ms max={delays.max() * 1000:.1f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="計測するサーバーのURL")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.url:
+        asyncio.run(run(args.url, args.clients, args.rounds))
+        return
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        url = f"http://127.0.0.1:{args.port}"
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app.app:app",
+                "--port",
+                str(args.port),
+                "--log-level",
+                "warning",
+                "--backlog",
+                str(args.clients * 2),
+            ],
+            cwd=ROOT,
+            env={**os.environ, "KEIMA_DIR_PATH": dir_path},
+        )
+        try:
+            wait_for_server(url)
+            asyncio.run(run(url, args.clients, args.rounds))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
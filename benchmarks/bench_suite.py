@@ -0,0 +1,339 @@
+"""バックエンドとAPIの性能をまとめて計測する
+
+一時ディレクトリを KEIMA_DIR_PATH にして synthetic.py の合成シーズン
+(N チーム × M レース × K 枚) を書き込み、以下の1回あたりの処理時間を計測する。
+マシンの揺らぎを抑えるため、計測全体を --runs 回繰り返して各回の中央値をまとめる。
+
+- Storage の get_team_coins / set_team_coins / save_result / load_result
+- Reward.reward_point
+- FastAPI のエンドポイント (プロセス内のASGIクライアントから呼び出す)
+
+結果は --output のJSONに書き出す。--baseline のJSONがあれば中央値を比較し、
+1つでも --tolerance を超えて遅くなっていれば終了コード1で終わる。
+チーム数・レース数・チケット数・Storage が基準と異なるときは比較せずに
+終了コード1で終わる。--check を付けると、基準がないときも終了コード1で終わる。
+レース当日のマシンで --update-baseline を付けて実行し、基準を保存しておく。
+
+実行例::
+
+    python benchmarks/bench_suite.py --teams 100 --races 10 --tickets 100
+    python benchmarks/bench_suite.py --update-baseline
+    python benchmarks/bench_suite.py --check
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from keima.backend.reward.reward import Reward
+from keima.backend.storage.base import Storage
+from keima.backend.storage.factory import create_storage
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from synthetic import generate_season, random_result, team_names
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+# 基準と一致しなければ比較できない計測条件
+COMPARABLE_META = ["storage", "teams", "races", "tickets"]
+
+
+def summarize(times: list[float]) -> dict:
+    """1回ごとの処理時間 [秒] から、回数と中央値・p99 [us] を求める"""
+    values = np.array(times) * 1e6
+    p50, p99 = np.percentile(values, [50, 99])
+    return {"calls": len(times), "median_us": round(p50, 2), "p99_us": round(p99, 2)}
+
+
+def time_calls(func: Callable[[int], object], repeat: int) -> dict:
+    """func(i) を repeat 回呼び出して処理時間をまとめる"""
+    func(0)
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+async def time_async_calls(
+    func: Callable[[int], Awaitable[httpx.Response]], repeat: int
+) -> dict:
+    """await func(i) を repeat 回呼び出して処理時間をまとめる"""
+    (await func(0)).raise_for_status()
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        response = await func(i)
+        times.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return summarize(times)
+
+
+def bench_backend(storage: Storage, args: argparse.Namespace) -> dict[str, dict]:
+    """Storage と Reward の処理時間を計測する"""
+    names = team_names(args.teams)
+    rng = np.random.default_rng(1)
+    reward = Reward()
+    game_id = args.races - 1
+    df = storage.load_tickets(names[0], game_id)
+    result = storage.load_result(game_id)
+
+    def team(i: int) -> str:
+        return names[i % len(names)]
+
+    return {
+        "storage.get_team_coins": time_calls(
+            lambda i: storage.get_team_coins(team(i)), args.repeat
+        ),
+        "storage.set_team_coins": time_calls(
+            lambda i: storage.set_team_coins(team(i), 10**9), args.repeat
+        ),
+        "storage.save_result": time_calls(
+            lambda i: storage.save_result(args.races + i + 1, random_result(rng)),
+            args.repeat,
+        ),
+        "storage.load_result": time_calls(
+            lambda i: storage.load_result(i % args.races), args.repeat
+        ),
+        "reward.reward_point": time_calls(
+            lambda i: reward.reward_point(df, result), args.repeat
+        ),
+    }
+
+
+async def bench_api(args: argparse.Namespace) -> dict[str, dict]:
+    """プロセス内のASGIクライアントから、エンドポイントの処理時間を計測する"""
+    # KEIMA_DIR_PATH を設定した後に読み込む
+    import app.app as app_module
+
+    names = team_names(args.teams)
+    game_id = args.races
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        response = await client.post(
+            "/admin/set_race_state",
+            json={"game_id": game_id, "ticket_buy": True, "ticket_paid": False},
+        )
+        response.raise_for_status()
+
+        def team(i: int) -> str:
+            return names[i % len(names)]
+
+        def buy(i: int) -> Awaitable[httpx.Response]:
+            tickets = [{"ticket_type": "win", "one": i % 4 + 1, "unit": 1}]
+            return client.post(
+                "/buy_ticket",
+                json={"team_name": team(i), "game_id": game_id, "tickets": tickets},
+            )
+
+        return {
+            "api.get_race_state": await time_async_calls(
+                lambda i: client.get("/get_race_state"), args.repeat
+            ),
+            "api.get_coins": await time_async_calls(
+                lambda i: client.get(
+                    "/get_coins", params={"team_name": team(i), "game_id": game_id}
+                ),
+                args.repeat,
+            ),
+            "api.set_coins": await time_async_calls(
+                lambda i: client.post(
+                    "/admin/set_coins",
+                    json={"team_name": team(i), "coins": 10**9},
+                ),
+                args.repeat,
+            ),
+            "api.buy_ticket": await time_async_calls(buy, args.repeat),
+            "api.get_odds": await time_async_calls(
+                lambda i: client.get("/get_odds", params={"game_id": game_id}),
+                args.repeat,
+            ),
+        }
+
+
+def merge_runs(runs: list[dict[str, dict]]) -> dict[str, dict]:
+    """計測全体を繰り返した結果を、計測ごとに各回の中央値でまとめる
+
+    Parameters
+    ----------
+    runs : list[dict[str, dict]]
+        1回ごとの計測結果
+
+    Returns
+    -------
+    dict[str, dict]
+        計測ごとの合計の回数と、各回の中央値・p99 の中央値
+    """
+    return {
+        name: {
+            "calls": sum(run[name]["calls"] for run in runs),
+            "median_us": round(
+                float(np.median([r[name]["median_us"] for r in runs])), 2
+            ),
+            "p99_us": round(float(np.median([r[name]["p99_us"] for r in runs])), 2),
+        }
+        for name in runs[0]
+    }
+
+
+def meta_mismatches(meta: dict, baseline_meta: dict) -> list[str]:
+    """基準と異なる計測条件の説明のリストを返す
+
+    Parameters
+    ----------
+    meta : dict
+        今回の計測条件
+    baseline_meta : dict
+        基準の計測条件
+
+    Returns
+    -------
+    list[str]
+        COMPARABLE_META のうち、基準と異なる条件ごとの説明
+    """
+    return [
+        f"{key}: {meta.get(key)!r} != baseline {baseline_meta.get(key)!r}"
+        for key in COMPARABLE_META
+        if meta.get(key) != baseline_meta.get(key)
+    ]
+
+
+def compare(
+    results: dict[str, dict], baseline: dict[str, dict], tolerance: float
+) -> list[str]:
+    """基準より tolerance を超えて遅くなった計測の説明のリストを返す
+
+    Parameters
+    ----------
+    results : dict[str, dict]
+        今回の計測結果
+    baseline : dict[str, dict]
+        基準の計測結果
+    tolerance : float
+        許容する中央値の増加の割合
+
+    Returns
+    -------
+    list[str]
+        遅くなった計測ごとの説明。基準にない計測は比較しない
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        limit = base["median_us"] * (1 + tolerance)
+        if current["median_us"] > limit:
+            regressions.append(
+                f"{name}: {current['median_us']:.1f}us > "
+                f"{base['median_us']:.1f}us * {1 + tolerance:.2f}"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--races", type=int, default=10)
+    parser.add_argument("--tickets", type=int, default=100)
+    parser.add_argument(
+        "--repeat", type=int, default=200, help="計測ごとの呼び出し回数"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="計測全体を繰り返す回数")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="許容する中央値の増加の割合"
+    )
+    parser.add_argument(
+        "--update-baseline", action="store_true", help="今回の結果を基準として保存する"
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="基準がなければ終了コード1で終わる"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        os.environ["KEIMA_DIR_PATH"] = dir_path
+        storage = create_storage(dir_path)
+        start = time.perf_counter()
+        generate_season(storage, args.teams, args.races, args.tickets)
+        generate_time = time.perf_counter() - start
+        try:
+            runs = []
+            for _ in range(args.runs):
+                run = bench_backend(storage, args)
+                run |= asyncio.run(bench_api(args))
+                runs.append(run)
+        finally:
+            storage.close()
+
+    results = merge_runs(runs)
+    report = {
+        "meta": {
+            "timestamp": datetime.now(UTC).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "storage": os.getenv("KEIMA_STORAGE", "csv"),
+            "teams": args.teams,
+            "races": args.races,
+            "tickets": args.tickets,
+            "runs": args.runs,
+            "generate_s": round(generate_time, 3),
+        },
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+    print(f"{'name':>24} {'calls':>6} {'p50[us]':>10} {'p99[us]':>10}")
+    for name, summary in results.items():
+        print(
+            f"{name:>24} {summary['calls']:>6} "
+            f"{summary['median_us']:>10.1f} {summary['p99_us']:>10.1f}"
+        )
+    print(f"results: {args.output}")
+
+    if args.update_baseline:
+        Path(args.baseline).write_text(json.dumps(report, indent=2) + "\n")
+        print(f"baseline updated: {args.baseline}")
+        return
+    if not Path(args.baseline).exists():
+        print(f"WARNING baseline not found: {args.baseline}", file=sys.stderr)
+        if args.check:
+            sys.exit(1)
+        return
+    baseline = json.loads(Path(args.baseline).read_text())
+    mismatches = meta_mismatches(report["meta"], baseline["meta"])
+    for mismatch in mismatches:
+        print(f"META MISMATCH {mismatch}", file=sys.stderr)
+    if mismatches:
+        sys.exit(1)
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"no regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
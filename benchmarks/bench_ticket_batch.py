@@ -0,0 +1,79 @@
+"""/buy_ticket 1回分のチケット変換のベンチマーク
+
+TicketInfo のリストを model_dump() で DataFrame にしてから unit の合計と
+CSVの行を求める従来の方法と、TicketBatch を使う方法で、
+1リクエストあたりの処理時間とチケット1枚あたりのメモリを比較する。
+
+実行例::
+
+    python benchmarks/bench_ticket_batch.py --sizes 1 10 100 1000
+"""
+
+import argparse
+import csv
+import io
+import timeit
+
+import pandas as pd
+
+from keima.backend.app_class.app_class import TicketInfo
+from keima.backend.tickets.ticket_batch import TicketBatch
+
+
+def make_tickets(num_tickets: int) -> list[TicketInfo]:
+    """win, exacta, trifecta を順に並べたチケットを生成する"""
+    templates = [
+        {"ticket_type": "win", "one": 1},
+        {"ticket_type": "exacta", "one": 1, "two": 2},
+        {"ticket_type": "trifecta", "one": 1, "two": 2, "three": 3},
+    ]
+    return [TicketInfo(**templates[i % 3], unit=i % 5 + 1) for i in range(num_tickets)]
+
+
+def with_dataframe(tickets: list[TicketInfo]) -> int:
+    """変更前の /buy_ticket と同じく DataFrame を経由する"""
+    ticket_df = pd.DataFrame([t.model_dump() for t in tickets])
+    num_coins = ticket_df["unit"].sum()
+    ticket_df.to_csv(io.StringIO(), index=False, header=False)
+    return int(num_coins)
+
+
+def with_batch(tickets: list[TicketInfo]) -> int:
+    batch = TicketBatch.from_tickets(tickets)
+    csv.writer(io.StringIO(), lineterminator="\n").writerows(batch.records())
+    return batch.units
+
+
+def measure(func, tickets: list[TicketInfo]) -> float:
+    """1回あたりの実行時間 [us] を返す"""
+    timer = timeit.Timer(lambda: func(tickets))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    args = parser.parse_args()
+
+    print(
+        f"{'tickets':>8} {'df[us]':>10} {'batch[us]':>10} {'speedup':>8} "
+        f"{'df[B/t]':>8} {'batch[B/t]':>10}"
+    )
+    for size in args.sizes:
+        tickets = make_tickets(size)
+        assert with_dataframe(tickets) == with_batch(tickets)
+
+        df_time = measure(with_dataframe, tickets)
+        batch_time = measure(with_batch, tickets)
+        ticket_df = pd.DataFrame([t.model_dump() for t in tickets])
+        df_bytes = ticket_df.memory_usage(index=False, deep=True).sum() / size
+        batch_bytes = TicketBatch.from_tickets(tickets).array.nbytes / size
+        print(
+            f"{size:>8} {df_time:>10.1f} {batch_time:>10.1f} "
+            f"{df_time / batch_time:>7.1f}x {df_bytes:>8.1f} {batch_bytes:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""チェックポイントからの起動と、ファイルを読み直す起動の比較
+
+synthetic.py の合成シーズンを一時ディレクトリの CsvStorage に書き込み、
+全チームのcoinと最後のレースの購入済みunitを参照した状態でチェックポイントを
+書き出す。その後メモリ上の状態を捨て、以下の時間を計測する。
+
+- cold: 全チームのcoinと購入済みunitを、ファイルを読んで参照し直す
+- warm: チェックポイントを読み込んでから、同じ参照をする
+
+実行例::
+
+    python benchmarks/bench_warm_start.py --teams 1000 --races 10 --tickets 100
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from keima.backend.checkpoint.checkpoint import CHECKPOINT_FILE, Checkpointer
+from keima.backend.coins.cache import coin_cache
+from keima.backend.race_result import result_store
+from keima.backend.storage.csv_storage import CsvStorage
+from keima.backend.tickets.reserved import reserved_units
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from synthetic import generate_season, team_names
+
+
+def touch_all(storage: CsvStorage, names: list[str], game_id: int) -> None:
+    """全チームのcoinと購入済みunit、レース結果を参照する"""
+    for team_name in names:
+        storage.get_team_coins(team_name)
+        storage.get_reserved_coins(team_name, game_id)
+    storage.load_result(game_id)
+
+
+def drop_memory() -> None:
+    """プロセスの再起動と同じく、メモリ上の状態を捨てる"""
+    coin_cache.clear()
+    reserved_units.clear()
+    result_store._stores.clear()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--teams", type=int, default=1000)
+    parser.add_argument("--races", type=int, default=10)
+    parser.add_argument("--tickets", type=int, default=100)
+    args = parser.parse_args()
+
+    names = team_names(args.teams)
+    game_id = args.races - 1
+    # 全チームをキャッシュに載せる
+    coin_cache.maxsize = max(coin_cache.maxsize, args.teams)
+    with tempfile.TemporaryDirectory() as dir_path:
+        storage = CsvStorage(dir_path)
+        generate_season(storage, args.teams, args.races, args.tickets)
+        checkpointer = Checkpointer(f"{dir_path}/{CHECKPOINT_FILE}", dir_path)
+
+        drop_memory()
+        start = time.perf_counter()
+        touch_all(storage, names, game_id)
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        size = checkpointer.save()
+        save_time = time.perf_counter() - start
+
+        drop_memory()
+        start = time.perf_counter()
+        stats = checkpointer.restore()
+        touch_all(storage, names, game_id)
+        warm = time.perf_counter() - start
+
+    print(f"teams={args.teams} races={args.races} tickets={args.tickets}")
+    print(f"checkpoint: {size / 1024:.1f}KiB, save {save_time * 1000:.1f}ms, {stats}")
+    print(f"cold: {cold * 1000:.1f}ms")
+    print(f"warm: {warm * 1000:.1f}ms ({cold / warm:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""ベンチマーク用の合成データ
+
+N チーム × M レース × K 枚のチケットを持つシーズンを、
+KEIMA_STORAGE に応じた保存先に書き込む。
+
+実行例::
+
+    python benchmarks/synthetic.py /tmp/keima --teams 100 --races 10 --tickets 100
+"""
+
+import argparse
+
+import numpy as np
+
+from keima.backend.storage.base import Storage
+from keima.backend.storage.factory import create_storage
+from keima.backend.tickets.ticket_batch import TICKET_DTYPE, TicketBatch
+
+INITIAL_COINS = 10**9
+NUM_PLAYERS = 4
+
+
+def team_names(num_teams: int) -> list[str]:
+    """合成データのteamの名前のリストを返す"""
+    return [f"team{i:04d}" for i in range(num_teams)]
+
+
+def random_tickets(rng: np.random.Generator, size: int) -> TicketBatch:
+    """win, exacta, trifecta がランダムに混ざったチケットを生成する
+
+    Parameters
+    ----------
+    rng : np.random.Generator
+        乱数生成器
+    size : int
+        チケットの枚数
+
+    Returns
+    -------
+    TicketBatch
+        生成したチケット
+    """
+    array = np.zeros(size, dtype=TICKET_DTYPE)
+    array["ticket_type"] = rng.integers(0, 3, size)
+    picks = np.argsort(rng.random((size, NUM_PLAYERS)), axis=1)[:, :3] + 1
+    array["one"] = picks[:, 0]
+    array["two"] = np.where(array["ticket_type"] >= 1, picks[:, 1], 0)
+    array["three"] = np.where(array["ticket_type"] == 2, picks[:, 2], 0)
+    array["unit"] = rng.integers(1, 5, size)
+    return TicketBatch(array)
+
+
+def random_result(rng: np.random.Generator) -> list[int]:
+    """ランダムなレース結果を生成する"""
+    return [int(player) for player in rng.permutation(NUM_PLAYERS) + 1]
+
+
+def generate_season(
+    storage: Storage, teams: int, races: int, tickets: int, seed: int = 0
+) -> None:
+    """合成したシーズンを保存先に書き込む
+
+    全チームのcoinを INITIAL_COINS にし、レース 0 から races - 1 まで
+    各チームが tickets 枚ずつ購入し、レース結果を保存する。
+
+    Parameters
+    ----------
+    storage : Storage
+        書き込む保存先
+    teams : int
+        チームの数
+    races : int
+        レースの数
+    tickets : int
+        1チーム1レースあたりのチケットの枚数
+    seed : int, optional
+        乱数のシード, by default 0
+    """
+    rng = np.random.default_rng(seed)
+    names = team_names(teams)
+    storage.set_teams_coins(dict.fromkeys(names, INITIAL_COINS), 0)
+    for game_id in range(races):
+        for team_name in names:
+            storage.append_tickets(team_name, game_id, random_tickets(rng, tickets))
+        storage.save_result(game_id, random_result(rng))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("dir_path", help="書き込むディレクトリ (KEIMA_DIR_PATH)")
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--races", type=int, default=10)
+    parser.add_argument("--tickets", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    storage = create_storage(args.dir_path)
+    try:
+        generate_season(storage, args.teams, args.races, args.tickets, args.seed)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from keima.backend.metrics.metrics import metrics
+
+admission_rejected = metrics.counter(
+    "keima_admission_rejected_total",
+    "Requests rejected by rate limits (429) or the concurrency cap (503).",
+    ("endpoint", "reason"),
+)
+storage_slots_in_use = metrics.gauge(
+    "keima_storage_slots_in_use", "Requests holding a storage slot."
+)
+
+
+class TokenBucket:
+    """キーごとのトークンバケットによるレート制限
+
+    キーごとに最大 burst 個のトークンを持ち、1秒に rate 個ずつ補充する。
+    1回のリクエストでトークンを1個使い、足りないときは拒否する。
+    キーの数は max_keys までとし、最後に使ったのが古いキーから捨てる
+    (捨てたキーは次のリクエストで満杯のバケットから始まる)。
+
+    Parameters
+    ----------
+    rate : float
+        1秒あたりに補充するトークンの数
+    burst : float
+        バケットに入るトークンの数の上限
+    max_keys : int, optional
+        記録するキーの数の上限, by default 100000
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000) -> None:
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Invalid rate limit: {rate}/{burst}")
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # キー -> (トークンの数, 最後に補充した時刻)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> float:
+        """キーのトークンを1個使う
+
+        Parameters
+        ----------
+        key : str
+            レート制限の単位 (team_name など)
+
+        Returns
+        -------
+        float
+            使えたときは0。足りないときはトークンが1個たまるまでの秒数
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class Admission:
+    """エンドポイントごとのレート制限と、ストレージを使う処理の同時実行数の制限
+
+    レート制限は rate_limits に指定したエンドポイントだけに、teamごと
+    (teamのないエンドポイントはクライアントごと) にかける。
+    同時実行数は max_concurrent までとし、そのうち admin_reserved 個は
+    /admin/* のリクエストだけが使える。どちらも超えたときは待たずに拒否する。
+    イベントループのスレッドから呼ぶ。
+
+    Parameters
+    ----------
+    rate_limits : dict[str, tuple[float, float]] | None, optional
+        エンドポイントの名前と (1秒あたりのリクエスト数, バースト) の辞書,
+        by default None
+    max_concurrent : int, optional
+        ストレージを使う処理の同時実行数の上限。0のときは制限しない,
+        by default 0
+    admin_reserved : int, optional
+        max_concurrent のうち /admin/* のために空けておく数, by default 0
+    """
+
+    def __init__(
+        self,
+        rate_limits: dict[str, tuple[float, float]] | None = None,
+        max_concurrent: int = 0,
+        admin_reserved: int = 0,
+    ) -> None:
+        if max_concurrent > 0 and not 0 <= admin_reserved < max_concurrent:
+            raise ValueError(
+                f"Invalid admin reserved slots: {admin_reserved}/{max_concurrent}"
+            )
+        self.buckets = {
+            endpoint: TokenBucket(rate, burst)
+            for endpoint, (rate, burst) in (rate_limits or {}).items()
+        }
+        self.max_concurrent = max_concurrent
+        self.admin_reserved = admin_reserved
+        self.in_use = 0
+
+    def check_rate(self, endpoint: str, key: str) -> int:
+        """エンドポイントのレート制限を確かめる
+
+        Parameters
+        ----------
+        endpoint : str
+            エンドポイントの名前
+        key : str
+            レート制限の単位 (team_name やクライアントのアドレス)
+
+        Returns
+        -------
+        int
+            受け付けるときは0。拒否するときは Retry-After の秒数 (1以上)
+        """
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            return 0
+        wait = bucket.acquire(key)
+        if wait == 0:
+            return 0
+        admission_rejected.inc(endpoint, "rate")
+        return max(1, math.ceil(wait))
+
+    def acquire(self, endpoint: str, admin: bool = False) -> bool:
+        """ストレージを使う処理の枠を1つ使う。使えたときは release で返す
+
+        Parameters
+        ----------
+        endpoint : str
+            エンドポイントの名前 (メトリクスのラベル)
+        admin : bool, optional
+            /admin/* のリクエストかどうか, by default False
+
+        Returns
+        -------
+        bool
+            枠を使えたかどうか
+        """
+        if self.max_concurrent > 0:
+            limit = self.max_concurrent - (0 if admin else self.admin_reserved)
+            if self.in_use >= limit:
+                admission_rejected.inc(endpoint, "overload")
+                return False
+        self.in_use += 1
+        storage_slots_in_use.set(self.in_use)
+        return True
+
+    def release(self) -> None:
+        """acquire で使った枠を返す"""
+        self.in_use -= 1
+        storage_slots_in_use.set(self.in_use)
+
+    @classmethod
+    def from_env(cls) -> "Admission":
+        """環境変数から作る
+
+        - KEIMA_RATE_LIMITS: "endpoint=rate/burst" のカンマ区切り
+          (例: "buy_ticket=10/20,get_coins=20/40")。burst を省略すると rate と同じ
+        - KEIMA_MAX_CONCURRENT: ストレージを使う処理の同時実行数の上限 (0は無制限)
+        - KEIMA_ADMIN_RESERVED: そのうち /admin/* のために空けておく数
+
+        Returns
+        -------
+        Admission
+            環境変数の設定の Admission
+        """
+        rate_limits = {}
+        for item in os.getenv("KEIMA_RATE_LIMITS", "").split(","):
+            if not item.strip():
+                continue
+            endpoint, limit = item.split("=")
+            rate, _, burst = limit.partition("/")
+            rate_limits[endpoint.strip()] = (float(rate), float(burst or rate))
+        return cls(
+            rate_limits,
+            int(os.getenv("KEIMA_MAX_CONCURRENT", "256")),
+            int(os.getenv("KEIMA_ADMIN_RESERVED", "16")),
+        )
@@ -1,16 +1,33 @@
+import os
 from typing import Literal
 
-from pydantic import BaseModel
+import numpy as np
+from pydantic import BaseModel, Field, field_validator
+
+# TicketBatch の unit 列 (int32) に入る最大の口数
+MAX_UNIT = int(np.iinfo(np.int32).max)
 
 
 class TicketInfo(BaseModel):
-    """チケット情報"""
+    """チケット情報
+
+    選手番号は1から KEIMA_NUM_PLAYERS まで、口数は1から MAX_UNIT までとし、
+    範囲外のリクエストは422で断る。
+    """
 
     ticket_type: Literal["win", "exacta", "trifecta"]
     one: int
     two: int | None = None
     three: int | None = None
-    unit: int = 1
+    unit: int = Field(default=1, gt=0, le=MAX_UNIT)
+
+    @field_validator("one", "two", "three")
+    @classmethod
+    def check_player(cls, player: int | None) -> int | None:
+        KEIMA_NUM_PLAYERS = int(os.getenv("KEIMA_NUM_PLAYERS", "4"))
+        if player is not None and not 1 <= player <= KEIMA_NUM_PLAYERS:
+            raise ValueError(f"player must be between 1 and {KEIMA_NUM_PLAYERS}")
+        return player
 
 
 class BuyTicketRequest(BaseModel):
@@ -81,7 +98,89 @@ class SetCoinsRequest(BaseModel):
 
 
 class RaceStateService:
-    """レースの状態"""
+    """レースの状態
+
+    状態はレース (game_id) ごとに持ち、複数のレースを同時に進行できる。
+    最後に更新したレースを現在のレースとし、game_id を指定しない
+    エンドポイントはこのレースを対象にする。
+    状態はプロセスのメモリ上に持つ。
+    uvicorn を複数ワーカーで動かすときは、全ワーカーで状態を共有する
+    SqliteRaceStateService を使う。
+    """
 
     def __init__(self):
         self.race_state = RaceState()
+        self.races = {self.race_state.game_id: self.race_state}
+        self.version = 0
+
+    def load(self) -> tuple[RaceState, int]:
+        """現在のレースの状態とversionを返す
+
+        Returns
+        -------
+        tuple[RaceState, int]
+            現在のレースの状態と、update のたびに1増える番号
+        """
+        return self.race_state, self.version
+
+    def get(self, game_id: int) -> RaceState | None:
+        """レースの状態を返す
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        RaceState | None
+            レースの状態。一度も設定されていないレースはNone
+        """
+        return self.races.get(game_id)
+
+    def open_races(self) -> list[int]:
+        """チケット購入受付中のレース番号のリストを返す
+
+        Returns
+        -------
+        list[int]
+            ticket_buy が True のレース番号のリスト
+        """
+        return [game_id for game_id, race in self.races.items() if race.ticket_buy]
+
+    def update(self, race_state: RaceState) -> RaceState:
+        """レースの状態を更新し、現在のレースにする
+
+        Parameters
+        ----------
+        race_state : RaceState
+            新しいレースの状態
+
+        Returns
+        -------
+        RaceState
+            同じレースの更新前の状態。初めて設定するレースは初期状態
+        """
+        previous = self.races.get(
+            race_state.game_id, RaceState(game_id=race_state.game_id)
+        )
+        self.races[race_state.game_id] = race_state
+        self.race_state = race_state
+        self.version += 1
+        return previous
+
+    def restore(self, races: dict[int, RaceState], game_id: int, version: int) -> None:
+        """チェックポイントから全レースの状態を読み込む
+
+        Parameters
+        ----------
+        races : dict[int, RaceState]
+            レース番号とレースの状態の辞書
+        game_id : int
+            現在のレース番号
+        version : int
+            チェックポイント作成時のversion
+        """
+        self.races = dict(races)
+        self.race_state = self.races.setdefault(game_id, RaceState(game_id=game_id))
+        self.version = version
@@ -0,0 +1,103 @@
+import asyncio
+
+# 追い出された購読者のキューに入れる値
+EVICTED = None
+
+
+class Broadcaster:
+    """1つのメッセージを多数の購読者に配信する
+
+    購読者ごとに上限付きのキューを持ち、publish はキューに入れるだけで
+    購読者の受信を待たない。キューが一杯になった (受信が追いつかない) 購読者は
+    キューを空にして EVICTED を入れ、購読から外す。
+    購読者は EVICTED を受け取ったら接続を閉じ、再接続して最新の状態を取り直す。
+
+    メッセージには単調増加する version を付け、publish 済みの version 以下の
+    メッセージは配信しない。同じ変更を複数の経路から publish しても1回だけ届く。
+
+    Parameters
+    ----------
+    queue_size : int, optional
+        購読者ごとのキューの上限, by default 16
+    """
+
+    def __init__(self, queue_size: int = 16) -> None:
+        self.queue_size = queue_size
+        self.version = -1
+        self.evicted = 0
+        self._subscribers: set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        """購読を始める
+
+        Returns
+        -------
+        asyncio.Queue
+            (version, メッセージ) または EVICTED が入るキュー
+        """
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """購読をやめる
+
+        Parameters
+        ----------
+        queue : asyncio.Queue
+            subscribe の戻り値
+        """
+        self._subscribers.discard(queue)
+
+    def publish(self, version: int, message: str) -> None:
+        """全購読者にメッセージを配信する
+
+        Parameters
+        ----------
+        version : int
+            メッセージのversion
+        message : str
+            配信するメッセージ。購読者ごとに作り直さないよう、送信する形式にしておく
+        """
+        if version <= self.version:
+            return
+        self.version = version
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait((version, message))
+            except asyncio.QueueFull:
+                self._evict(queue)
+
+    @property
+    def subscribers(self) -> int:
+        """購読者の数"""
+        return len(self._subscribers)
+
+    def _evict(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(EVICTED)
+        self.evicted += 1
+
+
+def format_event(event: str, data: str, event_id: int | None = None) -> str:
+    """Server-Sent Events の1イベントの文字列を返す
+
+    Parameters
+    ----------
+    event : str
+        イベント名
+    data : str
+        データ。改行を含まないこと
+    event_id : int | None, optional
+        イベントID, by default None
+
+    Returns
+    -------
+    str
+        送信する文字列
+    """
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines += [f"event: {event}", f"data: {data}"]
+    return "\n".join(lines) + "\n\n"
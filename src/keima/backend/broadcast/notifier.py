@@ -0,0 +1,88 @@
+import asyncio
+import contextlib
+from collections.abc import Awaitable, Callable
+
+
+class ChangeNotifier:
+    """キーごとの変更を、変更を待っている処理に知らせる
+
+    ロングポーリングで、このプロセスでの書き込みをすぐに返すために使う。
+    他のプロセスでの書き込みは知らせられないため、待つ側は定期的に
+    変更の有無を確かめ直す (long_poll の recheck)。
+    """
+
+    def __init__(self) -> None:
+        self._events: dict[str, asyncio.Event] = {}
+
+    def watch(self, key: str) -> asyncio.Event:
+        """次にkeyが変更されたときにセットされる Event を返す
+
+        変更を見逃さないよう、現在の値を読む前に呼ぶ。
+
+        Parameters
+        ----------
+        key : str
+            待つキー
+
+        Returns
+        -------
+        asyncio.Event
+            keyの変更が知らされるとセットされる Event
+        """
+        return self._events.setdefault(key, asyncio.Event())
+
+    def notify(self, key: str) -> None:
+        """keyを待っている処理を起こす
+
+        Parameters
+        ----------
+        key : str
+            変更されたキー
+        """
+        event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+
+async def long_poll(
+    notifier: ChangeNotifier,
+    key: str,
+    etag: str | None,
+    load_etag: Callable[[], Awaitable[str | None]],
+    wait: float,
+    recheck: float = 1.0,
+) -> str | None:
+    """ETagがetagから変わるまで最大wait秒待ち、最新のETagを返す
+
+    notifierで知らされたときと、recheck秒ごとにETagを読み直す。
+
+    Parameters
+    ----------
+    notifier : ChangeNotifier
+        変更を知らせる ChangeNotifier
+    key : str
+        notifierのキー
+    etag : str | None
+        クライアントが持っているETag
+    load_etag : Callable[[], Awaitable[str | None]]
+        最新のETagを返す関数
+    wait : float
+        最大の待ち時間 [秒]
+    recheck : float, optional
+        知らせがなくてもETagを読み直す間隔 [秒], by default 1.0
+
+    Returns
+    -------
+    str | None
+        最新のETag。待っている間に変わらなければetag
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        event = notifier.watch(key)
+        current = await load_etag()
+        remaining = deadline - loop.time()
+        if current != etag or remaining <= 0:
+            return current
+        with contextlib.suppress(TimeoutError):
+            await asyncio.wait_for(event.wait(), min(remaining, recheck))
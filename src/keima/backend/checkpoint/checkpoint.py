@@ -0,0 +1,320 @@
+import base64
+import csv
+import io
+import json
+import os
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from keima.backend.app_class.app_class import RaceState, RaceStateService
+from keima.backend.coins.cache import CoinCacheEntry, coin_cache
+from keima.backend.coins.get_coins import read_coins
+from keima.backend.coins.ledger import fsync_path
+from keima.backend.race_result.result_store import get_result_store
+from keima.backend.tickets.reserved import reserved_units
+
+CHECKPOINT_FILE = "checkpoint.bin"
+# チェックポイントのファイルの先頭。形式を変えたら番号を上げる
+MAGIC = b"KEIMACP2"
+# 追記前の内容が変わっていないことを確かめるために記録する、末尾のバイト数
+TAIL_BYTES = 32
+
+# (レース番号と (ticket_buy, ticket_paid) の辞書, 現在のレース番号, version)
+RaceSnapshot = tuple[dict[int, tuple[bool, bool]], int, int]
+
+
+class Checkpointer:
+    """メモリ上の状態のチェックポイント
+
+    以下をまとめて1つのファイルに書き出し、再起動時に読み込む。
+    ファイルは MAGIC と本文のCRC32に続けて、本文をJSONで書く。
+
+    - 全レースの状態 (RaceStateService がメモリ上に持つとき)
+    - coinのキャッシュ (チームごとの残高)
+    - チケットファイルごとの購入済みunitの合計
+    - レース結果の索引
+
+    ファイルは一時ファイルに書き出してから置き換えるため、書き込み途中で
+    落ちても前回のチェックポイントが残る。
+    チェックポイントの後の変更は、coin・チケット・レース結果のファイルは
+    追記された部分だけを読んで反映し、レースの状態は record_race_state で
+    記録したjournalから反映する。
+
+    Parameters
+    ----------
+    path : str
+        チェックポイントのファイルパス
+    dir_path : str
+        データ保存ディレクトリパス
+    """
+
+    def __init__(self, path: str, dir_path: str) -> None:
+        self.path = Path(path)
+        self.journal_path = self.path.with_name(self.path.name + ".journal")
+        self.dir_path = dir_path
+        self._lock = threading.Lock()
+
+    def capture_races(self, service: RaceStateService) -> RaceSnapshot:
+        """全レースの状態を取り出す。レースの状態を更新するスレッドで呼ぶ
+
+        Parameters
+        ----------
+        service : RaceStateService
+            レースの状態
+
+        Returns
+        -------
+        RaceSnapshot
+            save に渡すレースの状態
+        """
+        races = {
+            game_id: (race.ticket_buy, race.ticket_paid)
+            for game_id, race in service.races.items()
+        }
+        return races, service.race_state.game_id, service.version
+
+    def record_race_state(self, race_state: RaceState, version: int) -> None:
+        """チェックポイントの後のレースの状態の更新をjournalに追記する
+
+        Parameters
+        ----------
+        race_state : RaceState
+            更新後のレースの状態
+        version : int
+            更新後のversion
+        """
+        line = json.dumps({"version": version, **race_state.model_dump()}) + "\n"
+        with self._lock, open(self.journal_path, "a") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save(self, races: RaceSnapshot | None = None) -> int:
+        """チェックポイントを書き出す
+
+        Parameters
+        ----------
+        races : RaceSnapshot | None, optional
+            capture_races で取り出したレースの状態。
+            レースの状態を別に保存しているときはNone, by default None
+
+        Returns
+        -------
+        int
+            書き出したバイト数
+        """
+        # JSONのオブジェクトのキーは文字列になるため、int をキーにする辞書は
+        # [キー, 値] のリストにする。末尾のバイト列は base64 にする
+        results = get_result_store(self.dir_path).snapshot()
+        payload = {
+            "created": time.time(),
+            "races": None
+            if races is None
+            else [
+                [[game_id, *state] for game_id, state in races[0].items()],
+                races[1],
+                races[2],
+            ],
+            "coins": {
+                df_path: [
+                    list(entry.by_game.items()),
+                    entry.max_game_id,
+                    entry.stat,
+                    _b64(tail),
+                ]
+                for df_path, entry in coin_cache.snapshot().items()
+                if (tail := _tail(df_path, entry.stat[1])) is not None
+            },
+            "reserved": {
+                path: [total, size, _b64(tail)]
+                for path, (total, size) in reserved_units.snapshot().items()
+                if size > 0 and (tail := _tail(path, size)) is not None
+            },
+            "results": None
+            if results is None
+            else [list(results[0].items()), results[1], results[2]],
+        }
+        body = json.dumps(payload).encode()
+        data = MAGIC + zlib.crc32(body).to_bytes(4, "little") + body
+
+        # 複数ワーカーが同時に書き出しても一時ファイルが重ならないようにする
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        fsync_path(str(self.path.parent))
+        if races is not None:
+            self._trim_journal(races[2])
+        return len(data)
+
+    def restore(self, service: RaceStateService | None = None) -> dict[str, int]:
+        """チェックポイントを読み込み、その後の変更を反映する
+
+        チェックポイントがないときや壊れているときは、レースの状態をjournalから
+        戻すだけにし、各ファイルはこれまで通り最初の参照時に読み込む。
+
+        Parameters
+        ----------
+        service : RaceStateService | None, optional
+            レースの状態を読み込む先。Noneのときはレースの状態を読み込まない,
+            by default None
+
+        Returns
+        -------
+        dict[str, int]
+            読み込んだ件数 ("coins", "reserved", "results", "races") と、
+            チェックポイントの後の変更として反映した行数 ("replayed")
+        """
+        stats = dict.fromkeys(["coins", "reserved", "results", "races", "replayed"], 0)
+        payload = self._read()
+        if payload is None:
+            if service is not None:
+                stats["replayed"] = self._replay_journal(service, -1)
+            return stats
+
+        for df_path, (by_game, max_game_id, stat, tail) in payload["coins"].items():
+            entry = CoinCacheEntry(dict(by_game), max_game_id, tuple(stat))
+            current = _stat(df_path)
+            if current != entry.stat:
+                data = _appended(df_path, stat[1], base64.b64decode(tail))
+                if data is None:
+                    continue
+                df = read_coins(io.BytesIO(data), header=False)
+                for coins, game_id in zip(df["coins"], df["game_id"], strict=True):
+                    entry.by_game.setdefault(int(game_id), int(coins))
+                    entry.max_game_id = max(entry.max_game_id, int(game_id))
+                entry.stat = current
+                stats["replayed"] += len(df)
+            coin_cache.restore(df_path, entry)
+            stats["coins"] += 1
+
+        for path, (total, size, tail) in payload["reserved"].items():
+            current = _stat(path)[1]
+            if current != size:
+                data = _appended(path, size, base64.b64decode(tail))
+                if data is None:
+                    continue
+                # チケットファイルは最後の列が unit
+                rows = list(csv.reader(io.StringIO(data.decode())))
+                total += sum(int(row[-1]) for row in rows)
+                stats["replayed"] += len(rows)
+            reserved_units.restore(path, total, current)
+            stats["reserved"] += 1
+
+        if payload["results"] is not None:
+            results, columns, offset = payload["results"]
+            store = get_result_store(self.dir_path)
+            if store.restore(dict(results), columns, offset):
+                stats["results"] = len(results)
+
+        if service is not None and payload["races"] is not None:
+            races, game_id, version = payload["races"]
+            service.restore(
+                {
+                    race_id: RaceState(
+                        game_id=race_id, ticket_buy=ticket_buy, ticket_paid=ticket_paid
+                    )
+                    for race_id, ticket_buy, ticket_paid in races
+                },
+                game_id,
+                version,
+            )
+            stats["races"] = len(races)
+            stats["replayed"] += self._replay_journal(service, version)
+        return stats
+
+    def _read(self) -> dict | None:
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            return None
+        header = len(MAGIC) + 4
+        if len(data) < header or not data.startswith(MAGIC):
+            return None
+        body = data[header:]
+        if zlib.crc32(body) != int.from_bytes(data[len(MAGIC) : header], "little"):
+            return None
+        return json.loads(body)
+
+    def _journal_lines(self) -> list[dict]:
+        try:
+            text = self.journal_path.read_text()
+        except FileNotFoundError:
+            return []
+        # 書き込み途中の最後の行は読まない
+        return [
+            json.loads(line)
+            for line in text.splitlines(keepends=True)
+            if line.endswith("\n")
+        ]
+
+    def _replay_journal(self, service: RaceStateService, version: int) -> int:
+        replayed = 0
+        for line in self._journal_lines():
+            if line.pop("version") > version:
+                service.update(RaceState(**line))
+                replayed += 1
+        return replayed
+
+    def _trim_journal(self, version: int) -> None:
+        """チェックポイントに含めた更新をjournalから除く"""
+        with self._lock:
+            lines = [
+                json.dumps(line) + "\n"
+                for line in self._journal_lines()
+                if line["version"] > version
+            ]
+            if not lines:
+                self.journal_path.unlink(missing_ok=True)
+                return
+            tmp_path = f"{self.journal_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self.journal_path)
+
+
+def _stat(path: str) -> tuple[int, int]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return (-1, -1)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _tail(path: str, size: int) -> bytes | None:
+    """ファイルの size バイト目までの末尾 TAIL_BYTES バイトを返す"""
+    start = max(0, size - TAIL_BYTES)
+    try:
+        with open(path, "rb") as f:
+            f.seek(start)
+            tail = f.read(size - start)
+    except FileNotFoundError:
+        return None
+    return tail if len(tail) == size - start else None
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def _appended(path: str, size: int, tail: bytes) -> bytes | None:
+    """チェックポイントの後に追記された部分を返す。
+
+    size バイト目までの末尾がチェックポイントの時と異なるとき
+    (ファイルが書き直されたとき) や、追記の途中のときはNoneを返す。
+    """
+    try:
+        with open(path, "rb") as f:
+            f.seek(size - len(tail))
+            if f.read(len(tail)) != tail:
+                return None
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if not data.endswith(b"\n"):
+        return None
+    return data
@@ -0,0 +1,157 @@
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+
+@dataclass
+class CoinCacheEntry:
+    """1チーム分のcoinのキャッシュ
+
+    Parameters
+    ----------
+    by_game : dict[int, int]
+        game_idと、そのgame_idの最初の行のcoin数の辞書
+    max_game_id : int
+        最大のgame_id
+    stat : tuple[int, int]
+        キャッシュ作成時のファイルの (mtime_ns, size)
+    """
+
+    by_game: dict[int, int] = field(default_factory=dict)
+    max_game_id: int = 0
+    stat: tuple[int, int] = (0, 0)
+
+    def coins(self, game_id: int | None = None) -> int:
+        """get_team_coins と同じ規則でcoin数を返す"""
+        if game_id is None:
+            return self.by_game[self.max_game_id]
+        return self.by_game.get(game_id, 0)
+
+    @property
+    def version(self) -> str:
+        """キャッシュ作成時のファイルのversion。coins_version と同じ形式"""
+        return format_version(self.stat)
+
+
+class CoinCache:
+    """チームごとのcoin残高のLRUキャッシュ
+
+    get_team_coins で読み込んだ結果をcoin設定ファイルのパスごとに保持し、
+    set_team_coins の書き込み時に更新する (write-through)。
+    参照のたびにファイルの mtime と size を確認し、プロセス外から
+    書き換えられていたときはキャッシュを破棄する。
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        キャッシュするチーム数の上限。0のときはキャッシュしない, by default 1024
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, CoinCacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, df_path: str) -> CoinCacheEntry | None:
+        """有効なキャッシュを返す。ないときや古いときはNoneを返す"""
+        with self._lock:
+            entry = self._entries.get(df_path)
+            if entry is None:
+                return None
+            if entry.stat != file_stat(df_path):
+                del self._entries[df_path]
+                return None
+            self._entries.move_to_end(df_path)
+            return entry
+
+    def load(
+        self, df_path: str, df: pd.DataFrame, stat: tuple[int, int]
+    ) -> CoinCacheEntry:
+        """読み込んだcoin設定ファイルのDataFrameからキャッシュを作る
+
+        statは読み込む前に file_stat で取ったもの。読み込みの間に書き換えられ、
+        ファイルの stat が変わっていたときは、作ったエントリを保持しない。
+        """
+        first_rows = df.drop_duplicates(subset="game_id", keep="first")
+        entry = CoinCacheEntry(
+            by_game={
+                int(game_id): int(coins)
+                for game_id, coins in zip(
+                    first_rows["game_id"], first_rows["coins"], strict=True
+                )
+            },
+            max_game_id=int(df["game_id"].max()),
+            stat=stat,
+        )
+        if file_stat(df_path) == stat:
+            self._store(df_path, entry)
+        return entry
+
+    def record(
+        self, df_path: str, entry: CoinCacheEntry | None, coins: int, game_id: int
+    ) -> None:
+        """書き込んだ1行をキャッシュに反映する。
+
+        entryは書き込み前に lookup で取得したもの。
+        書き込み前にキャッシュがなかったときは何もしない。
+        lookup から record までは journal_lock を取ったまま呼ぶこと。
+        書き込み後の stat をそのまま有効とみなすため、ロックの外で
+        間に書き込まれた行があると、その行を含まないキャッシュが残る。
+        """
+        if entry is None:
+            return
+        entry.by_game.setdefault(int(game_id), int(coins))
+        entry.max_game_id = max(entry.max_game_id, int(game_id))
+        entry.stat = file_stat(df_path)
+        self._store(df_path, entry)
+
+    def snapshot(self) -> dict[str, CoinCacheEntry]:
+        """チェックポイント用に、全てのキャッシュの複製を返す"""
+        with self._lock:
+            return {
+                df_path: CoinCacheEntry(
+                    dict(entry.by_game), entry.max_game_id, entry.stat
+                )
+                for df_path, entry in self._entries.items()
+            }
+
+    def restore(self, df_path: str, entry: CoinCacheEntry) -> None:
+        """チェックポイントから読み込んだキャッシュを追加する"""
+        self._store(df_path, entry)
+
+    def invalidate(self, df_path: str) -> None:
+        with self._lock:
+            self._entries.pop(df_path, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, df_path: str, entry: CoinCacheEntry) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[df_path] = entry
+            self._entries.move_to_end(df_path)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def format_version(stat: tuple[int, int]) -> str:
+    """ファイルの (mtime_ns, size) をcoinのversionの文字列にする"""
+    return f"{stat[0]:x}-{stat[1]:x}"
+
+
+def file_stat(df_path: str) -> tuple[int, int]:
+    """ファイルの (mtime_ns, size) を返す。ファイルがないときは (-1, -1) を返す"""
+    try:
+        st = os.stat(df_path)
+    except FileNotFoundError:
+        return (-1, -1)
+    return (st.st_mtime_ns, st.st_size)
+
+
+coin_cache = CoinCache(int(os.getenv("KEIMA_COIN_CACHE_SIZE", "1024")))
@@ -1,13 +1,45 @@
+import os
+from typing import IO
+
 import pandas as pd
 
+from keima.backend.coins.cache import coin_cache, file_stat
+from keima.backend.metrics.metrics import metrics
+from keima.backend.storage.layout import coins_path
 from keima.myexception.backend import NoCoinsDataError
 
+COINS_COLUMNS = ["team_name", "coins", "game_id"]
+
 
+def read_coins(source: str | IO[bytes], header: bool = True) -> pd.DataFrame:
+    """coin設定ファイルを読み込む。
+
+    Parameters
+    ----------
+    source : str | IO[bytes]
+        coin設定ファイルのパス、またはその内容
+    header : bool, optional
+        先頭にヘッダー行があるかどうか。追記された部分だけを読むときはFalseにし、
+        COINS_COLUMNS の列として読む, by default True
+
+    Returns
+    -------
+    pd.DataFrame
+        "team_name", "coins", "game_id" 列を持つDataFrame
+    """
+    if header:
+        return pd.read_csv(source, dtype={"team_name": str})
+    return pd.read_csv(source, names=COINS_COLUMNS, dtype={"team_name": str})
+
+
+@metrics.timed("get_team_coins")
 def get_team_coins(team_name: str, dir_path: str, game_id: int | None = None) -> int:
     """teamのcoinを取得する。
 
     game_idが指定されているときは、その値に対応する行のcoinsを返す。
     指定されていないときは、dfの最後の行のcoinsを返す。
+    読み込んだ結果は coin_cache に保持し、ファイルが変わっていない間は
+    ファイルを読み直さずにキャッシュから返す。
 
     Parameters
     ----------
@@ -23,16 +55,16 @@ def get_team_coins(team_name: str, dir_path: str, game_id: int | None = None) ->
     int
         dfの最後の行のcoins値
     """
-    df_path = f"{dir_path}/{team_name}_coins.csv"
-    df = pd.read_csv(df_path)
-
-    if df.empty:
-        raise NoCoinsDataError(f"No coins data available for team: {team_name}")
-
-    if game_id is not None:
-        filtered_coins = df.loc[df["game_id"] == game_id, "coins"]
-        coins = filtered_coins.iloc[0] if not filtered_coins.empty else 0
-    else:
-        df = df.sort_values(by="game_id", ascending=False)
-        coins = df.iloc[0]["coins"]
-    return coins
+    df_path = coins_path(team_name, dir_path)
+    entry = coin_cache.lookup(df_path)
+    if entry is None:
+        stat = file_stat(df_path)
+        df = read_coins(df_path)
+        if metrics.enabled:
+            metrics.record_io("coins", "read", len(df), os.path.getsize(df_path))
+
+        if df.empty:
+            raise NoCoinsDataError(f"No coins data available for team: {team_name}")
+
+        entry = coin_cache.load(df_path, df, stat)
+    return entry.coins(game_id)
@@ -0,0 +1,361 @@
+import argparse
+import contextlib
+import csv
+import fcntl
+import io
+import json
+import os
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+import pandas as pd
+
+from keima.backend.metrics.metrics import metrics
+from keima.backend.storage.layout import coins_path, iter_coins_paths
+
+COINS_JOURNAL = "coins_journal.json"
+COINS_JOURNAL_LOCK = "coins_journal.lock"
+
+
+class JournalLock:
+    """coinの一括更新のjournalを使う処理のロック
+
+    journalと一時ファイルはデータ保存ディレクトリに1つずつのため、
+    一時ファイルの書き出しからjournalの適用までを1つずつ実行する。
+    プロセス内は RLock で、複数ワーカーの間は
+    "{dir_path}/coins_journal.lock" の flock で排他する。
+    同じスレッドからは入れ子で取れる (flock は一番外側で1回だけ取る)。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    @contextlib.contextmanager
+    def hold(self, dir_path: str) -> Iterator[None]:
+        """dir_path のjournalのロックを取る
+
+        Parameters
+        ----------
+        dir_path : str
+            coin設定ファイルのディレクトリパス
+        """
+        with self._lock:
+            fd = None
+            if self._depth == 0:
+                fd = os.open(
+                    Path(dir_path) / COINS_JOURNAL_LOCK, os.O_RDWR | os.O_CREAT
+                )
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if fd is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    os.close(fd)
+
+
+journal_lock = JournalLock()
+
+
+class CoinLedger:
+    """coin設定ファイルへの追記専用の書き込み
+
+    "{team_name}_coins.csv" と同じ列 (team_name, coins, game_id) の1行を
+    ファイル末尾に追記するだけで、既存の履歴を読み直さない。
+    そのため既存のcoin設定ファイルもそのまま読み書きでき、
+    get_team_coins の結果も変わらない。
+
+    game_idの自動採番に使う最大値はファイルごとに記録しておき、
+    ファイルサイズが記録と異なるとき (外部から書き換えられたとき) だけ読み直す。
+    追記ごとに flush して他のプロセスから読めるようにし、
+    fsync は fsync_every 件ごとにまとめて行う。
+
+    Parameters
+    ----------
+    fsync_every : int, optional
+        fsyncをまとめる追記件数, by default 100
+    """
+
+    def __init__(self, fsync_every: int = 100) -> None:
+        self.fsync_every = fsync_every
+        # df_path -> (最大game_id, 最後に確認したファイルサイズ)
+        self._max_game_ids: dict[str, tuple[int | None, int]] = {}
+        self._dirty: set[str] = set()
+        self._pending = 0
+        self._lock = threading.RLock()
+
+    def append(
+        self, team_name: str, coins: int, dir_path: str, game_id: int | None = None
+    ) -> int:
+        """teamのcoinを1行追記する。
+
+        game_idの扱いは set_team_coins と同じ。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        coins : int
+            設定するcoinの数
+        dir_path : str
+            coin設定ファイルのディレクトリパス
+        game_id : int | None, optional
+            ゲームID, by default None
+
+        Returns
+        -------
+        int
+            追記した行のgame_id
+        """
+        with self._lock:
+            df_path = coins_path(team_name, dir_path, create=True)
+            game_id = self._next_game_id(df_path, game_id)
+            self._write(df_path, _coins_line(team_name, coins, game_id))
+            self._count_pending(1)
+            return game_id
+
+    def append_many(
+        self,
+        team_coins: dict[str, int],
+        dir_path: str,
+        game_id: int | None = None,
+        records: list[tuple[str, int, str]] | None = None,
+    ) -> dict[str, int]:
+        """複数teamのcoinをまとめて追記する。
+
+        追記前のファイルサイズと追記する行をjournalに記録してから追記するため、
+        途中で落ちても recover_team_coins で残りの追記を完了できる。
+
+        Parameters
+        ----------
+        team_coins : dict[str, int]
+            team_nameと設定するcoinの数の辞書
+        dir_path : str
+            coin設定ファイルのディレクトリパス
+        game_id : int | None, optional
+            ゲームID, by default None
+        records : list[tuple[str, int, str]] | None, optional
+            coinと同時にコミットする、coin設定ファイル以外への追記
+            (ファイル、追記前のサイズ、追記する行) のリスト, by default None
+
+        Returns
+        -------
+        dict[str, int]
+            team_nameと追記した行のgame_idの辞書
+        """
+        with journal_lock.hold(dir_path), self._lock:
+            appends = []
+            game_ids = {}
+            for team_name, coins in team_coins.items():
+                df_path = coins_path(team_name, dir_path, create=True)
+                team_game_id = self._next_game_id(df_path, game_id)
+                game_ids[team_name] = team_game_id
+                size = os.path.getsize(df_path) if Path(df_path).exists() else 0
+                appends.append(
+                    (df_path, size, _coins_line(team_name, coins, team_game_id))
+                )
+
+            write_journal(dir_path, {"append": appends, "records": records or []})
+            self.apply_appends(appends)
+            append_records(records or [])
+            Path(dir_path, COINS_JOURNAL).unlink()
+            return game_ids
+
+    def apply_appends(self, appends: list[tuple[str, int, str]]) -> None:
+        """journalに記録された追記を適用する。
+
+        ファイルサイズが追記前のサイズと異なる行は、適用済みとして飛ばす。
+
+        Parameters
+        ----------
+        appends : list[tuple[str, int, str]]
+            ファイル、追記前のサイズ、追記する行のリスト
+        """
+        with self._lock:
+            for df_path, size, line in appends:
+                self._write(df_path, line, size)
+            self.flush()
+
+    def flush(self) -> None:
+        """追記済みでfsyncしていないファイルをfsyncする"""
+        with self._lock:
+            for df_path in self._dirty:
+                if Path(df_path).exists():
+                    fsync_path(df_path)
+            self._dirty.clear()
+            self._pending = 0
+
+    def compact(self, team_name: str, dir_path: str) -> None:
+        """teamのcoin設定ファイルを圧縮する。
+
+        get_team_coins は各game_idの最初の行だけを参照するため、
+        game_idごとに最初の行だけを残して書き直す。
+        読み込みから置き換えまでの間に追記された行を失わないよう、
+        全体を journal_lock を取って実行する。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        dir_path : str
+            coin設定ファイルのディレクトリパス
+        """
+        with journal_lock.hold(dir_path), self._lock:
+            self.flush()
+            df_path = coins_path(team_name, dir_path)
+            df = pd.read_csv(df_path)
+            df = df.drop_duplicates(subset="game_id", keep="first")
+            tmp_path = f"{df_path}.tmp"
+            df.to_csv(tmp_path, index=False)
+            fsync_path(tmp_path)
+            os.replace(tmp_path, df_path)
+            self.forget(df_path)
+
+    def forget(self, df_path: str) -> None:
+        """記録しているgame_idの最大値を破棄し、次回の追記時に読み直す"""
+        with self._lock:
+            self._max_game_ids.pop(df_path, None)
+
+    def _next_game_id(self, df_path: str, game_id: int | None) -> int:
+        max_game_id, size = self._max_game_ids.get(df_path, (None, -1))
+        current_size = os.path.getsize(df_path) if Path(df_path).exists() else 0
+        if current_size != size:
+            max_game_id = _scan_max_game_id(df_path)
+        if game_id is None:
+            game_id = 0 if max_game_id is None else max_game_id + 1
+        self._max_game_ids[df_path] = (max_game_id, current_size)
+        return game_id
+
+    def _write(self, df_path: str, line: str, size: int | None = None) -> None:
+        exists = Path(df_path).exists()
+        if size is not None and exists and os.path.getsize(df_path) != size:
+            # journalの再適用時など、すでに追記済み
+            return
+        with open(df_path, "a") as f:
+            if not exists or f.tell() == 0:
+                f.write("team_name,coins,game_id\n")
+            f.write(line)
+        metrics.record_io("coins", "write", 1, len(line))
+        game_id = int(line.rsplit(",", 1)[1])
+        max_game_id, _ = self._max_game_ids.get(df_path, (None, 0))
+        if max_game_id is None or game_id > max_game_id:
+            max_game_id = game_id
+        self._max_game_ids[df_path] = (max_game_id, os.path.getsize(df_path))
+        self._dirty.add(df_path)
+
+    def _count_pending(self, count: int) -> None:
+        self._pending += count
+        if self._pending >= self.fsync_every:
+            self.flush()
+
+
+def record_entry(path: str | Path, lines: str) -> tuple[str, int, str]:
+    """coinと同時にコミットする追記を、journalに記録する形にする
+
+    Parameters
+    ----------
+    path : str | Path
+        追記するファイル
+    lines : str
+        追記する行。改行で終わること
+
+    Returns
+    -------
+    tuple[str, int, str]
+        ファイル、追記前のサイズ、追記する行
+    """
+    size = os.path.getsize(path) if Path(path).exists() else 0
+    return str(path), size, lines
+
+
+def append_records(records: list[tuple[str, int, str]]) -> None:
+    """journalに記録された coin設定ファイル以外への追記を適用する。
+
+    ファイルサイズが追記前のサイズと異なるファイルは、適用済みとして飛ばす。
+
+    Parameters
+    ----------
+    records : list[tuple[str, int, str]]
+        ファイル、追記前のサイズ、追記する行のリスト
+    """
+    for path, size, lines in records:
+        current_size = os.path.getsize(path) if Path(path).exists() else 0
+        if current_size != size:
+            continue
+        with open(path, "a") as f:
+            f.write(lines)
+        fsync_path(path)
+
+
+def write_journal(dir_path: str, entries: dict) -> None:
+    """coinの一括更新のjournalを書き込む。
+
+    journalのrenameが完了した時点で、その一括更新はコミットされたとみなす。
+
+    Parameters
+    ----------
+    dir_path : str
+        coin設定ファイルのディレクトリパス
+    entries : dict
+        "replace" に [一時ファイル, 置き換え先] のリスト、
+        "append" に [ファイル, 追記前のサイズ, 追記する行] のリスト、
+        "records" に coin設定ファイル以外への同じ形の追記のリストを持つ辞書
+    """
+    journal_path = Path(dir_path) / COINS_JOURNAL
+    journal_tmp = journal_path.with_suffix(".tmp")
+    journal_tmp.write_text(json.dumps(entries))
+    fsync_path(journal_tmp)
+    os.replace(journal_tmp, journal_path)
+    fsync_path(dir_path)
+
+
+def fsync_path(path: str | Path) -> None:
+    """ファイルまたはディレクトリをfsyncする"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _coins_line(team_name: str, coins: int, game_id: int) -> str:
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerow([team_name, int(coins), int(game_id)])
+    return buf.getvalue()
+
+
+def _scan_max_game_id(df_path: str) -> int | None:
+    if not Path(df_path).exists():
+        return None
+    game_ids = pd.read_csv(df_path, usecols=["game_id"])["game_id"]
+    return None if game_ids.empty else int(game_ids.max())
+
+
+coin_ledger = CoinLedger(int(os.getenv("KEIMA_LEDGER_FSYNC_EVERY", "100")))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="coin設定ファイルを圧縮する。"
+        "teamごとに coins_journal.lock を取るため、サーバーを止めずに実行できる"
+    )
+    parser.add_argument("command", choices=["compact"])
+    parser.add_argument("dir_path", help="coin設定ファイルのディレクトリパス")
+    parser.add_argument("--team", nargs="*", help="対象のteam。省略時は全team")
+    args = parser.parse_args()
+
+    teams = args.team or [
+        path.name.removesuffix("_coins.csv")
+        for path in sorted(iter_coins_paths(args.dir_path))
+    ]
+    for team_name in teams:
+        coin_ledger.compact(team_name, args.dir_path)
+        print(f"compacted {team_name}")
+
+
+if __name__ == "__main__":
+    main()
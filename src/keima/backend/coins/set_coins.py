@@ -1,8 +1,23 @@
+import json
+import os
 from pathlib import Path
 
 import pandas as pd
 
+from keima.backend.coins.cache import coin_cache
+from keima.backend.coins.ledger import (
+    COINS_JOURNAL,
+    append_records,
+    coin_ledger,
+    fsync_path,
+    journal_lock,
+    write_journal,
+)
+from keima.backend.metrics.metrics import metrics
+from keima.backend.storage.layout import coins_path, iter_coins_paths
 
+
+@metrics.timed("set_team_coins")
 def set_team_coins(
     team_name: str, coins: int, dir_path: str, game_id: int | None = None
 ) -> None:
@@ -15,6 +30,9 @@ def set_team_coins(
     新規作成時はgame_idは0とする。
 
     ファイル名は"{team_name}_coins.csv"とする。
+    環境変数 KEIMA_COINS_STORAGE が "ledger" のときは、既存の履歴を読み直さずに
+    CoinLedger で1行追記する。
+    CoinLedger.compact による書き直しと重ならないよう、journal_lock を取って書き込む。
 
     Parameters
     ----------
@@ -27,8 +45,136 @@ def set_team_coins(
     game_id : int | None, optional
         ゲームID, by default None
     """
-    # This is a placeholder implementation.
-    df_path = f"{dir_path}/{team_name}_coins.csv"
+    df_path = coins_path(team_name, dir_path, create=True)
+    with journal_lock.hold(dir_path):
+        entry = coin_cache.lookup(df_path)
+        if _use_ledger():
+            game_id = coin_ledger.append(team_name, coins, dir_path, game_id)
+        else:
+            # This is a placeholder implementation.
+            df, game_id = _append_coins_row(df_path, team_name, coins, game_id)
+            df.to_csv(df_path, index=False)
+            if metrics.enabled:
+                metrics.record_io("coins", "write", len(df), os.path.getsize(df_path))
+        coin_cache.record(df_path, entry, coins, game_id)
+
+
+def set_teams_coins(
+    team_coins: dict[str, int],
+    dir_path: str,
+    game_id: int | None = None,
+    records: list[tuple[str, int, str]] | None = None,
+) -> None:
+    """複数teamのcoinをまとめて設定する。
+
+    各teamの行の追加は set_team_coins と同じ規則で行う。
+    途中でプロセスが落ちても一部のteamだけが更新された状態にならないよう、
+    全teamの新しいファイルを一時ファイルに書き出し、置き換え対象を
+    journalに記録してから一括で置き換える。
+    journalが残っている場合は、次回の呼び出し時に apply_coins_journal で
+    置き換えを完了させる。
+    journalと一時ファイルは1つずつのため、一時ファイルの書き出しから
+    置き換えまでは journal_lock を取って1つずつ実行する。
+    KEIMA_COINS_STORAGE が "ledger" のときは、置き換えの代わりに
+    CoinLedger.append_many で追記する。
+    recordsに指定した追記も、同じjournalに記録してcoinと同時にコミットする。
+
+    Parameters
+    ----------
+    team_coins : dict[str, int]
+        team_nameと設定するcoinの数の辞書
+    dir_path : str
+        coin設定ファイルのディレクトリパス
+    game_id : int | None, optional
+        ゲームID, by default None
+    records : list[tuple[str, int, str]] | None, optional
+        ledger.record_entry で作った、coin設定ファイル以外への追記のリスト,
+        by default None
+    """
+    with journal_lock.hold(dir_path):
+        apply_coins_journal(dir_path)
+
+        df_paths = {
+            team_name: coins_path(team_name, dir_path, create=True)
+            for team_name in team_coins
+        }
+        entries = {
+            team_name: coin_cache.lookup(df_path)
+            for team_name, df_path in df_paths.items()
+        }
+        if _use_ledger():
+            game_ids = coin_ledger.append_many(team_coins, dir_path, game_id, records)
+        else:
+            replaces = []
+            game_ids = {}
+            for team_name, coins in team_coins.items():
+                df_path = df_paths[team_name]
+                tmp_path = f"{df_path}.tmp"
+                df, game_ids[team_name] = _append_coins_row(
+                    df_path, team_name, coins, game_id
+                )
+                df.to_csv(tmp_path, index=False)
+                fsync_path(tmp_path)
+                replaces.append((tmp_path, df_path))
+
+            write_journal(dir_path, {"replace": replaces, "records": records or []})
+            apply_coins_journal(dir_path)
+
+        for team_name, coins in team_coins.items():
+            coin_cache.record(
+                df_paths[team_name], entries[team_name], coins, game_ids[team_name]
+            )
+
+
+def apply_coins_journal(dir_path: str) -> None:
+    """journalが残っていれば、記録された一括更新を最後まで適用する。
+
+    Parameters
+    ----------
+    dir_path : str
+        coin設定ファイルのディレクトリパス
+    """
+    journal_path = Path(dir_path) / COINS_JOURNAL
+    with journal_lock.hold(dir_path):
+        if not journal_path.exists():
+            return
+        journal = json.loads(journal_path.read_text())
+        replaces = journal.get("replace", [])
+        for tmp_path, df_path in replaces:
+            if Path(tmp_path).exists():
+                os.replace(tmp_path, df_path)
+        coin_ledger.apply_appends(journal.get("append", []))
+        append_records(journal.get("records", []))
+        # KEIMA_LAYOUT=sharded のときは、置き換えたファイルのディレクトリが分かれる
+        for parent in {str(Path(df_path).parent) for _, df_path in replaces} | {
+            dir_path
+        }:
+            fsync_path(parent)
+        journal_path.unlink()
+
+
+def recover_team_coins(dir_path: str) -> None:
+    """中断された set_teams_coins の一括更新を片付ける。起動時に呼ぶ
+
+    journalが存在するときは、記録された置き換えを最後まで適用する。
+    その後、コミット前に残った一時ファイルを削除する。
+    実行中の一括更新の一時ファイルは、journalのロックを取ってから消すため消さない。
+
+    Parameters
+    ----------
+    dir_path : str
+        coin設定ファイルのディレクトリパス
+    """
+    with journal_lock.hold(dir_path):
+        apply_coins_journal(dir_path)
+        for tmp_path in iter_coins_paths(dir_path, "_coins.csv.tmp"):
+            tmp_path.unlink()
+
+
+def _append_coins_row(
+    df_path: str, team_name: str, coins: int, game_id: int | None
+) -> tuple[pd.DataFrame, int]:
+    """coin設定ファイルに1行追加したDataFrameと、追加した行のgame_idを返す"""
     if Path(df_path).exists():
         df = pd.read_csv(df_path)
         if game_id is None:
@@ -43,5 +189,8 @@ def set_team_coins(
         df = pd.DataFrame(
             {"team_name": [team_name], "coins": [coins], "game_id": [game_id]}
         )
+    return df, int(game_id)
+
 
-    df.to_csv(df_path, index=False)
+def _use_ledger() -> bool:
+    return os.getenv("KEIMA_COINS_STORAGE", "csv") == "ledger"
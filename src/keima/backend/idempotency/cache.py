@@ -0,0 +1,247 @@
+import asyncio
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Iterator
+from pathlib import Path
+
+from keima.backend.metrics.metrics import metrics
+from keima.myexception.backend import IdempotencyKeyReusedError
+
+ADMIN_IDEMPOTENCY_FILE = "idempotency_admin.jsonl"
+
+idempotency_replays = metrics.counter(
+    "keima_idempotency_replays_total",
+    "Responses returned from the idempotency cache without running the handler.",
+    ("cache",),
+)
+
+
+class IdempotencyCache:
+    """Idempotency-Key ごとの処理結果のキャッシュ
+
+    同じキーで再送されたリクエストには、処理をやり直さずに保存した結果を返す。
+    同じキーのリクエストが処理中のときは、その処理が終わるのを待ってから
+    結果を返す。処理が例外で終わったときは保存しないため、再送すると
+    もう一度処理する。
+    保存する件数は maxsize まで、保存期間は ttl 秒までとし、
+    古いものから捨てる。結果はプロセスごとに持つため、uvicorn を複数ワーカーで
+    動かすと、別のワーカーが処理したキーの再送はもう一度処理する。
+    path を指定すると結果をファイルに追記し、再起動後も同じ結果を返す。
+    ファイルは複数ワーカーで共有できるよう、追記と詰め直しを
+    "{path}.lock" の flock で排他し、詰め直しでは他のワーカーが追記した
+    結果も残す。
+
+    Parameters
+    ----------
+    name : str
+        メトリクスの cache ラベルの値
+    maxsize : int, optional
+        保存する結果の数の上限, by default 10000
+    ttl : float, optional
+        結果を保存しておく秒数, by default 600
+    path : str | None, optional
+        結果を追記するファイルパス。Noneのときはメモリ上だけに持つ,
+        by default None
+    run : Callable[..., Awaitable] | None, optional
+        ファイルへの追記を実行する関数 (StorageExecutor.run など)。
+        Noneのときはイベントループ上で追記する, by default None
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = 10000,
+        ttl: float = 600,
+        path: str | None = None,
+        run: Callable[..., Awaitable] | None = None,
+    ) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = None if path is None else Path(path)
+        self._run = run
+        # キー -> (期限のUNIX時刻, リクエストの指紋, 結果)
+        self._entries: OrderedDict[str, tuple[float, str, dict]] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self._lines = 0
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self._load()
+
+    async def run(
+        self, key: str, fingerprint: str, func: Callable[[], Awaitable[dict]]
+    ) -> tuple[dict, bool]:
+        """キーの結果があればそれを返し、なければ func を実行して結果を保存する
+
+        Parameters
+        ----------
+        key : str
+            Idempotency-Key。teamやエンドポイントごとに別のキーになるよう
+            呼び出し側で (持ち主, メソッド, パス) の接頭辞を付ける
+        fingerprint : str
+            リクエストの内容を表す文字列。同じキーで異なる内容のリクエストを
+            検出するために使う
+        func : Callable[[], Awaitable[dict]]
+            リクエストを処理する関数
+
+        Returns
+        -------
+        tuple[dict, bool]
+            結果と、保存していた結果を返したかどうか
+
+        Raises
+        ------
+        IdempotencyKeyReusedError
+            同じキーで異なる内容のリクエストが送られたとき
+        """
+        while True:
+            entry = self.get(key)
+            if entry is not None:
+                entry_fingerprint, result = entry
+                if entry_fingerprint != fingerprint:
+                    raise IdempotencyKeyReusedError(
+                        f"Idempotency-Key {key} was used for a different request."
+                    )
+                idempotency_replays.inc(self.name)
+                return result, True
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+            # 同じキーの処理が終わるのを待ってから、保存された結果を確かめ直す
+            await asyncio.shield(in_flight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await func()
+            line = self.put(key, fingerprint, result)
+            if line is not None:
+                if self._run is None:
+                    self._append(line)
+                else:
+                    await self._run(self._append, line)
+            return result, False
+        finally:
+            del self._in_flight[key]
+            future.set_result(None)
+
+    def get(self, key: str) -> tuple[str, dict] | None:
+        """期限内のキーの (リクエストの指紋, 結果) を返す。ないときはNone"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, fingerprint, result = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            return fingerprint, result
+
+    def put(self, key: str, fingerprint: str, result: dict) -> str | None:
+        """結果を保存する
+
+        Returns
+        -------
+        str | None
+            ファイルに追記する行。path がないときはNone
+        """
+        entry = (time.time() + self.ttl, fingerprint, result)
+        with self._lock:
+            self._store(key, entry)
+        return None if self.path is None else _line(key, entry)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _store(self, key: str, entry: tuple[float, str, dict]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        now = time.time()
+        while self._entries and (
+            len(self._entries) > self.maxsize
+            or next(iter(self._entries.values()))[0] <= now
+        ):
+            self._entries.popitem(last=False)
+
+    def _append(self, line: str) -> None:
+        with self._lock, self._file_lock():
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._lines += 1
+            if self._lines > 2 * self.maxsize:
+                self._compact()
+
+    def _compact(self) -> None:
+        """期限切れや上限を超えた結果を、ファイルから除く
+
+        他のワーカーが追記した結果も残すため、メモリ上の結果ではなく
+        ファイルの内容を読み直して詰める。_file_lock の中で呼ぶ。
+        """
+        records: OrderedDict[str, str] = OrderedDict()
+        now = time.time()
+        for key, expires, line in _read_lines(self.path):
+            records.pop(key, None)
+            if expires > now:
+                records[key] = line
+        lines = list(records.values())[-self.maxsize :]
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._lines = len(lines)
+
+    @contextlib.contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _load(self) -> None:
+        now = time.time()
+        for _, expires, line in _read_lines(self.path):
+            self._lines += 1
+            if expires > now:
+                record = json.loads(line)
+                self._store(
+                    record["key"],
+                    (record["expires"], record["fingerprint"], record["result"]),
+                )
+
+
+def _read_lines(path: Path) -> Iterator[tuple[str, float, str]]:
+    """ファイルの結果を (キー, 期限, 行) で順に返す"""
+    try:
+        text = path.read_text()
+    except FileNotFoundError:
+        return
+    for line in text.splitlines(keepends=True):
+        # 書き込み途中の最後の行は読まない
+        if not line.endswith("\n"):
+            continue
+        record = json.loads(line)
+        yield record["key"], record["expires"], line
+
+
+def _line(key: str, entry: tuple[float, str, dict]) -> str:
+    expires, fingerprint, result = entry
+    record = {
+        "key": key,
+        "expires": expires,
+        "fingerprint": fingerprint,
+        "result": result,
+    }
+    return json.dumps(record) + "\n"
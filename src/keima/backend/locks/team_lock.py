@@ -0,0 +1,100 @@
+import asyncio
+import contextlib
+import fcntl
+import os
+from collections.abc import AsyncIterator, Iterable
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+
+class TeamLockManager:
+    """チームごとのロック
+
+    同じチームの購入や支払いは1つずつ実行し、別のチームの処理は待たせない。
+    ロックはチームごとに必要になったときに作り、待っている処理がなくなったら捨てる。
+
+    mode が "file" のときは、プロセス内の asyncio.Lock に加えて
+    "{lock_dir}/{team_name}.lock" の flock も取るため、
+    uvicorn を複数ワーカーで動かしてもチームごとに排他できる。
+    flock はノンブロッキングで再試行するため、スレッドを占有しない。
+
+    Parameters
+    ----------
+    mode : str, optional
+        "process" または "file", by default "process"
+    lock_dir : str | None, optional
+        mode が "file" のときのロックファイルのディレクトリパス, by default None
+    """
+
+    def __init__(self, mode: str = "process", lock_dir: str | None = None) -> None:
+        if mode not in ("process", "file"):
+            raise ValueError(f"Unknown lock mode: {mode}")
+        if mode == "file" and lock_dir is None:
+            raise ValueError("lock_dir is required for file lock mode")
+        self.mode = mode
+        self.lock_dir = lock_dir
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._users: dict[str, int] = {}
+
+    @asynccontextmanager
+    async def lock(self, team_name: str) -> AsyncIterator[None]:
+        """teamのロックを取る
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        """
+        lock = self._locks.get(team_name)
+        if lock is None:
+            lock = self._locks[team_name] = asyncio.Lock()
+        self._users[team_name] = self._users.get(team_name, 0) + 1
+        try:
+            async with lock:
+                if self.mode == "file":
+                    fd = await self._flock(team_name)
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+                        os.close(fd)
+                else:
+                    yield
+        finally:
+            self._users[team_name] -= 1
+            if self._users[team_name] == 0:
+                del self._users[team_name]
+                del self._locks[team_name]
+
+    @asynccontextmanager
+    async def lock_many(self, team_names: Iterable[str]) -> AsyncIterator[None]:
+        """複数teamのロックを取る
+
+        ロックは名前順に取るため、複数teamのロックを取る処理どうしで
+        互いに待ち合うことはない。
+
+        Parameters
+        ----------
+        team_names : Iterable[str]
+            teamの名前の列
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            for team_name in sorted(set(team_names)):
+                await stack.enter_async_context(self.lock(team_name))
+            yield
+
+    async def _flock(self, team_name: str) -> int:
+        Path(self.lock_dir).mkdir(parents=True, exist_ok=True)
+        fd = os.open(f"{self.lock_dir}/{team_name}.lock", os.O_RDWR | os.O_CREAT)
+        delay = 0.001
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 0.05)
+        except BaseException:
+            os.close(fd)
+            raise
@@ -0,0 +1,285 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from typing import ParamSpec, TypeVar
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# 処理時間のヒストグラムのバケットの上限 [秒]
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class _Metric(ABC):
+    """ラベルの値ごとに値を持つメトリクス"""
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            lines += self._samples()
+        return lines
+
+    def _labels(self, values: tuple[str, ...], extra: str = "") -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"'
+            for name, value in zip(self.labelnames, values, strict=True)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    @abstractmethod
+    def _samples(self) -> list[str]:
+        """ロックを取った状態で呼ばれ、出力する行のリストを返す"""
+
+
+class Counter(_Metric):
+    """増えるだけの値"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...]):
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        """ラベルの値の組の値を amount 増やす"""
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues: str) -> float:
+        """ラベルの値の組の値を返す"""
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{self._labels(labels)} {_number(value)}"
+            for labels, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(Counter):
+    """増減する値"""
+
+    kind = "gauge"
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        """ラベルの値の組の値を value にする"""
+        with self._lock:
+            self._values[labelvalues] = value
+
+
+class Histogram(_Metric):
+    """観測した値の分布"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...],
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = buckets
+        # ラベルの値の組 -> [バケットごとの数 (累積ではない)..., +Infの数, 合計]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        """値を1つ記録する"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labelvalues)
+            if counts is None:
+                counts = self._values[labelvalues] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, *labelvalues: str) -> int:
+        """ラベルの値の組で記録した値の数を返す"""
+        with self._lock:
+            counts = self._values.get(labelvalues)
+            return 0 if counts is None else int(sum(counts[:-1]))
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for labels, counts in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts, strict=False):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{self._labels(labels, le)} {cumulative}"
+                )
+            cumulative += counts[len(self.buckets)]
+            inf = self._labels(labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(labels)} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{self._labels(labels)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """プロセス内のメトリクスの登録先
+
+    enabled が False のときは、timed で包んだ関数も計測せずにそのまま呼び、
+    呼び出し側も enabled を確かめてから記録する。
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        計測するかどうか, by default True
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._metrics: dict[str, _Metric] = {}
+        self.function_seconds = self.histogram(
+            "keima_function_duration_seconds",
+            "Duration of instrumented storage and reward functions.",
+            ("function",),
+        )
+        self.function_errors = self.counter(
+            "keima_function_errors_total",
+            "Exceptions raised by instrumented functions.",
+            ("function",),
+        )
+        self.io_bytes = self.counter(
+            "keima_io_bytes_total",
+            "Bytes read from or written to data files.",
+            ("file", "direction"),
+        )
+        self.io_rows = self.counter(
+            "keima_io_rows_total",
+            "Rows read from or written to data files.",
+            ("file", "direction"),
+        )
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Counter:
+        """Counter を登録する"""
+        return self._register(Counter(name, help_text, tuple(labelnames)))
+
+    def gauge(self, name: str, help_text: str, labelnames=()) -> Gauge:
+        """Gauge を登録する"""
+        return self._register(Gauge(name, help_text, tuple(labelnames)))
+
+    def histogram(self, name: str, help_text: str, labelnames=()) -> Histogram:
+        """Histogram を登録する"""
+        return self._register(Histogram(name, help_text, tuple(labelnames)))
+
+    def timed(self, function: str) -> Callable[[Callable[P, T]], Callable[P, T]]:
+        """関数の処理時間と例外の数を記録するデコレーター
+
+        Parameters
+        ----------
+        function : str
+            メトリクスの function ラベルの値
+
+        Returns
+        -------
+        Callable[[Callable[P, T]], Callable[P, T]]
+            デコレーター
+        """
+
+        def decorator(func: Callable[P, T]) -> Callable[P, T]:
+            @functools.wraps(func)
+            def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except BaseException:
+                    self.function_errors.inc(function)
+                    raise
+                finally:
+                    self.function_seconds.observe(time.perf_counter() - start, function)
+
+            return wrapper
+
+        return decorator
+
+    def record_io(
+        self, file: str, direction: str, rows: int, num_bytes: int | None = None
+    ) -> None:
+        """データファイルの読み書きの行数とバイト数を記録する
+
+        Parameters
+        ----------
+        file : str
+            ファイルの種類 ("coins", "results" など)
+        direction : str
+            "read" または "write"
+        rows : int
+            行数
+        num_bytes : int | None, optional
+            バイト数。Noneのときは記録しない, by default None
+        """
+        if not self.enabled:
+            return
+        self.io_rows.inc(file, direction, amount=rows)
+        if num_bytes is not None:
+            self.io_bytes.inc(file, direction, amount=num_bytes)
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式で全てのメトリクスを返す
+
+        Returns
+        -------
+        str
+            text/plain; version=0.0.4 の本文
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# 環境変数 KEIMA_METRICS=0 で計測をやめる
+metrics = Metrics(os.getenv("KEIMA_METRICS", "1") != "0")
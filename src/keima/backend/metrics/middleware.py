@@ -0,0 +1,93 @@
+import time
+
+from starlette.routing import BaseRoute, Match
+
+from keima.backend.metrics.metrics import Metrics
+
+
+class MetricsMiddleware:
+    """エンドポイントごとの処理時間・処理中のリクエスト数・ステータスを記録する
+
+    ルーティングの後に scope に入る "route" のパスのテンプレート
+    ("/admin/reward_tickets/{team_name}" など) をラベルにするため、
+    パスパラメーターの値ごとに系列が増えることはない。
+    処理中のリクエスト数はルーティングの前に数えるため、
+    routes からパスのテンプレートを求めてラベルにする。
+    処理時間はレスポンスのヘッダーを送るまでを計測するため、
+    SSE やロングポーリングの待ち時間は含まない。
+
+    Parameters
+    ----------
+    app : ASGIApp
+        包むASGIアプリケーション
+    metrics : Metrics
+        記録先
+    routes : list[BaseRoute] | None, optional
+        アプリケーションのルート (FastAPI の app.routes)。
+        Noneのときは処理中のリクエスト数の route を "unmatched" にする, by default None
+    """
+
+    def __init__(
+        self, app, metrics: Metrics, routes: list[BaseRoute] | None = None
+    ) -> None:
+        self.app = app
+        self.metrics = metrics
+        self.routes = routes or []
+        self.request_seconds = metrics.histogram(
+            "keima_http_request_duration_seconds",
+            "Time until the response headers are sent.",
+            ("route", "method"),
+        )
+        self.requests = metrics.counter(
+            "keima_http_requests_total",
+            "Finished HTTP requests.",
+            ("route", "method", "status"),
+        )
+        self.in_flight = metrics.gauge(
+            "keima_http_requests_in_flight",
+            "HTTP requests being processed.",
+            ("route", "method"),
+        )
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not self.metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                self.request_seconds.observe(
+                    time.perf_counter() - start, _route(scope), method
+                )
+            await send(message)
+
+        route = _match_route(self.routes, scope)
+        self.in_flight.inc(route, method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight.inc(route, method, amount=-1)
+            self.requests.inc(_route(scope), method, str(status))
+
+
+def _route(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+def _match_route(routes: list[BaseRoute], scope) -> str:
+    # Router と同じく、パスとメソッドが一致するルートを優先する
+    partial = "unmatched"
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+        if match == Match.PARTIAL and partial == "unmatched":
+            partial = getattr(route, "path", "unmatched")
+    return partial
@@ -0,0 +1,275 @@
+import asyncio
+import threading
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+
+from keima.backend.tickets.outcome_pool import OutcomeKey, OutcomePool
+from keima.backend.tickets.ticket_batch import NO_PLAYER, TICKET_TYPES, TicketBatch
+from keima.myexception.backend import TicketBuyClosedError
+
+
+class RaceOdds:
+    """レースの全チームのチケットの集計から計算したパリミュチュエル方式のオッズ
+
+    ticket_typeごとに賭けられたunitの合計から控除率分を引いたものを、
+    的中したunitで分け合う。
+    的中条件のオッズは (1 - takeout) * ticket_typeのunitの合計 / 的中条件のunit。
+    計算量は的中条件の組み合わせの数 (4頭なら最大40) だけで決まり、
+    チケットの枚数によらない。
+
+    Parameters
+    ----------
+    pool : OutcomePool
+        全チームのチケットの集計
+    takeout : float, optional
+        控除率, by default 0.0
+    """
+
+    def __init__(self, pool: OutcomePool, takeout: float = 0.0) -> None:
+        self.pool = pool
+        self.takeout = takeout
+        self.totals = [0] * len(TICKET_TYPES)
+        for (ticket_type, *_), unit in pool.items():
+            self.totals[ticket_type] += unit
+        self._dict: dict | None = None
+
+    def payout(self, key: OutcomeKey) -> float:
+        """的中条件の1unitあたりの払い戻しを返す。誰も賭けていないときは0
+
+        Parameters
+        ----------
+        key : OutcomeKey
+            (ticket_type, one, two, three)
+
+        Returns
+        -------
+        float
+            オッズ
+        """
+        unit = self.pool.get(*key)
+        if unit == 0:
+            return 0.0
+        return (1 - self.takeout) * self.totals[key[0]] / unit
+
+    def to_dict(self) -> dict:
+        """APIのレスポンスや保存に使う辞書を返す
+
+        的中条件は "1"、"1-2"、"1-2-3" のように着順をつないだ文字列で表す。
+
+        Returns
+        -------
+        dict
+            "takeout"、ticket_typeごとのunitの合計 "totals"、
+            的中条件ごとのunit "units" とオッズ "odds" の辞書
+        """
+        if self._dict is not None:
+            return self._dict
+        units: dict[str, dict[str, int]] = {name: {} for name in TICKET_TYPES}
+        odds: dict[str, dict[str, float]] = {name: {} for name in TICKET_TYPES}
+        for key, unit in sorted(self.pool.items()):
+            name = TICKET_TYPES[key[0]]
+            picks = "-".join(str(p) for p in key[1:] if p != NO_PLAYER)
+            units[name][picks] = unit
+            odds[name][picks] = round(self.payout(key), 4)
+        self._dict = {
+            "takeout": self.takeout,
+            "totals": dict(zip(TICKET_TYPES, self.totals, strict=True)),
+            "units": units,
+            "odds": odds,
+        }
+        return self._dict
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RaceOdds":
+        """to_dict で保存した辞書から作る
+
+        Parameters
+        ----------
+        data : dict
+            to_dict の戻り値
+
+        Returns
+        -------
+        RaceOdds
+            オッズ
+        """
+        units = {}
+        for name, picks_units in data["units"].items():
+            for picks, unit in picks_units.items():
+                players = [int(p) for p in picks.split("-")]
+                players += [NO_PLAYER] * (3 - len(players))
+                units[(TICKET_TYPES.index(name), *players)] = unit
+        return cls(OutcomePool(units), data["takeout"])
+
+
+class OddsBook:
+    """購入を受け付けているレースのオッズをメモリ上で更新する
+
+    レースごとに全チームのチケットの集計を持ち、購入のたびに加算する。
+    オッズは集計が変わったときだけ計算し直すため、多数のクライアントが
+    ポーリングしてもチケットを読み直すことはない。
+    集計がまだないレースは、最初の参照時に loader で保存先から読み込む。
+
+    購入の締め切り時には close で、受付中の購入が終わるのを待ってから
+    最終オッズを作る。締め切り後の購入は TicketBuyClosedError になる。
+
+    Parameters
+    ----------
+    loader : Callable[[int], Awaitable[OutcomePool]]
+        game_idの全チームのチケットの集計を保存先から読み込む関数
+    takeout : float, optional
+        控除率, by default 0.0
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[int], Awaitable[OutcomePool]],
+        takeout: float = 0.0,
+    ) -> None:
+        self.loader = loader
+        self.takeout = takeout
+        self._pools: dict[int, OutcomePool] = {}
+        self._odds: dict[int, RaceOdds] = {}
+        self._final: dict[int, RaceOdds] = {}
+        self._closed: set[int] = set()
+        self._in_flight: dict[int, int] = {}
+        self._idle: dict[int, asyncio.Event] = {}
+        self._load_lock = asyncio.Lock()
+        # add は保存先への書き込みと同じスレッドから呼ばれることがある
+        self._lock = threading.Lock()
+
+    @asynccontextmanager
+    async def purchase(self, game_id: int) -> AsyncIterator[None]:
+        """購入の間、締め切りを待たせる
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+        """
+        if game_id in self._closed:
+            raise TicketBuyClosedError(f"Ticket purchasing is closed: {game_id}")
+        self._in_flight[game_id] = self._in_flight.get(game_id, 0) + 1
+        self._idle.setdefault(game_id, asyncio.Event()).clear()
+        try:
+            await self._ensure_pool(game_id)
+            yield
+        finally:
+            self._in_flight[game_id] -= 1
+            if self._in_flight[game_id] == 0:
+                del self._in_flight[game_id]
+                self._idle.pop(game_id).set()
+
+    def add(self, game_id: int, tickets: TicketBatch) -> None:
+        """購入したチケットを集計に加える。purchase の中で呼ぶ
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+        tickets : TicketBatch
+            購入したチケット
+        """
+        with self._lock:
+            self._pools[game_id].add(tickets)
+            self._odds.pop(game_id, None)
+
+    async def odds(self, game_id: int) -> tuple[RaceOdds, bool]:
+        """現在のオッズを返す
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        tuple[RaceOdds, bool]
+            オッズと、締め切り後の最終オッズかどうか
+        """
+        if game_id in self._final:
+            return self._final[game_id], True
+        await self._ensure_pool(game_id)
+        with self._lock:
+            odds = self._odds.get(game_id)
+            if odds is None:
+                pool = OutcomePool()
+                pool.merge(self._pools[game_id])
+                odds = self._odds[game_id] = RaceOdds(pool, self.takeout)
+        return odds, False
+
+    def open(self, game_id: int) -> None:
+        """購入の受付を始める。締め切り後にもう一度受け付けるときも呼ぶ
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+        """
+        self._closed.discard(game_id)
+        self._final.pop(game_id, None)
+
+    async def close(self, game_id: int) -> RaceOdds:
+        """購入を締め切り、受付中の購入が終わってから最終オッズを作る
+
+        最終オッズは、他のワーカーでの購入も含めるため保存先から読み直した
+        集計で計算する。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        RaceOdds
+            最終オッズ
+        """
+        if game_id in self._final:
+            return self._final[game_id]
+        self._closed.add(game_id)
+        if game_id in self._idle:
+            await self._idle[game_id].wait()
+        pool = await self.loader(game_id)
+        with self._lock:
+            self._pools[game_id] = pool
+            self._odds.pop(game_id, None)
+            final = self._final[game_id] = RaceOdds(pool, self.takeout)
+        return final
+
+    def final(self, game_id: int) -> RaceOdds | None:
+        """最終オッズを返す。まだ締め切っていないときはNone
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        RaceOdds | None
+            最終オッズ
+        """
+        return self._final.get(game_id)
+
+    def set_final(self, game_id: int, odds: RaceOdds) -> None:
+        """保存先から読み込んだ最終オッズを登録する
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+        odds : RaceOdds
+            最終オッズ
+        """
+        self._closed.add(game_id)
+        self._final[game_id] = odds
+
+    async def _ensure_pool(self, game_id: int) -> None:
+        if game_id in self._pools:
+            return
+        async with self._load_lock:
+            if game_id not in self._pools:
+                pool = await self.loader(game_id)
+                with self._lock:
+                    self._pools[game_id] = pool
@@ -0,0 +1,65 @@
+import json
+import os
+from pathlib import Path
+
+
+def odds_path(game_id: int, dir_path: str) -> Path:
+    """最終オッズのファイルのパスを返す。
+
+    ファイル名は"race_{game_id}_odds.json"とする。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    Path
+        最終オッズのファイルのパス
+    """
+    return Path(dir_path) / f"race_{game_id}_odds.json"
+
+
+def save_final_odds(game_id: int, odds: dict, dir_path: str) -> None:
+    """最終オッズを保存する。
+
+    一時ファイルに書いてから置き換えるため、読み込み側が書き込み途中の
+    ファイルを読むことはない。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    odds : dict
+        RaceOdds.to_dict の戻り値
+    dir_path : str
+        データ保存ディレクトリパス
+    """
+    path = odds_path(game_id, dir_path)
+    tmp_path = path.with_suffix(".json.tmp")
+    tmp_path.write_text(json.dumps(odds))
+    os.replace(tmp_path, path)
+
+
+def load_final_odds(game_id: int, dir_path: str) -> dict | None:
+    """最終オッズを読み込む。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    dict | None
+        RaceOdds.to_dict の形式の辞書。保存されていないときはNone
+    """
+    path = odds_path(game_id, dir_path)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
@@ -1,12 +1,14 @@
-import os
-from pathlib import Path
-
-import pandas as pd
+from keima.backend.metrics.metrics import metrics
+from keima.backend.race_result.result_store import get_result_store
 
 
+@metrics.timed("load_result")
 def load_result(game_id: int, dir_path: str) -> list[int]:
     """レース結果を読み込む。
 
+    結果は dir_path ごとの ResultStore の索引から返し、
+    ファイルを毎回読み直さない。
+
     Parameters
     ----------
     game_id : int
@@ -19,14 +21,24 @@ def load_result(game_id: int, dir_path: str) -> list[int]:
     list[int]
         レース結果
     """
-    dir_path = Path(dir_path)
-    df_path = dir_path / "race_results.csv"
+    return get_result_store(dir_path).load(game_id)
+
 
-    df = pd.read_csv(df_path)
-    results = df.loc[df["game_id"] == game_id]
-    if results.empty:
-        raise ValueError(f"No results found for game_id {game_id}")
+def load_results(game_ids: list[int], dir_path: str) -> dict[int, list[int]]:
+    """複数レースの結果をまとめて読み込む。
+
+    結果が保存されていないgame_idは戻り値に含めない。
+
+    Parameters
+    ----------
+    game_ids : list[int]
+        レースIDのリスト
+    dir_path : str
+        レース結果保存ディレクトリパス
 
-    KEIMA_NUM_PLAYERS = int(os.getenv("KEIMA_NUM_PLAYERS", "4"))
-    result_row = results.iloc[0]
-    return [result_row[f"racer_{i + 1}"] for i in range(KEIMA_NUM_PLAYERS)]
+    Returns
+    -------
+    dict[int, list[int]]
+        game_idとレース結果の辞書
+    """
+    return get_result_store(dir_path).load_many(game_ids)
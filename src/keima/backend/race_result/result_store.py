@@ -0,0 +1,209 @@
+import csv
+import io
+import os
+import threading
+from pathlib import Path
+
+from keima.backend.metrics.metrics import metrics
+from keima.myexception.backend import InvalidPlayerCountError
+
+RESULTS_FILE = "race_results.csv"
+# 以前の save_result が書き込んでいたファイル名
+LEGACY_RESULTS_FILE = "race_result.csv"
+
+
+class ResultStore:
+    """game_idをキーにしたレース結果のメモリ上の索引
+
+    最初の参照時にレース結果ファイルを1回だけ読み込み、以降の参照はメモリから返す。
+    保存時はファイル末尾に1行追記し、索引にも追加する。
+    他のプロセスが追記したときは、ファイルサイズの増加を検知して
+    増えた部分だけを読み込む。
+    同じgame_idの結果が複数あるときは、最初の行を使う。
+
+    Parameters
+    ----------
+    dir_path : str
+        レース結果保存ディレクトリパス
+    """
+
+    def __init__(self, dir_path: str) -> None:
+        self.path = Path(dir_path) / RESULTS_FILE
+        self.legacy_path = Path(dir_path) / LEGACY_RESULTS_FILE
+        self._results: dict[int, list[int]] = {}
+        self._columns: list[str] | None = None
+        self._offset = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def save(self, game_id: int, result: list[int]) -> None:
+        """レース結果を1行追記する。
+
+        Parameters
+        ----------
+        game_id : int
+            レースID
+        result : list[int]
+            レース結果
+        """
+        KEIMA_NUM_PLAYERS = int(os.getenv("KEIMA_NUM_PLAYERS", "4"))
+        if len(result) != KEIMA_NUM_PLAYERS:
+            raise InvalidPlayerCountError(
+                f"result must contain {KEIMA_NUM_PLAYERS} player numbers"
+            )
+
+        with self._lock:
+            self._refresh()
+            columns = self._columns or ["game_id"] + [
+                f"racer_{i + 1}" for i in range(len(result))
+            ]
+            row = dict(zip(columns[1:], result, strict=False))
+            row["game_id"] = game_id
+
+            buf = io.StringIO()
+            writer = csv.DictWriter(buf, columns, lineterminator="\n")
+            if self._columns is None:
+                writer.writeheader()
+            writer.writerow(row)
+            with open(self.path, "a", newline="") as f:
+                f.write(buf.getvalue())
+            metrics.record_io("results", "write", 1, len(buf.getvalue()))
+
+            self._columns = columns
+            self._offset = self.path.stat().st_size
+            self._results.setdefault(int(game_id), [int(r) for r in result])
+
+    def load(self, game_id: int) -> list[int]:
+        """レース結果を返す。
+
+        Parameters
+        ----------
+        game_id : int
+            レースID
+
+        Returns
+        -------
+        list[int]
+            レース結果
+        """
+        results = self.load_many([game_id])
+        if game_id not in results:
+            raise ValueError(f"No results found for game_id {game_id}")
+        return results[game_id]
+
+    def load_many(self, game_ids: list[int]) -> dict[int, list[int]]:
+        """複数レースの結果をまとめて返す。
+
+        結果が保存されていないgame_idは戻り値に含めない。
+
+        Parameters
+        ----------
+        game_ids : list[int]
+            レースIDのリスト
+
+        Returns
+        -------
+        dict[int, list[int]]
+            game_idとレース結果の辞書
+        """
+        KEIMA_NUM_PLAYERS = int(os.getenv("KEIMA_NUM_PLAYERS", "4"))
+        with self._lock:
+            self._refresh()
+            return {
+                game_id: self._results[game_id][:KEIMA_NUM_PLAYERS]
+                for game_id in game_ids
+                if game_id in self._results
+            }
+
+    def snapshot(self) -> tuple[dict[int, list[int]], list[str] | None, int] | None:
+        """チェックポイント用に、索引と読み込み済みのファイルサイズを返す
+
+        Returns
+        -------
+        tuple[dict[int, list[int]], list[str] | None, int] | None
+            (game_idとレース結果の辞書, 列名, 読み込み済みのバイト数)。
+            まだファイルを読み込んでいないときはNone
+        """
+        with self._lock:
+            if not self._loaded:
+                return None
+            return dict(self._results), self._columns, self._offset
+
+    def restore(
+        self, results: dict[int, list[int]], columns: list[str] | None, offset: int
+    ) -> bool:
+        """チェックポイントの索引を読み込む。
+
+        ファイルがチェックポイントより短くなっているときは読み込まない。
+        チェックポイントの後に追記された行は、次の参照時に読み込む。
+
+        Returns
+        -------
+        bool
+            読み込んだかどうか
+        """
+        size = self.path.stat().st_size if self.path.exists() else 0
+        with self._lock:
+            if self._loaded or size < offset:
+                return False
+            self._results = dict(results)
+            self._columns = columns
+            self._offset = offset
+            self._loaded = True
+            return True
+
+    def refresh(self) -> None:
+        """ファイルの変更を索引に反映する。起動時に呼ぶと索引を先に作っておける"""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self) -> None:
+        if not self._loaded:
+            self._loaded = True
+            if self.legacy_path.exists():
+                with open(self.legacy_path, newline="") as f:
+                    self._add_rows(csv.reader(f), skip_header=True)
+
+        size = self.path.stat().st_size if self.path.exists() else 0
+        if size == self._offset:
+            return
+        if size < self._offset:
+            # ファイルが書き直されたときは最初から読み直す
+            self._results.clear()
+            self._columns = None
+            self._offset = 0
+            self._loaded = False
+            self._refresh()
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # 書き込み途中の最後の行は、次回の参照まで読まない
+        data = data[: data.rfind(b"\n") + 1]
+        metrics.record_io("results", "read", data.count(b"\n"), len(data))
+        rows = csv.reader(data.decode().splitlines())
+        if self._offset == 0:
+            self._columns = next(rows, None)
+        self._add_rows(rows)
+        self._offset += len(data)
+
+    def _add_rows(self, rows, skip_header: bool = False) -> None:
+        if skip_header:
+            next(rows, None)
+        for row in rows:
+            if row:
+                self._results.setdefault(int(row[0]), [int(r) for r in row[1:]])
+
+
+_stores: dict[str, ResultStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_result_store(dir_path: str) -> ResultStore:
+    """dir_pathごとに1つの ResultStore を返す"""
+    key = str(Path(dir_path).resolve())
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ResultStore(dir_path)
+        return _stores[key]
@@ -0,0 +1,31 @@
+import os
+
+from keima.backend.app_class.app_class import RaceStateService
+from keima.backend.race_state.sqlite_race_state import SqliteRaceStateService
+
+
+def create_race_state_service(dir_path: str) -> RaceStateService:
+    """環境変数 KEIMA_RACE_STATE に応じたレースの状態の保存先を作る。
+
+    - "memory" (デフォルト): プロセスのメモリ上。1ワーカーのとき
+    - "sqlite": KEIMA_RACE_STATE_PATH (デフォルトは "{dir_path}/race_state.sqlite3")。
+      複数ワーカーで共有するとき
+
+    Parameters
+    ----------
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    RaceStateService
+        レースの状態
+    """
+    race_state_type = os.getenv("KEIMA_RACE_STATE", "memory")
+    if race_state_type == "memory":
+        return RaceStateService()
+    if race_state_type == "sqlite":
+        return SqliteRaceStateService(
+            os.getenv("KEIMA_RACE_STATE_PATH", f"{dir_path}/race_state.sqlite3")
+        )
+    raise ValueError(f"Unknown KEIMA_RACE_STATE: {race_state_type}")
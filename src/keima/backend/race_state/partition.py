@@ -0,0 +1,52 @@
+import os
+
+
+class RacePartition:
+    """複数のサーバーでレースを分担するときの、このサーバーの担当
+
+    game_id を count で割った余りが index のレースを担当する。
+    購入受付中のオッズや受付中の購入数はプロセスのメモリ上にあるため、
+    1つのレースの購入と締め切りは同じサーバーで受け付ける。
+    リバースプロキシなどで game_id ごとに振り分けて使う。
+
+    Parameters
+    ----------
+    index : int, optional
+        このサーバーの番号 (0 から count - 1), by default 0
+    count : int, optional
+        サーバーの数, by default 1
+    """
+
+    def __init__(self, index: int = 0, count: int = 1) -> None:
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"Invalid race partition: {index}/{count}")
+        self.index = index
+        self.count = count
+
+    def owns(self, game_id: int) -> bool:
+        """game_idのレースをこのサーバーが担当するか
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        bool
+            担当するときはTrue
+        """
+        return game_id % self.count == self.index
+
+    @classmethod
+    def from_env(cls) -> "RacePartition":
+        """環境変数 KEIMA_RACE_PARTITION ("index/count") から作る
+
+        Returns
+        -------
+        RacePartition
+            未設定のときは全てのレースを担当する RacePartition
+        """
+        value = os.getenv("KEIMA_RACE_PARTITION", "0/1")
+        index, count = value.split("/")
+        return cls(int(index), int(count))
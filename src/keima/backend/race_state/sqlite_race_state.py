@@ -0,0 +1,156 @@
+import sqlite3
+import threading
+
+from keima.backend.app_class.app_class import RaceState, RaceStateService
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS race_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    game_id INTEGER NOT NULL,
+    ticket_buy INTEGER NOT NULL,
+    ticket_paid INTEGER NOT NULL,
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO race_state (id, game_id, ticket_buy, ticket_paid, version)
+VALUES (1, 0, 0, 0, 0);
+CREATE TABLE IF NOT EXISTS races (
+    game_id INTEGER PRIMARY KEY,
+    ticket_buy INTEGER NOT NULL,
+    ticket_paid INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO races (game_id, ticket_buy, ticket_paid)
+SELECT game_id, ticket_buy, ticket_paid FROM race_state WHERE id = 1;
+"""
+
+
+class SqliteRaceStateService(RaceStateService):
+    """SQLiteに保存し、全ワーカーで共有するレースの状態
+
+    レースごとの状態を races テーブルに、現在のレースを race_state テーブルの
+    1行に、更新のたびに1増える version と一緒に保存する。
+    各プロセスは読み込んだ状態をスレッドごとにキャッシュし、
+    PRAGMA data_version (他の接続が書き込んだときだけ変わる) が変わっていなければ
+    テーブルを読まずにキャッシュを返す。
+    再起動しても状態は残る。
+
+    Parameters
+    ----------
+    db_path : str
+        SQLiteのデータベースファイルのパス
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._conn().executescript(SCHEMA)
+
+    @property
+    def race_state(self) -> RaceState:
+        return self.load()[0]
+
+    @race_state.setter
+    def race_state(self, race_state: RaceState) -> None:
+        self.update(race_state)
+
+    @property
+    def version(self) -> int:
+        """更新のたびに1増える番号"""
+        return self.load()[1]
+
+    @property
+    def races(self) -> dict[int, RaceState]:
+        """レース番号ごとのレースの状態"""
+        return self._load()[2]
+
+    def load(self) -> tuple[RaceState, int]:
+        """現在のレースの状態とversionを返す
+
+        Returns
+        -------
+        tuple[RaceState, int]
+            現在のレースの状態とversion
+        """
+        race_state, version, _ = self._load()
+        return race_state, version
+
+    def update(self, race_state: RaceState) -> RaceState:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _, version, races = self._select(conn)
+            previous = races.get(
+                race_state.game_id, RaceState(game_id=race_state.game_id)
+            )
+            values = (race_state.game_id, race_state.ticket_buy, race_state.ticket_paid)
+            conn.execute(
+                "INSERT OR REPLACE INTO races (game_id, ticket_buy, ticket_paid) "
+                "VALUES (?, ?, ?)",
+                values,
+            )
+            conn.execute(
+                "UPDATE race_state "
+                "SET game_id = ?, ticket_buy = ?, ticket_paid = ?, version = ? "
+                "WHERE id = 1",
+                (*values, version + 1),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        # 自分の接続の書き込みでは data_version は変わらない
+        (data_version,) = conn.execute("PRAGMA data_version").fetchone()
+        race_state = race_state.model_copy()
+        races = {**races, race_state.game_id: race_state}
+        self._local.cached = (data_version, race_state, version + 1, races)
+        return previous
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _load(self) -> tuple[RaceState, int, dict[int, RaceState]]:
+        conn = self._conn()
+        (data_version,) = conn.execute("PRAGMA data_version").fetchone()
+        cached = getattr(self._local, "cached", None)
+        if cached is not None and cached[0] == data_version:
+            return cached[1:]
+        selected = self._select(conn)
+        self._local.cached = (data_version, *selected)
+        return selected
+
+    def _select(
+        self, conn: sqlite3.Connection
+    ) -> tuple[RaceState, int, dict[int, RaceState]]:
+        game_id, ticket_buy, ticket_paid, version = conn.execute(
+            "SELECT game_id, ticket_buy, ticket_paid, version FROM race_state "
+            "WHERE id = 1"
+        ).fetchone()
+        race_state = RaceState(
+            game_id=game_id, ticket_buy=bool(ticket_buy), ticket_paid=bool(ticket_paid)
+        )
+        races = {
+            row[0]: RaceState(
+                game_id=row[0], ticket_buy=bool(row[1]), ticket_paid=bool(row[2])
+            )
+            for row in conn.execute(
+                "SELECT game_id, ticket_buy, ticket_paid FROM races"
+            )
+        }
+        return race_state, version, races
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
@@ -1,9 +1,24 @@
+import math
 import os
 
+import numpy as np
 import pandas as pd
 
+from keima.backend.metrics.metrics import metrics
+from keima.backend.odds.odds import RaceOdds
+from keima.backend.tickets.outcome_pool import OutcomePool
+from keima.backend.tickets.ticket_batch import (
+    EXACTA,
+    NO_PLAYER,
+    TRIFECTA,
+    WIN,
+)
 from keima.myexception.backend import InvalidPlayerCountError
 
+reward_tickets = metrics.counter(
+    "keima_reward_tickets_total", "Tickets scored by Reward.reward_point."
+)
+
 
 class Reward:
     def __init__(
@@ -24,6 +39,7 @@ class Reward:
         self.exacta_rate = exacta_rate
         self.trifecta_rate = trifecta_rate
 
+    @metrics.timed("reward_point")
     def reward_point(
         self, df: pd.DataFrame, result: list[int], game_id: int | None = None
     ) -> int:
@@ -52,40 +68,96 @@ class Reward:
         int
             獲得ポイント
         """
-        KEIMA_NUM_PLAYERS = int(os.getenv("KEIMA_NUM_PLAYERS", "4"))
-        if len(result) != KEIMA_NUM_PLAYERS:
-            raise InvalidPlayerCountError(
-                f"result must contain {KEIMA_NUM_PLAYERS} player numbers"
-            )
+        self._check_result(result)
 
         if df.empty:
             return 0
 
-        if game_id is None:
-            game_id = df["game_id"].max()
-
-        df = df[df["game_id"] == game_id]
+        df = self._filter_game(df, game_id)
+        if metrics.enabled:
+            reward_tickets.inc(amount=len(df))
+        return int((self._hit_rates(df, result) * df["unit"].to_numpy()).sum())
 
-        single_tickets = df[df["ticket_type"] == "win"]
-        exacta_tickets = df[df["ticket_type"] == "exacta"]
-        trifecta_tickets = df[df["ticket_type"] == "trifecta"]
-
-        point = 0
+    def reward_pool(
+        self, pool: OutcomePool, result: list[int], odds: RaceOdds | None = None
+    ) -> int:
+        """的中条件ごとに集計したチケットの獲得pointを計算する
 
-        for _, ticket in single_tickets.iterrows():
-            if ticket["one"] == result[0]:
-                point += self.single_rate * ticket["unit"]
+        チケットの枚数によらず、'win'、'exacta'、'trifecta' の的中条件を
+        1つずつ参照するだけで計算する。
+        oddsを指定したときは、固定の倍率の代わりにオッズで計算し、
+        ticket_typeごとに小数点以下を切り捨てる。
 
-        for _, ticket in exacta_tickets.iterrows():
-            if ticket["one"] == result[0] and ticket["two"] == result[1]:
-                point += self.exacta_rate * ticket["unit"]
+        Parameters
+        ----------
+        pool : OutcomePool
+            1チーム1レース分のチケットの集計
+        result : list[int]
+            レースの結果リスト。
+        odds : RaceOdds | None, optional
+            締め切り時の最終オッズ, by default None
 
-        for _, ticket in trifecta_tickets.iterrows():
-            if (
-                ticket["one"] == result[0]
-                and ticket["two"] == result[1]
-                and ticket["three"] == result[2]
-            ):
-                point += self.trifecta_rate * ticket["unit"]
+        Returns
+        -------
+        int
+            獲得ポイント
+        """
+        self._check_result(result)
+
+        first, second, third = result[:3]
+        keys = [
+            (WIN, first, NO_PLAYER, NO_PLAYER),
+            (EXACTA, first, second, NO_PLAYER),
+            (TRIFECTA, first, second, third),
+        ]
+        if odds is None:
+            rates = [self.single_rate, self.exacta_rate, self.trifecta_rate]
+            return sum(rate * pool.get(*key) for rate, key in zip(rates, keys))
+        return sum(math.floor(odds.payout(key) * pool.get(*key)) for key in keys)
+
+    def _check_result(self, result: list[int]) -> None:
+        KEIMA_NUM_PLAYERS = int(os.getenv("KEIMA_NUM_PLAYERS", "4"))
+        if len(result) != KEIMA_NUM_PLAYERS:
+            raise InvalidPlayerCountError(
+                f"result must contain {KEIMA_NUM_PLAYERS} player numbers"
+            )
 
-        return point
+    def _filter_game(self, df: pd.DataFrame, game_id: int | None) -> pd.DataFrame:
+        """game_id 列があるときは対象ゲームの行だけに絞る"""
+        if "game_id" not in df.columns:
+            return df
+        if game_id is None:
+            game_id = df["game_id"].max()
+        return df[df["game_id"] == game_id]
+
+    def _hit_rates(self, df: pd.DataFrame, result: list[int]) -> np.ndarray:
+        """各チケットが的中していればその倍率、外れていれば0の配列を返す"""
+        ticket_type = df["ticket_type"].to_numpy()
+        return self._rates(
+            ticket_type == "win",
+            ticket_type == "exacta",
+            ticket_type == "trifecta",
+            df["one"].to_numpy(),
+            df["two"].to_numpy(),
+            df["three"].to_numpy(),
+            result,
+        )
+
+    def _rates(
+        self,
+        is_win: np.ndarray,
+        is_exacta: np.ndarray,
+        is_trifecta: np.ndarray,
+        one: np.ndarray,
+        two: np.ndarray,
+        three: np.ndarray,
+        result: list[int],
+    ) -> np.ndarray:
+        hit_one = one == result[0]
+        hit_two = hit_one & (two == result[1])
+        hit_three = hit_two & (three == result[2])
+        return np.select(
+            [is_win & hit_one, is_exacta & hit_two, is_trifecta & hit_three],
+            [self.single_rate, self.exacta_rate, self.trifecta_rate],
+            default=0,
+        )
@@ -0,0 +1,228 @@
+import asyncio
+import contextlib
+import uuid
+from collections.abc import Awaitable, Callable
+
+from keima.backend.locks.team_lock import TeamLockManager
+from keima.backend.odds.odds import RaceOdds
+from keima.backend.reward.reward import Reward
+from keima.backend.settlement.settle import commit_scores, score_pools
+from keima.backend.storage.base import Storage
+from keima.myexception.backend import SettlementJobExistsError
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class SettlementJob:
+    """レース精算のジョブの進捗
+
+    Parameters
+    ----------
+    job_id : str
+        ジョブID
+    game_id : int
+        レース番号
+    """
+
+    def __init__(self, job_id: str, game_id: int) -> None:
+        self.job_id = job_id
+        self.game_id = game_id
+        self.status = QUEUED
+        self.total_teams = 0
+        self.skipped_teams = 0
+        self.processed_teams = 0
+        self.coins_paid = 0
+        self.coins_rewarded = 0
+        self.error: str | None = None
+
+    def to_dict(self) -> dict:
+        """進捗を辞書で返す
+
+        Returns
+        -------
+        dict
+            ジョブID、レース番号、状態、teamの数 (全体・開始前に精算済み・
+            このジョブで精算済み)、支払いcoinと報酬coinの合計、エラー
+        """
+        return {
+            "job_id": self.job_id,
+            "game_id": self.game_id,
+            "status": self.status,
+            "total_teams": self.total_teams,
+            "skipped_teams": self.skipped_teams,
+            "processed_teams": self.processed_teams,
+            "coins_paid": self.coins_paid,
+            "coins_rewarded": self.coins_rewarded,
+            "error": self.error,
+        }
+
+
+class SettlementJobQueue:
+    """レース精算をバックグラウンドで1つずつ実行する
+
+    teamを chunk_size ずつ精算し、精算のたびに進捗を更新する。
+    精算済みのteamは Storage.load_settled で確かめて飛ばすため、
+    途中で落ちたジョブは同じレースで投入し直せば続きから再開する。
+    同じレースのジョブは、待機中・実行中・完了のものがあれば受け付けない。
+    locks を渡すと、精算するteamのロックを取ってからコミットするため、
+    同じteamの /admin/pay_tickets などと同時にはコミットしない。
+
+    Parameters
+    ----------
+    run : Callable[..., Awaitable]
+        ブロックする読み書きを実行する関数 (StorageExecutor.run など)
+    chunk_size : int, optional
+        1回に精算するteamの数, by default 64
+    on_settled : Callable[[dict[str, dict[str, int]]], None] | None, optional
+        teamを精算するたびに、commit_scores の戻り値で呼ばれる関数,
+        by default None
+    locks : TeamLockManager | None, optional
+        コミットの間に取るteamのロック, by default None
+    """
+
+    def __init__(
+        self,
+        run: Callable[..., Awaitable],
+        chunk_size: int = 64,
+        on_settled: Callable[[dict[str, dict[str, int]]], None] | None = None,
+        locks: TeamLockManager | None = None,
+    ) -> None:
+        self.run = run
+        self.chunk_size = chunk_size
+        self.on_settled = on_settled
+        self.locks = locks
+        self._jobs: dict[str, SettlementJob] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+
+    def submit(
+        self,
+        game_id: int,
+        storage: Storage,
+        reward: Reward,
+        odds: RaceOdds | None = None,
+    ) -> SettlementJob:
+        """レース精算のジョブを投入する
+
+        イベントループ上で呼ぶこと。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+        storage : Storage
+            データの保存先
+        reward : Reward
+            得点計算クラス
+        odds : RaceOdds | None, optional
+            オッズで報酬を計算するときの最終オッズ, by default None
+
+        Returns
+        -------
+        SettlementJob
+            投入したジョブ
+
+        Raises
+        ------
+        SettlementJobExistsError
+            同じレースのジョブが待機中・実行中・完了のとき
+        """
+        for job in self._jobs.values():
+            if job.game_id == game_id and job.status != FAILED:
+                raise SettlementJobExistsError(
+                    f"Settlement job {job.job_id} for game {game_id} is {job.status}."
+                )
+        job = SettlementJob(uuid.uuid4().hex, game_id)
+        self._jobs[job.job_id] = job
+        task = asyncio.create_task(self._run(job, storage, reward, odds))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id: str) -> SettlementJob | None:
+        """ジョブを返す
+
+        Parameters
+        ----------
+        job_id : str
+            ジョブID
+
+        Returns
+        -------
+        SettlementJob | None
+            ジョブ。存在しないときはNone
+        """
+        return self._jobs.get(job_id)
+
+    def active(self, game_id: int) -> bool:
+        """レースのジョブが待機中か実行中かを返す
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        bool
+            待機中か実行中のジョブがあるかどうか
+        """
+        return any(
+            job.game_id == game_id and job.status in (QUEUED, RUNNING)
+            for job in self._jobs.values()
+        )
+
+    async def join(self) -> None:
+        """投入済みのジョブが全て終わるまで待つ"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    async def _run(
+        self,
+        job: SettlementJob,
+        storage: Storage,
+        reward: Reward,
+        odds: RaceOdds | None,
+    ) -> None:
+        async with self._lock:
+            job.status = RUNNING
+            try:
+                await self._settle(job, storage, reward, odds)
+            except Exception as e:  # noqa: BLE001  失敗はジョブの状態で返す
+                job.status = FAILED
+                job.error = f"{type(e).__name__}: {e}"
+            else:
+                job.status = DONE
+
+    async def _settle(
+        self,
+        job: SettlementJob,
+        storage: Storage,
+        reward: Reward,
+        odds: RaceOdds | None,
+    ) -> None:
+        result = await self.run(storage.load_result, job.game_id)
+        pools = await self.run(storage.load_pools, job.game_id)
+        settled = await self.run(storage.load_settled, job.game_id)
+        pending = [team_name for team_name in pools if team_name not in settled]
+        job.total_teams = len(pools)
+        job.skipped_teams = len(pools) - len(pending)
+
+        for i in range(0, len(pending), self.chunk_size):
+            chunk = {t: pools[t] for t in pending[i : i + self.chunk_size]}
+            scores = score_pools(chunk, reward, result, odds)
+            async with (
+                self.locks.lock_many(scores)
+                if self.locks is not None
+                else contextlib.nullcontext()
+            ):
+                settlement = await self.run(commit_scores, job.game_id, storage, scores)
+            job.processed_teams += len(settlement)
+            job.coins_paid += sum(s["paid"] for s in settlement.values())
+            job.coins_rewarded += sum(s["reward"] for s in settlement.values())
+            if self.on_settled is not None:
+                self.on_settled(settlement)
@@ -0,0 +1,150 @@
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from keima.backend.odds.odds import RaceOdds
+from keima.backend.reward.reward import Reward
+from keima.backend.settlement.settle import commit_scores
+from keima.backend.storage.base import Storage
+from keima.backend.tickets.outcome_pool import OutcomePool
+from keima.backend.tickets.ticket_batch import TicketBatch
+
+
+def create_settle_executor(workers: int | None = None) -> ProcessPoolExecutor:
+    """精算に使う ProcessPoolExecutor を作る
+
+    スレッドを使っているプロセスから fork しないよう、spawn でワーカーを作る。
+
+    Parameters
+    ----------
+    workers : int | None, optional
+        ワーカーの数, by default None (CPUの数)
+
+    Returns
+    -------
+    ProcessPoolExecutor
+        精算に使う ProcessPoolExecutor
+    """
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def score_teams(
+    storage: Storage,
+    game_id: int,
+    team_names: list[str],
+    reward: Reward,
+    result: list[int],
+    odds: RaceOdds | None = None,
+) -> dict[str, tuple[int, int]]:
+    """teamのチケットを読み込み、支払いcoinと報酬coinを計算する
+
+    ProcessPoolExecutor のワーカーで呼ぶため、引数はすべて pickle できる。
+    チケットを集計してから Reward.reward_pool で計算するので、
+    購入時の集計から計算する settle_tickets と同じ値になる。
+
+    Parameters
+    ----------
+    storage : Storage
+        データの保存先
+    game_id : int
+        レース番号
+    team_names : list[str]
+        計算するteamの名前のリスト
+    reward : Reward
+        得点計算クラス
+    result : list[int]
+        レースの結果リスト
+    odds : RaceOdds | None, optional
+        オッズで報酬を計算するときの最終オッズ, by default None
+
+    Returns
+    -------
+    dict[str, tuple[int, int]]
+        team_nameと (支払いcoin, 報酬coin) の辞書
+    """
+    scores = {}
+    for team_name in team_names:
+        tickets = TicketBatch.from_frame(storage.load_tickets(team_name, game_id))
+        pool = OutcomePool.from_tickets(tickets)
+        scores[team_name] = (pool.total, reward.reward_pool(pool, result, odds))
+    return scores
+
+
+def settle_tickets_parallel(
+    game_id: int,
+    storage: Storage,
+    reward: Reward,
+    odds: RaceOdds | None = None,
+    workers: int | None = None,
+    chunk_size: int = 64,
+    executor: Executor | None = None,
+) -> dict[str, dict[str, int]]:
+    """チケットを読み直し、複数のプロセスで計算してレースを精算する。
+
+    teamを chunk_size ずつに分け、ワーカーのプロセスでチケットの読み込みと
+    計算を行う。親のプロセスで結果をまとめ、新しいcoin残高は
+    Storage.settle_teams で全チーム分を一括で書き込む。
+    精算済みのteamは飛ばし、精算結果は settle_tickets と同じになる。
+
+    Parameters
+    ----------
+    game_id : int
+        レース番号
+    storage : Storage
+        データの保存先。ワーカーには pickle して渡す
+    reward : Reward
+        得点計算クラス
+    odds : RaceOdds | None, optional
+        オッズで報酬を計算するときの最終オッズ, by default None
+    workers : int | None, optional
+        executorを指定しないときに作るワーカーの数。
+        1のときはプロセスを作らずに計算する, by default None (CPUの数)
+    chunk_size : int, optional
+        1回にワーカーに渡すteamの数, by default 64
+    executor : Executor | None, optional
+        計算に使う Executor。指定したときはworkersを使わない, by default None
+
+    Returns
+    -------
+    dict[str, dict[str, int]]
+        team_nameと、支払いcoin("paid")、報酬coin("reward")、
+        精算後のcoin数("team_coins")の辞書。精算済みのteamは含まない
+    """
+    result = storage.load_result(game_id)
+    settled = storage.load_settled(game_id)
+    team_names = [t for t in storage.game_teams(game_id) if t not in settled]
+    if not team_names:
+        return {}
+
+    chunks = [
+        team_names[i : i + chunk_size] for i in range(0, len(team_names), chunk_size)
+    ]
+    if executor is None and workers == 1:
+        scores = score_teams(storage, game_id, team_names, reward, result, odds)
+    elif executor is None:
+        with create_settle_executor(workers) as pool_executor:
+            scores = _score_chunks(
+                pool_executor, chunks, storage, game_id, reward, result, odds
+            )
+    else:
+        scores = _score_chunks(executor, chunks, storage, game_id, reward, result, odds)
+
+    return commit_scores(game_id, storage, scores)
+
+
+def _score_chunks(
+    executor: Executor,
+    chunks: list[list[str]],
+    storage: Storage,
+    game_id: int,
+    reward: Reward,
+    result: list[int],
+    odds: RaceOdds | None,
+) -> dict[str, tuple[int, int]]:
+    futures = [
+        executor.submit(score_teams, storage, game_id, chunk, reward, result, odds)
+        for chunk in chunks
+    ]
+    scores = {}
+    for future in futures:
+        scores.update(future.result())
+    return scores
@@ -0,0 +1,108 @@
+from keima.backend.odds.odds import RaceOdds
+from keima.backend.reward.reward import Reward
+from keima.backend.storage.base import Storage
+from keima.backend.tickets.outcome_pool import OutcomePool
+
+
+def settle_tickets(
+    game_id: int, storage: Storage, reward: Reward, odds: RaceOdds | None = None
+) -> dict[str, dict[str, int]]:
+    """レースの全チームのチケットの支払いと報酬をまとめて精算する。
+
+    レース結果は1回だけ読み込み、購入時に更新しているチケットの集計から
+    支払いcoinと報酬coinを計算する。チケット自体は読み直さないため、
+    計算量はチケットの枚数によらずチーム数に比例する。
+    新しいcoin残高は Storage.settle_teams で全チーム分を一括で書き込み、
+    精算済みとして記録する。精算済みのteamは飛ばす。
+
+    Parameters
+    ----------
+    game_id : int
+        レース番号
+    storage : Storage
+        データの保存先
+    reward : Reward
+        得点計算クラス
+    odds : RaceOdds | None, optional
+        オッズで報酬を計算するときの最終オッズ, by default None
+
+    Returns
+    -------
+    dict[str, dict[str, int]]
+        team_nameと、支払いcoin("paid")、報酬coin("reward")、
+        精算後のcoin数("team_coins")の辞書。精算済みのteamは含まない
+    """
+    result = storage.load_result(game_id)
+
+    settled = storage.load_settled(game_id)
+    pools = {
+        team_name: pool
+        for team_name, pool in storage.load_pools(game_id).items()
+        if team_name not in settled
+    }
+    scores = score_pools(pools, reward, result, odds)
+    return commit_scores(game_id, storage, scores)
+
+
+def score_pools(
+    pools: dict[str, OutcomePool],
+    reward: Reward,
+    result: list[int],
+    odds: RaceOdds | None = None,
+) -> dict[str, tuple[int, int]]:
+    """teamのチケットの集計から、支払いcoinと報酬coinを計算する
+
+    Parameters
+    ----------
+    pools : dict[str, OutcomePool]
+        team_nameとチケットの集計の辞書
+    reward : Reward
+        得点計算クラス
+    result : list[int]
+        レースの結果リスト
+    odds : RaceOdds | None, optional
+        オッズで報酬を計算するときの最終オッズ, by default None
+
+    Returns
+    -------
+    dict[str, tuple[int, int]]
+        team_nameと (支払いcoin, 報酬coin) の辞書
+    """
+    return {
+        team_name: (pool.total, reward.reward_pool(pool, result, odds))
+        for team_name, pool in pools.items()
+    }
+
+
+def commit_scores(
+    game_id: int, storage: Storage, scores: dict[str, tuple[int, int]]
+) -> dict[str, dict[str, int]]:
+    """支払いcoinと報酬coinをcoinに反映し、精算済みとして記録する
+
+    コミットの時点ですでに精算済みのteamは反映せず、戻り値にも含めない。
+
+    Parameters
+    ----------
+    game_id : int
+        レース番号
+    storage : Storage
+        データの保存先
+    scores : dict[str, tuple[int, int]]
+        team_nameと (支払いcoin, 報酬coin) の辞書
+
+    Returns
+    -------
+    dict[str, dict[str, int]]
+        team_nameと、支払いcoin("paid")、報酬coin("reward")、
+        精算後のcoin数("team_coins")の辞書 (このとき精算したteamだけ)
+    """
+    team_coins = storage.settle_teams(game_id, scores)
+    return {
+        team_name: {
+            "paid": paid,
+            "reward": rewarded,
+            "team_coins": int(team_coins[team_name]),
+        }
+        for team_name, (paid, rewarded) in scores.items()
+        if team_name in team_coins
+    }
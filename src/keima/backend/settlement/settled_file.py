@@ -0,0 +1,198 @@
+import csv
+import io
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from keima.backend.coins.get_coins import get_team_coins
+from keima.backend.coins.ledger import journal_lock, record_entry
+from keima.backend.coins.set_coins import apply_coins_journal, set_teams_coins
+
+SETTLED_COLUMNS = ["team_name", "paid", "reward"]
+
+# パス -> (読み込んだときの (mtime_ns, size), 精算済みのteam)
+_cache: dict[str, tuple[tuple[int, int], dict[str, tuple[int | None, int | None]]]] = {}
+_cache_lock = threading.Lock()
+
+
+def settled_path(game_id: int, dir_path: str) -> Path:
+    """精算済みのteamを記録するファイルのパスを返す。
+
+    ファイル名は"race_{game_id}_settled.csv"とし、ヘッダーは書かない。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    Path
+        精算済みのteamを記録するファイルのパス
+    """
+    return Path(dir_path) / f"race_{game_id}_settled.csv"
+
+
+def load_settled(
+    game_id: int, dir_path: str
+) -> dict[str, tuple[int | None, int | None]]:
+    """精算済みのteamを読み込む。
+
+    /admin/pay_tickets と /admin/reward_tickets で支払いと報酬を別々に
+    記録したteamは、まだ記録していない方をNoneで返す。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    dict[str, tuple[int | None, int | None]]
+        team_nameと (支払いcoin, 報酬coin) の辞書
+    """
+    path = settled_path(game_id, dir_path)
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return {}
+    if st.st_size == 0:
+        return {}
+    # 購入のたびのcoinの確認からも呼ぶため、ファイルが変わっていなければ読み直さない
+    stat = (st.st_mtime_ns, st.st_size)
+    with _cache_lock:
+        cached = _cache.get(str(path))
+    if cached is not None and cached[0] == stat:
+        return dict(cached[1])
+    df = pd.read_csv(path, names=SETTLED_COLUMNS, dtype={"team_name": str})
+    settled: dict[str, tuple[int | None, int | None]] = {}
+    for row in df.itertuples(index=False):
+        paid, rewarded = settled.get(row.team_name, (None, None))
+        if pd.notna(row.paid):
+            paid = int(row.paid)
+        if pd.notna(row.reward):
+            rewarded = int(row.reward)
+        settled[row.team_name] = (paid, rewarded)
+    with _cache_lock:
+        _cache[str(path)] = (stat, settled)
+    return dict(settled)
+
+
+def settle_teams(
+    game_id: int, scores: dict[str, tuple[int, int]], dir_path: str
+) -> dict[str, int]:
+    """teamのcoinに報酬と支払いの差を反映し、精算済みとして記録する。
+
+    coinの更新と精算済みの記録は set_teams_coins の同じjournalでコミットするため、
+    途中で落ちても片方だけが残ることはない。
+    精算済みのteamはjournalのロックを取ってから確かめ直し、飛ばす。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    scores : dict[str, tuple[int, int]]
+        team_nameと (支払いcoin, 報酬coin) の辞書
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    dict[str, int]
+        このとき精算したteamのteam_nameと、反映後のcoin数の辞書
+    """
+    if not scores:
+        return {}
+    return _commit_settlement(game_id, scores, dir_path)
+
+
+def settle_team_part(
+    game_id: int,
+    team_name: str,
+    paid: int | None,
+    rewarded: int | None,
+    dir_path: str,
+) -> int | None:
+    """teamの支払いか報酬の片方だけをcoinに反映し、精算済みとして記録する。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    team_name : str
+        teamの名前
+    paid : int | None
+        支払いcoin。Noneのときは支払わない
+    rewarded : int | None
+        報酬coin。Noneのときは報酬を払わない
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    int | None
+        反映後のcoin数。指定した方がすでに記録されているときはNone
+    """
+    team_coins = _commit_settlement(
+        game_id, {team_name: (paid, rewarded)}, dir_path, partial=True
+    )
+    return team_coins.get(team_name)
+
+
+def _commit_settlement(
+    game_id: int,
+    scores: dict[str, tuple[int | None, int | None]],
+    dir_path: str,
+    partial: bool = False,
+) -> dict[str, int]:
+    # coinの読み込みから記録の追記までの間に、他の一括更新を割り込ませない
+    with journal_lock.hold(dir_path):
+        # 中断された一括更新の追記を先に適用してから、追記前のサイズを記録する
+        apply_coins_journal(dir_path)
+        settled = load_settled(game_id, dir_path)
+        if partial:
+            scores = {
+                team_name: (paid, rewarded)
+                for team_name, (paid, rewarded) in scores.items()
+                if not _overlaps((paid, rewarded), settled.get(team_name))
+            }
+        else:
+            scores = {t: s for t, s in scores.items() if t not in settled}
+        if not scores:
+            return {}
+        team_coins = {
+            team_name: get_team_coins(team_name, dir_path)
+            + (rewarded or 0)
+            - (paid or 0)
+            for team_name, (paid, rewarded) in scores.items()
+        }
+        buf = io.StringIO()
+        # 記録しない方は空欄にする
+        csv.writer(buf, lineterminator="\n").writerows(
+            [
+                team_name,
+                "" if paid is None else paid,
+                "" if rewarded is None else rewarded,
+            ]
+            for team_name, (paid, rewarded) in scores.items()
+        )
+        record = record_entry(settled_path(game_id, dir_path), buf.getvalue())
+        set_teams_coins(team_coins, dir_path, records=[record])
+    return team_coins
+
+
+def _overlaps(
+    score: tuple[int | None, int | None], settled: tuple[int | None, int | None] | None
+) -> bool:
+    """score の支払いか報酬のうち、すでに記録されているものがあればTrue"""
+    if settled is None:
+        return False
+    return any(
+        new is not None and old is not None
+        for new, old in zip(score, settled, strict=True)
+    )
@@ -0,0 +1,556 @@
+from abc import ABC, abstractmethod
+from collections.abc import Iterable, Iterator
+
+import pandas as pd
+
+from keima.backend.tickets.outcome_pool import OutcomePool
+from keima.backend.tickets.ticket_batch import TicketBatch
+from keima.myexception.backend import NoCoinsDataError
+
+
+class Storage(ABC):
+    """coin、チケット、レース結果の保存先のインターフェース
+
+    CSVファイルに保存する CsvStorage と、SQLiteに保存する SqliteStorage がある。
+    coinの game_id の扱いは set_team_coins / get_team_coins と同じ。
+    """
+
+    @abstractmethod
+    def get_team_coins(self, team_name: str, game_id: int | None = None) -> int:
+        """teamのcoinを取得する。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        game_id : int | None, optional
+            ゲームID, by default None
+
+        Returns
+        -------
+        int
+            game_idが指定されているときはその行のcoin数、
+            指定されていないときは最新のcoin数
+        """
+
+    def get_cached_coins(
+        self, team_name: str, game_id: int | None = None
+    ) -> tuple[int, str] | None:
+        """ディスクを読まずに返せるときだけteamのcoinとversionを返す。
+
+        イベントループ上で呼ぶため、ファイルの読み込みやクエリはしない。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        game_id : int | None, optional
+            ゲームID, by default None
+
+        Returns
+        -------
+        tuple[int, str] | None
+            キャッシュにあるときはcoin数と get_coins_version と同じversion、
+            ないときはNone
+        """
+        return None
+
+    def get_coins_version(self, team_name: str) -> str | None:
+        """teamのcoinが書き込まれるたびに変わる文字列を返す。
+
+        coin自体は読み込まないため、変更の有無の確認に使う。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+
+        Returns
+        -------
+        str | None
+            coinのversion。coinがないときや、保存先が対応していないときはNone
+        """
+        return None
+
+    @abstractmethod
+    def set_team_coins(
+        self, team_name: str, coins: int, game_id: int | None = None
+    ) -> None:
+        """teamのcoinを設定する。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        coins : int
+            設定するcoinの数
+        game_id : int | None, optional
+            ゲームID。Noneのときは既存の最大値+1, by default None
+        """
+
+    @abstractmethod
+    def set_teams_coins(
+        self, team_coins: dict[str, int], game_id: int | None = None
+    ) -> None:
+        """複数teamのcoinを、全teamが更新されるかどれも更新されないかの
+        どちらかになるようにまとめて設定する。
+
+        Parameters
+        ----------
+        team_coins : dict[str, int]
+            team_nameと設定するcoinの数の辞書
+        game_id : int | None, optional
+            ゲームID, by default None
+        """
+
+    def add_teams_coins(self, team_deltas: dict[str, int]) -> dict[str, int]:
+        """複数teamの最新のcoinに増減をまとめて反映する。
+
+        Parameters
+        ----------
+        team_deltas : dict[str, int]
+            team_nameとcoinの増減の辞書
+
+        Returns
+        -------
+        dict[str, int]
+            team_nameと反映後のcoin数の辞書
+        """
+        team_coins = {
+            team_name: self.get_team_coins(team_name) + delta
+            for team_name, delta in team_deltas.items()
+        }
+        self.set_teams_coins(team_coins)
+        return team_coins
+
+    @abstractmethod
+    def append_tickets(
+        self, team_name: str, game_id: int, tickets: TicketBatch
+    ) -> None:
+        """teamのチケットを、同じレースで購入済みのチケットに追記する。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        game_id : int
+            レース番号
+        tickets : TicketBatch
+            購入したチケット
+        """
+
+    def append_teams_tickets(
+        self, game_id: int, team_tickets: dict[str, TicketBatch]
+    ) -> None:
+        """複数teamのチケットを、それぞれ同じレースで購入済みのチケットに追記する。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+        team_tickets : dict[str, TicketBatch]
+            team_nameと購入したチケットの辞書
+        """
+        for team_name, tickets in team_tickets.items():
+            self.append_tickets(team_name, game_id, tickets)
+
+    @abstractmethod
+    def get_reserved_coins(self, team_name: str, game_id: int) -> int:
+        """teamがレースで購入済みのチケットのunitの合計を返す。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        int
+            購入済みのunitの合計。チケットがないときは0
+        """
+
+    def reserve_tickets(
+        self,
+        team_name: str,
+        game_id: int,
+        tickets: TicketBatch,
+        other_game_ids: Iterable[int] = (),
+    ) -> bool:
+        """購入済みと今回のチケットのunitの合計がteamのcoin以下のときだけ
+        チケットを追記する。
+
+        coinの確認と追記の間に同じteamの書き込みが入らないよう、
+        呼び出し側でteamのロックを取っておくこと。
+        他のレースで購入済みのunitも、other_game_ids で指定すれば合計に含める。
+        購入を締め切ったレースも、teamの支払いを精算済みとして記録するまでは
+        coinから引かれていないため含める。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        game_id : int
+            レース番号
+        tickets : TicketBatch
+            購入したチケット
+        other_game_ids : Iterable[int], optional
+            購入済みのunitを合計に含める他のレース番号。teamの支払いを
+            精算済みのレースは含めない, by default ()
+
+        Returns
+        -------
+        bool
+            追記したときはTrue、coinが足りないときはFalse
+        """
+        game_ids = {game_id, *other_game_ids}
+        reserved = self._unpaid_reserved_coins(team_name, game_ids, {})
+        if self.get_team_coins(team_name) < reserved + tickets.units:
+            return False
+        self.append_tickets(team_name, game_id, tickets)
+        return True
+
+    def reserve_teams_tickets(
+        self,
+        game_id: int,
+        purchases: list[tuple[str, TicketBatch]],
+        other_game_ids: Iterable[int] = (),
+    ) -> list[bool]:
+        """複数teamの購入を、coinをまとめて確認してからまとめて追記する。
+
+        購入ごとに reserve_tickets と同じ条件で確認し、同じteamの購入が
+        複数あるときは前の購入から順に、それまでに受け付けた分も含めて確認する。
+        coinのないteamの購入は受け付けない。
+        呼び出し側で全teamのロックを取っておくこと。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+        purchases : list[tuple[str, TicketBatch]]
+            team_nameと購入したチケットのリスト
+        other_game_ids : Iterable[int], optional
+            購入済みのunitを合計に含める他のレース番号。teamの支払いを
+            精算済みのレースは含めない, by default ()
+
+        Returns
+        -------
+        list[bool]
+            purchases と同じ順の、追記したかどうかのリスト
+        """
+        game_ids = {game_id, *other_game_ids}
+        settled: dict[int, dict] = {}
+        available = {}
+        for team_name in dict.fromkeys(team_name for team_name, _ in purchases):
+            try:
+                coins = self.get_team_coins(team_name)
+            # CSVではcoin設定ファイルがないときに FileNotFoundError になる
+            except (FileNotFoundError, NoCoinsDataError):
+                continue
+            reserved = self._unpaid_reserved_coins(team_name, game_ids, settled)
+            available[team_name] = coins - reserved
+        accepted, team_tickets = select_purchases(purchases, available)
+        self.append_teams_tickets(game_id, team_tickets)
+        return accepted
+
+    def _unpaid_reserved_coins(
+        self, team_name: str, game_ids: Iterable[int], settled: dict[int, dict]
+    ) -> int:
+        """game_idsのうち、teamの支払いを精算していないレースの購入済みunitの合計
+
+        settled は game_id ごとの load_settled の結果を覚えておく辞書で、
+        複数teamを確認するときに同じレースを読み直さないよう使い回す。
+        """
+        total = 0
+        for game_id in game_ids:
+            units = self.get_reserved_coins(team_name, game_id)
+            if units == 0:
+                continue
+            if game_id not in settled:
+                settled[game_id] = self.load_settled(game_id)
+            if settled[game_id].get(team_name, (None, None))[0] is None:
+                total += units
+        return total
+
+    @abstractmethod
+    def load_tickets(self, team_name: str, game_id: int) -> pd.DataFrame:
+        """teamのチケットを読み込む。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        pd.DataFrame
+            チケット情報のDataFrame
+        """
+
+    @abstractmethod
+    def iter_game_tickets(self, game_id: int) -> Iterator[tuple[str, pd.DataFrame]]:
+        """game_idの全teamのチケットを1チームずつ読み込む。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Yields
+        ------
+        tuple[str, pd.DataFrame]
+            team_nameとそのチームのチケット情報のDataFrame
+        """
+
+    def game_teams(self, game_id: int) -> list[str]:
+        """game_idのチケットを購入したteamの名前を返す。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        list[str]
+            名前順のteamの名前のリスト
+        """
+        return sorted(self.load_pools(game_id))
+
+    @abstractmethod
+    def load_pools(self, game_id: int) -> dict[str, OutcomePool]:
+        """game_idの全teamのチケットの集計を読み込む。
+
+        集計は append_tickets でチケットと一緒に更新される。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        dict[str, OutcomePool]
+            team_nameとチケットの集計の辞書
+        """
+
+    def load_pool(self, team_name: str, game_id: int) -> OutcomePool:
+        """teamのチケットの集計を読み込む。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        OutcomePool
+            チケットの集計。チケットがないときは空の集計
+        """
+        return self.load_pools(game_id).get(team_name, OutcomePool())
+
+    @abstractmethod
+    def rebuild_pools(self, game_id: int) -> dict[str, OutcomePool]:
+        """保存されているチケットからgame_idの集計を作り直す。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        dict[str, OutcomePool]
+            team_nameとチケットの集計の辞書
+        """
+
+    @abstractmethod
+    def settle_teams(
+        self, game_id: int, scores: dict[str, tuple[int, int]]
+    ) -> dict[str, int]:
+        """teamのcoinに報酬と支払いの差を反映し、精算済みとして記録する。
+
+        coinの更新と精算済みの記録は、途中で落ちても片方だけが残らないよう
+        まとめてコミットする。精算済みのteamはコミットの中で確かめ直して飛ばすため、
+        同じレースを同時に精算しても二重に反映しない。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+        scores : dict[str, tuple[int, int]]
+            team_nameと (支払いcoin, 報酬coin) の辞書
+
+        Returns
+        -------
+        dict[str, int]
+            このとき精算したteamのteam_nameと、反映後のcoin数の辞書
+        """
+
+    @abstractmethod
+    def settle_team_part(
+        self,
+        team_name: str,
+        game_id: int,
+        paid: int | None = None,
+        rewarded: int | None = None,
+    ) -> int | None:
+        """teamの支払いか報酬だけをcoinに反映し、精算済みとして記録する。
+
+        /admin/pay_tickets と /admin/reward_tickets から使う。
+        記録したteamは settle_teams では精算しない。
+
+        Parameters
+        ----------
+        team_name : str
+            teamの名前
+        game_id : int
+            レース番号
+        paid : int | None, optional
+            支払いcoin。Noneのときは支払わない, by default None
+        rewarded : int | None, optional
+            報酬coin。Noneのときは報酬を払わない, by default None
+
+        Returns
+        -------
+        int | None
+            反映後のcoin数。指定した方がすでに記録されているときはNone
+        """
+
+    @abstractmethod
+    def load_settled(self, game_id: int) -> dict[str, tuple[int | None, int | None]]:
+        """精算済みのteamを読み込む。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        dict[str, tuple[int | None, int | None]]
+            team_nameと (支払いcoin, 報酬coin) の辞書。
+            settle_team_part でまだ記録していない方はNone
+        """
+
+    @abstractmethod
+    def save_final_odds(self, game_id: int, odds: dict) -> None:
+        """購入締め切り時の最終オッズを保存する。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+        odds : dict
+            RaceOdds.to_dict の戻り値
+        """
+
+    @abstractmethod
+    def load_final_odds(self, game_id: int) -> dict | None:
+        """最終オッズを読み込む。
+
+        Parameters
+        ----------
+        game_id : int
+            レース番号
+
+        Returns
+        -------
+        dict | None
+            RaceOdds.to_dict の形式の辞書。保存されていないときはNone
+        """
+
+    @abstractmethod
+    def save_result(self, game_id: int, result: list[int]) -> None:
+        """レース結果を保存する。
+
+        Parameters
+        ----------
+        game_id : int
+            レースID
+        result : list[int]
+            レース結果
+        """
+
+    @abstractmethod
+    def load_result(self, game_id: int) -> list[int]:
+        """レース結果を読み込む。
+
+        Parameters
+        ----------
+        game_id : int
+            レースID
+
+        Returns
+        -------
+        list[int]
+            レース結果
+        """
+
+    def load_results(self, game_ids: list[int]) -> dict[int, list[int]]:
+        """複数レースの結果をまとめて読み込む。
+
+        結果が保存されていないgame_idは戻り値に含めない。
+
+        Parameters
+        ----------
+        game_ids : list[int]
+            レースIDのリスト
+
+        Returns
+        -------
+        dict[int, list[int]]
+            game_idとレース結果の辞書
+        """
+        results = {}
+        for game_id in game_ids:
+            try:
+                results[game_id] = self.load_result(game_id)
+            except ValueError:
+                continue
+        return results
+
+    def recover(self) -> None:
+        """中断された書き込みを片付ける。起動時に呼ぶ"""
+
+    def close(self) -> None:
+        """書き込みをディスクに反映して閉じる。終了時に呼ぶ"""
+
+
+def select_purchases(
+    purchases: list[tuple[str, TicketBatch]], available: dict[str, int]
+) -> tuple[list[bool], dict[str, TicketBatch]]:
+    """teamごとの残りのcoinの範囲で、受け付ける購入を前から順に選ぶ
+
+    Parameters
+    ----------
+    purchases : list[tuple[str, TicketBatch]]
+        team_nameと購入したチケットのリスト
+    available : dict[str, int]
+        team_nameと、coinから購入済みのunitを引いた残り。ないteamは受け付けない
+
+    Returns
+    -------
+    tuple[list[bool], dict[str, TicketBatch]]
+        purchases と同じ順の受け付けたかどうかのリストと、
+        team_nameと受け付けたチケットをつなげたものの辞書
+    """
+    available = dict(available)
+    accepted = []
+    team_batches: dict[str, list[TicketBatch]] = {}
+    for team_name, tickets in purchases:
+        ok = team_name in available and tickets.units <= available[team_name]
+        if ok:
+            available[team_name] -= tickets.units
+            team_batches.setdefault(team_name, []).append(tickets)
+        accepted.append(ok)
+    team_tickets = {
+        team_name: TicketBatch.concat(batches)
+        for team_name, batches in team_batches.items()
+    }
+    return accepted, team_tickets
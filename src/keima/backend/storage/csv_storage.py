@@ -0,0 +1,166 @@
+import os
+from collections.abc import Iterator
+
+import pandas as pd
+
+from keima.backend.coins.cache import coin_cache, format_version
+from keima.backend.coins.get_coins import get_team_coins
+from keima.backend.coins.ledger import coin_ledger
+from keima.backend.coins.set_coins import (
+    recover_team_coins,
+    set_team_coins,
+    set_teams_coins,
+)
+from keima.backend.odds.odds_file import load_final_odds, save_final_odds
+from keima.backend.race_result.load_result import load_result, load_results
+from keima.backend.race_result.result_store import get_result_store
+from keima.backend.race_result.save_result import save_result
+from keima.backend.settlement.settled_file import (
+    load_settled,
+    settle_team_part,
+    settle_teams,
+)
+from keima.backend.storage.base import Storage
+from keima.backend.storage.layout import coins_path
+from keima.backend.tickets.load_tickets import (
+    game_ticket_paths,
+    get_reserved_coins,
+    iter_game_tickets,
+    load_tickets,
+)
+from keima.backend.tickets.outcome_pool import OutcomePool
+from keima.backend.tickets.pool_file import (
+    append_pool,
+    append_pools,
+    load_pool,
+    load_pools,
+    rebuild_pools,
+)
+from keima.backend.tickets.save_tickets import append_tickets
+from keima.backend.tickets.ticket_batch import TicketBatch
+
+
+class CsvStorage(Storage):
+    """dir_path 以下のCSVファイルに保存する
+
+    - coin: "{team_name}_coins.csv"
+    - チケット: "{team_name}_{game_id}_tickets.csv"
+    - KEIMA_LAYOUT=sharded のときのcoin: "coins/{shard}/{team_name}_coins.csv"
+    - KEIMA_LAYOUT=sharded のときのチケット:
+      "games/{game_id}/{shard}/{team_name}_tickets.csv" と、teamの一覧
+      "games/{game_id}/manifest.txt"
+    - チケットの集計: "race_{game_id}_pools.csv"
+    - 最終オッズ: "race_{game_id}_odds.json"
+    - 精算済みのteam: "race_{game_id}_settled.csv"
+    - レース結果: "race_results.csv"
+
+    Parameters
+    ----------
+    dir_path : str
+        データ保存ディレクトリパス
+    """
+
+    def __init__(self, dir_path: str) -> None:
+        self.dir_path = dir_path
+
+    def get_team_coins(self, team_name: str, game_id: int | None = None) -> int:
+        return get_team_coins(team_name, self.dir_path, game_id)
+
+    def get_cached_coins(
+        self, team_name: str, game_id: int | None = None
+    ) -> tuple[int, str] | None:
+        entry = coin_cache.lookup(coins_path(team_name, self.dir_path))
+        return None if entry is None else (entry.coins(game_id), entry.version)
+
+    def get_coins_version(self, team_name: str) -> str | None:
+        # coinを書き込むと行が増えてサイズが、一時ファイルからの置き換えではmtimeが変わる
+        try:
+            stat = os.stat(coins_path(team_name, self.dir_path))
+        except FileNotFoundError:
+            return None
+        return format_version((stat.st_mtime_ns, stat.st_size))
+
+    def set_team_coins(
+        self, team_name: str, coins: int, game_id: int | None = None
+    ) -> None:
+        set_team_coins(team_name, coins, self.dir_path, game_id)
+
+    def set_teams_coins(
+        self, team_coins: dict[str, int], game_id: int | None = None
+    ) -> None:
+        set_teams_coins(team_coins, self.dir_path, game_id)
+
+    def append_tickets(
+        self, team_name: str, game_id: int, tickets: TicketBatch
+    ) -> None:
+        append_tickets(team_name, game_id, tickets, self.dir_path)
+        append_pool(team_name, game_id, tickets, self.dir_path)
+
+    def append_teams_tickets(
+        self, game_id: int, team_tickets: dict[str, TicketBatch]
+    ) -> None:
+        # チケットファイルはteamごとに追記し、集計ファイルには1回で追記する
+        for team_name, tickets in team_tickets.items():
+            append_tickets(team_name, game_id, tickets, self.dir_path)
+        if team_tickets:
+            append_pools(game_id, team_tickets, self.dir_path)
+
+    def get_reserved_coins(self, team_name: str, game_id: int) -> int:
+        return get_reserved_coins(team_name, game_id, self.dir_path)
+
+    def load_tickets(self, team_name: str, game_id: int) -> pd.DataFrame:
+        return load_tickets(team_name, game_id, self.dir_path)
+
+    def iter_game_tickets(self, game_id: int) -> Iterator[tuple[str, pd.DataFrame]]:
+        return iter_game_tickets(game_id, self.dir_path)
+
+    def game_teams(self, game_id: int) -> list[str]:
+        return list(game_ticket_paths(game_id, self.dir_path))
+
+    def load_pools(self, game_id: int) -> dict[str, OutcomePool]:
+        return load_pools(game_id, self.dir_path)
+
+    def load_pool(self, team_name: str, game_id: int) -> OutcomePool:
+        return load_pool(team_name, game_id, self.dir_path)
+
+    def rebuild_pools(self, game_id: int) -> dict[str, OutcomePool]:
+        return rebuild_pools(game_id, self.dir_path)
+
+    def settle_teams(
+        self, game_id: int, scores: dict[str, tuple[int, int]]
+    ) -> dict[str, int]:
+        return settle_teams(game_id, scores, self.dir_path)
+
+    def settle_team_part(
+        self,
+        team_name: str,
+        game_id: int,
+        paid: int | None = None,
+        rewarded: int | None = None,
+    ) -> int | None:
+        return settle_team_part(game_id, team_name, paid, rewarded, self.dir_path)
+
+    def load_settled(self, game_id: int) -> dict[str, tuple[int | None, int | None]]:
+        return load_settled(game_id, self.dir_path)
+
+    def save_final_odds(self, game_id: int, odds: dict) -> None:
+        save_final_odds(game_id, odds, self.dir_path)
+
+    def load_final_odds(self, game_id: int) -> dict | None:
+        return load_final_odds(game_id, self.dir_path)
+
+    def save_result(self, game_id: int, result: list[int]) -> None:
+        save_result(game_id, result, self.dir_path)
+
+    def load_result(self, game_id: int) -> list[int]:
+        return load_result(game_id, self.dir_path)
+
+    def load_results(self, game_ids: list[int]) -> dict[int, list[int]]:
+        return load_results(game_ids, self.dir_path)
+
+    def recover(self) -> None:
+        recover_team_coins(self.dir_path)
+        get_result_store(self.dir_path).refresh()
+
+    def close(self) -> None:
+        coin_ledger.flush()
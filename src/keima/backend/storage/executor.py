@@ -0,0 +1,40 @@
+import asyncio
+import functools
+import os
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import ParamSpec, TypeVar
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+class StorageExecutor:
+    """ストレージのI/O専用のスレッドプール
+
+    async のエンドポイントから、ブロックするCSVやSQLiteの読み書きを
+    イベントループの外で実行する。
+    uvicorn のデフォルトのスレッドプールとは別にすることで、
+    重い書き込みが詰まってもメモリだけで返せるエンドポイントは待たされない。
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        スレッド数の上限, by default 8
+    """
+
+    def __init__(self, max_workers: int = 8) -> None:
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="keima-storage"
+        )
+
+    async def run(self, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        """funcをスレッドプールで実行し、結果を待つ"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+
+storage_executor = StorageExecutor(int(os.getenv("KEIMA_STORAGE_WORKERS", "8")))
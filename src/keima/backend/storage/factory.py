@@ -0,0 +1,31 @@
+import os
+
+from keima.backend.storage.base import Storage
+from keima.backend.storage.csv_storage import CsvStorage
+from keima.backend.storage.sqlite_storage import SqliteStorage
+
+
+def create_storage(dir_path: str) -> Storage:
+    """環境変数 KEIMA_STORAGE に応じた保存先を作る。
+
+    - "csv" (デフォルト): dir_path 以下のCSVファイル
+    - "sqlite": KEIMA_SQLITE_PATH (デフォルトは "{dir_path}/keima.sqlite3")
+
+    Parameters
+    ----------
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    Storage
+        保存先
+    """
+    storage_type = os.getenv("KEIMA_STORAGE", "csv")
+    if storage_type == "csv":
+        return CsvStorage(dir_path)
+    if storage_type == "sqlite":
+        return SqliteStorage(
+            os.getenv("KEIMA_SQLITE_PATH", f"{dir_path}/keima.sqlite3")
+        )
+    raise ValueError(f"Unknown KEIMA_STORAGE: {storage_type}")
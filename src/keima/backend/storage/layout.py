@@ -0,0 +1,264 @@
+import argparse
+import functools
+import hashlib
+import os
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+# ハッシュの先頭何文字でディレクトリを分けるか (16進数2文字で256個)
+SHARD_CHARS = 2
+MANIFEST_FILE = "manifest.txt"
+
+_created_dirs: set[str] = set()
+_created_lock = threading.Lock()
+
+
+def sharded() -> bool:
+    """環境変数 KEIMA_LAYOUT が "sharded" のときTrue
+
+    - "flat" (デフォルト): 全てのファイルを dir_path の直下に置く
+    - "sharded": coinは "coins/{shard}/"、チケットは "games/{game_id}/{shard}/" に置く。
+      shard は team_name のハッシュの先頭 SHARD_CHARS 文字
+    """
+    return os.getenv("KEIMA_LAYOUT", "flat") == "sharded"
+
+
+@functools.lru_cache(maxsize=4096)
+def team_shard(team_name: str) -> str:
+    """team_nameから、ファイルを置くサブディレクトリの名前を返す"""
+    return hashlib.sha1(team_name.encode()).hexdigest()[:SHARD_CHARS]
+
+
+def coins_path(team_name: str, dir_path: str, create: bool = False) -> str:
+    """teamのcoin設定ファイルのパスを返す。
+
+    ファイル名は"{team_name}_coins.csv"とする。
+
+    Parameters
+    ----------
+    team_name : str
+        teamの名前
+    dir_path : str
+        データ保存ディレクトリパス
+    create : bool, optional
+        書き込む前に、置き場所のディレクトリを作るかどうか, by default False
+
+    Returns
+    -------
+    str
+        coin設定ファイルのパス
+    """
+    if not sharded():
+        return f"{dir_path}/{team_name}_coins.csv"
+    parent = f"{dir_path}/coins/{team_shard(team_name)}"
+    if create:
+        _makedirs(parent)
+    return f"{parent}/{team_name}_coins.csv"
+
+
+def iter_coins_paths(dir_path: str, suffix: str = "_coins.csv") -> Iterator[Path]:
+    """全teamのcoin設定ファイル (suffixで終わるファイル) のパスを返す
+
+    Parameters
+    ----------
+    dir_path : str
+        データ保存ディレクトリパス
+    suffix : str, optional
+        ファイル名の末尾, by default "_coins.csv"
+
+    Yields
+    ------
+    Path
+        ファイルのパス
+    """
+    pattern = f"coins/*/*{suffix}" if sharded() else f"*{suffix}"
+    yield from Path(dir_path).glob(pattern)
+
+
+def game_dir(game_id: int, dir_path: str) -> Path:
+    """shardedのときの、レースのチケットファイルを置くディレクトリを返す"""
+    return Path(dir_path) / "games" / str(game_id)
+
+
+def ticket_path(team_name: str, game_id: int, dir_path: str) -> Path:
+    """teamのチケットファイルのパスを返す。
+
+    flatのときのファイル名は"{team_name}_{game_id}_tickets.csv"、
+    shardedのときは"games/{game_id}/{shard}/{team_name}_tickets.csv"とする。
+
+    Parameters
+    ----------
+    team_name : str
+        teamの名前
+    game_id : int
+        ゲームID
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    Path
+        チケットファイルのパス
+    """
+    if not sharded():
+        return Path(dir_path) / f"{team_name}_{game_id}_tickets.csv"
+    shard = team_shard(team_name)
+    return Path(f"{dir_path}/games/{game_id}/{shard}/{team_name}_tickets.csv")
+
+
+def register_ticket_file(team_name: str, game_id: int, dir_path: str) -> None:
+    """teamのチケットファイルを作る前に、置き場所を作ってmanifestに追記する。
+
+    flatのときは何もしない。
+    manifestには team_name を1行ずつ追記する。チケットファイルより先に
+    書き込むため、途中で落ちてもチケットファイルがmanifestから漏れることはない。
+
+    Parameters
+    ----------
+    team_name : str
+        teamの名前
+    game_id : int
+        ゲームID
+    dir_path : str
+        データ保存ディレクトリパス
+    """
+    if not sharded():
+        return
+    _makedirs(str(ticket_path(team_name, game_id, dir_path).parent))
+    manifest = game_dir(game_id, dir_path) / MANIFEST_FILE
+    # 1行の O_APPEND の書き込みは、他のteamの追記と混ざらない
+    fd = os.open(manifest, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, f"{team_name}\n".encode())
+    finally:
+        os.close(fd)
+
+
+def game_ticket_paths(game_id: int, dir_path: str) -> dict[str, Path]:
+    """game_idのチケットファイルのパスを、ファイルを読まずにteamごとに返す。
+
+    flatのときはディレクトリを走査し、shardedのときはレースのmanifestを読む。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    dict[str, Path]
+        team_nameとチケットファイルのパスの辞書。team_name順
+    """
+    if not sharded():
+        suffix = f"_{game_id}_tickets.csv"
+        return {
+            path.name[: -len(suffix)]: path
+            for path in sorted(Path(dir_path).glob(f"*{suffix}"))
+        }
+    manifest = game_dir(game_id, dir_path) / MANIFEST_FILE
+    try:
+        team_names = manifest.read_text().splitlines()
+    except FileNotFoundError:
+        return {}
+    paths = {}
+    for team_name in sorted(set(team_names)):
+        path = ticket_path(team_name, game_id, dir_path)
+        # manifestへの追記の後、チケットファイルを作る前に落ちたteamは除く
+        if path.exists():
+            paths[team_name] = path
+    return paths
+
+
+def migrate_to_sharded(dir_path: str) -> tuple[int, int]:
+    """flatのcoin設定ファイルとチケットファイルを、shardedの置き場所に移す。
+
+    サーバーを止めてから実行する。途中で止まっても、もう一度実行すれば
+    残りのファイルを移す。移した後は KEIMA_LAYOUT=sharded で起動する。
+
+    Parameters
+    ----------
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    tuple[int, int]
+        移したcoin設定ファイルの数と、チケットファイルの数
+    """
+    root = Path(dir_path)
+    num_coins = 0
+    for path in sorted(root.glob("*_coins.csv")):
+        team_name = path.name.removesuffix("_coins.csv")
+        parent = root / "coins" / team_shard(team_name)
+        parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, parent / path.name)
+        num_coins += 1
+
+    num_tickets = 0
+    for path in sorted(root.glob("*_tickets.csv")):
+        team_name, game_id, _ = path.name.rsplit("_", 2)
+        if not game_id.isdigit():
+            continue
+        parent = game_dir(int(game_id), dir_path) / team_shard(team_name)
+        parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, parent / f"{team_name}_tickets.csv")
+        num_tickets += 1
+
+    # 前回の途中までの実行で移したファイルも含めるため、ディレクトリから作り直す
+    for path in (root / "games").glob("*"):
+        if path.name.isdigit():
+            rebuild_manifest(int(path.name), dir_path)
+    return num_coins, num_tickets
+
+
+def rebuild_manifest(game_id: int, dir_path: str) -> list[str]:
+    """shardedのレースのディレクトリを走査して、manifestを作り直す。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    dir_path : str
+        データ保存ディレクトリパス
+
+    Returns
+    -------
+    list[str]
+        manifestに書き込んだteam_nameのリスト
+    """
+    directory = game_dir(game_id, dir_path)
+    team_names = sorted(
+        path.name.removesuffix("_tickets.csv")
+        for path in directory.glob("*/*_tickets.csv")
+    )
+    tmp_path = directory / f"{MANIFEST_FILE}.tmp"
+    tmp_path.write_text("".join(f"{team_name}\n" for team_name in team_names))
+    os.replace(tmp_path, directory / MANIFEST_FILE)
+    return team_names
+
+
+def _makedirs(path: str) -> None:
+    if path in _created_dirs:
+        return
+    os.makedirs(path, exist_ok=True)
+    with _created_lock:
+        _created_dirs.add(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="flatのデータ保存ディレクトリをshardedの配置に移す"
+    )
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("dir_path", help="データ保存ディレクトリパス")
+    args = parser.parse_args()
+
+    num_coins, num_tickets = migrate_to_sharded(args.dir_path)
+    print(f"moved {num_coins} coins files and {num_tickets} ticket files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,575 @@
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+
+import pandas as pd
+
+from keima.backend.storage.base import Storage, select_purchases
+from keima.backend.tickets.outcome_pool import OutcomePool
+from keima.backend.tickets.ticket_batch import TICKET_TYPES, TicketBatch
+from keima.myexception.backend import InvalidPlayerCountError, NoCoinsDataError
+
+TICKET_COLUMNS = ["ticket_type", "one", "two", "three", "unit"]
+# 1つのクエリに渡すプレースホルダの数の上限 (SQLITE_MAX_VARIABLE_NUMBER より小さくする)
+SQL_VARIABLES = 500
+
+# 支払いと報酬は /admin/pay_tickets と /admin/reward_tickets で別々に記録できるよう、
+# まだ記録していない方をNULLにする
+SETTLEMENTS_TABLE = """
+CREATE TABLE IF NOT EXISTS settlements (
+    game_id INTEGER NOT NULL,
+    team_name TEXT NOT NULL,
+    paid INTEGER,
+    reward INTEGER,
+    PRIMARY KEY (game_id, team_name)
+)
+"""
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS coins (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    team_name TEXT NOT NULL,
+    coins INTEGER NOT NULL,
+    game_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coins_team_game ON coins (team_name, game_id, id);
+
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    team_name TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    ticket_type TEXT NOT NULL,
+    one INTEGER NOT NULL,
+    two INTEGER,
+    three INTEGER,
+    unit INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_team_game ON tickets (team_name, game_id);
+CREATE INDEX IF NOT EXISTS tickets_game ON tickets (game_id, team_name);
+
+CREATE TABLE IF NOT EXISTS reserved_coins (
+    team_name TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    units INTEGER NOT NULL,
+    PRIMARY KEY (team_name, game_id)
+);
+
+CREATE TABLE IF NOT EXISTS outcome_pools (
+    team_name TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    ticket_type TEXT NOT NULL,
+    one INTEGER NOT NULL,
+    two INTEGER NOT NULL,
+    three INTEGER NOT NULL,
+    units INTEGER NOT NULL,
+    PRIMARY KEY (game_id, team_name, ticket_type, one, two, three)
+);
+
+CREATE TABLE IF NOT EXISTS final_odds (
+    game_id INTEGER PRIMARY KEY,
+    odds TEXT NOT NULL
+);
+
+{SETTLEMENTS_TABLE};
+
+CREATE TABLE IF NOT EXISTS race_results (
+    game_id INTEGER PRIMARY KEY,
+    result TEXT NOT NULL
+);
+"""
+
+
+# チケットを OutcomePool と同じキーで集計して outcome_pools に入れる
+POOLS_FROM_TICKETS = """
+INSERT INTO outcome_pools (team_name, game_id, ticket_type, one, two, three, units)
+SELECT
+    team_name,
+    game_id,
+    ticket_type,
+    one,
+    CASE WHEN ticket_type = 'win' THEN 0 ELSE COALESCE(two, 0) END,
+    CASE WHEN ticket_type = 'trifecta' THEN COALESCE(three, 0) ELSE 0 END,
+    SUM(unit)
+FROM tickets {where}
+GROUP BY 1, 2, 3, 4, 5, 6
+"""
+
+
+# 支払いを精算済みとして記録したレースの購入済みunitは、coinから引いているため除く
+UNPAID = (
+    "WHERE NOT EXISTS (SELECT 1 FROM settlements s "
+    "WHERE s.game_id = r.game_id AND s.team_name = r.team_name "
+    "AND s.paid IS NOT NULL)"
+)
+
+
+class SqliteStorage(Storage):
+    """SQLite (WALモード) に保存する
+
+    接続はスレッドごとに作り、書き込みは BEGIN IMMEDIATE の
+    トランザクションで行う。複数チームのcoinの更新やチケットの保存は
+    executemany でまとめて1つのトランザクションで書き込む。
+
+    Parameters
+    ----------
+    db_path : str
+        SQLiteのデータベースファイルのパス
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        conn = self._conn()
+        tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master")}
+        conn.executescript(SCHEMA)
+        # 集計のテーブルがなかったころのデータベースは、チケットから集計し直す
+        if "reserved_coins" not in tables:
+            conn.execute(
+                "INSERT INTO reserved_coins (team_name, game_id, units) "
+                "SELECT team_name, game_id, SUM(unit) FROM tickets "
+                "GROUP BY team_name, game_id"
+            )
+        if "outcome_pools" not in tables:
+            conn.execute(POOLS_FROM_TICKETS.format(where=""))
+        # 支払いと報酬を別々に記録できなかったころの settlements を作り直す
+        columns = conn.execute("PRAGMA table_info(settlements)").fetchall()
+        if any(name == "paid" and notnull for _, name, _, notnull, *_ in columns):
+            with self._transaction() as tx:
+                tx.execute("ALTER TABLE settlements RENAME TO settlements_old")
+                tx.execute(SETTLEMENTS_TABLE)
+                tx.execute("INSERT INTO settlements SELECT * FROM settlements_old")
+                tx.execute("DROP TABLE settlements_old")
+
+    def get_team_coins(self, team_name: str, game_id: int | None = None) -> int:
+        conn = self._conn()
+        if game_id is None:
+            return self._latest_coins(conn, team_name)
+
+        row = conn.execute(
+            "SELECT coins FROM coins WHERE team_name = ? AND game_id = ? "
+            "ORDER BY id ASC LIMIT 1",
+            (team_name, game_id),
+        ).fetchone()
+        if row is None:
+            if not self._has_coins(conn, team_name):
+                raise NoCoinsDataError(f"No coins data available for team: {team_name}")
+            return 0
+        return row[0]
+
+    def get_coins_version(self, team_name: str) -> str | None:
+        (latest_id,) = (
+            self._conn()
+            .execute("SELECT MAX(id) FROM coins WHERE team_name = ?", (team_name,))
+            .fetchone()
+        )
+        return None if latest_id is None else str(latest_id)
+
+    def set_team_coins(
+        self, team_name: str, coins: int, game_id: int | None = None
+    ) -> None:
+        self.set_teams_coins({team_name: coins}, game_id)
+
+    def set_teams_coins(
+        self, team_coins: dict[str, int], game_id: int | None = None
+    ) -> None:
+        with self._transaction() as conn:
+            self._insert_coins(conn, team_coins, game_id)
+
+    def add_teams_coins(self, team_deltas: dict[str, int]) -> dict[str, int]:
+        with self._transaction() as conn:
+            team_coins = {}
+            for team_name, delta in team_deltas.items():
+                team_coins[team_name] = self._latest_coins(conn, team_name) + delta
+            self._insert_coins(conn, team_coins, None)
+        return team_coins
+
+    def append_tickets(
+        self, team_name: str, game_id: int, tickets: TicketBatch
+    ) -> None:
+        with self._transaction() as conn:
+            self._insert_tickets(conn, team_name, game_id, tickets)
+
+    def get_reserved_coins(self, team_name: str, game_id: int) -> int:
+        row = (
+            self._conn()
+            .execute(
+                "SELECT units FROM reserved_coins WHERE team_name = ? AND game_id = ?",
+                (team_name, game_id),
+            )
+            .fetchone()
+        )
+        return 0 if row is None else row[0]
+
+    def reserve_tickets(
+        self,
+        team_name: str,
+        game_id: int,
+        tickets: TicketBatch,
+        other_game_ids: Iterable[int] = (),
+    ) -> bool:
+        game_ids = sorted({game_id, *other_game_ids})
+        placeholders = ", ".join("?" * len(game_ids))
+        # coinの確認と追記を1つのトランザクションで行うため、
+        # 別プロセスからの同時購入でもcoinを超えて保存されない
+        with self._transaction() as conn:
+            (reserved,) = conn.execute(
+                f"SELECT COALESCE(SUM(units), 0) FROM reserved_coins r {UNPAID} "
+                f"AND r.team_name = ? AND r.game_id IN ({placeholders})",
+                (team_name, *game_ids),
+            ).fetchone()
+            if self._latest_coins(conn, team_name) < reserved + tickets.units:
+                return False
+            self._insert_tickets(conn, team_name, game_id, tickets)
+        return True
+
+    def reserve_teams_tickets(
+        self,
+        game_id: int,
+        purchases: list[tuple[str, TicketBatch]],
+        other_game_ids: Iterable[int] = (),
+    ) -> list[bool]:
+        game_ids = sorted({game_id, *other_game_ids})
+        placeholders = ", ".join("?" * len(game_ids))
+        team_names = list(dict.fromkeys(team_name for team_name, _ in purchases))
+        # coinと購入済みunitはteamごとに問い合わせず、まとめて読む
+        with self._transaction() as conn:
+            reserved = dict(
+                conn.execute(
+                    f"SELECT r.team_name, SUM(units) FROM reserved_coins r {UNPAID} "
+                    f"AND r.game_id IN ({placeholders}) GROUP BY r.team_name",
+                    game_ids,
+                )
+            )
+            available = {
+                team_name: coins - reserved.get(team_name, 0)
+                for team_name, coins in self._teams_latest_coins(
+                    conn, team_names
+                ).items()
+            }
+            accepted, team_tickets = select_purchases(purchases, available)
+            self._insert_teams_tickets(conn, game_id, team_tickets)
+        return accepted
+
+    def append_teams_tickets(
+        self, game_id: int, team_tickets: dict[str, TicketBatch]
+    ) -> None:
+        with self._transaction() as conn:
+            self._insert_teams_tickets(conn, game_id, team_tickets)
+
+    def load_tickets(self, team_name: str, game_id: int) -> pd.DataFrame:
+        return pd.read_sql_query(
+            f"SELECT {', '.join(TICKET_COLUMNS)} FROM tickets "
+            "WHERE team_name = ? AND game_id = ? ORDER BY id",
+            self._conn(),
+            params=(team_name, game_id),
+        )
+
+    def iter_game_tickets(self, game_id: int) -> Iterator[tuple[str, pd.DataFrame]]:
+        df = pd.read_sql_query(
+            f"SELECT team_name, {', '.join(TICKET_COLUMNS)} FROM tickets "
+            "WHERE game_id = ? ORDER BY team_name, id",
+            self._conn(),
+            params=(game_id,),
+        )
+        for team_name, team_df in df.groupby("team_name", sort=True):
+            yield str(team_name), team_df[TICKET_COLUMNS].reset_index(drop=True)
+
+    def game_teams(self, game_id: int) -> list[str]:
+        rows = self._conn().execute(
+            "SELECT team_name FROM reserved_coins WHERE game_id = ? ORDER BY team_name",
+            (game_id,),
+        )
+        return [team_name for (team_name,) in rows]
+
+    def load_pools(self, game_id: int) -> dict[str, OutcomePool]:
+        rows = self._conn().execute(
+            "SELECT team_name, ticket_type, one, two, three, units FROM outcome_pools "
+            "WHERE game_id = ? ORDER BY team_name",
+            (game_id,),
+        )
+        return _pools_from_rows(rows)
+
+    def load_pool(self, team_name: str, game_id: int) -> OutcomePool:
+        rows = self._conn().execute(
+            "SELECT team_name, ticket_type, one, two, three, units FROM outcome_pools "
+            "WHERE game_id = ? AND team_name = ?",
+            (game_id, team_name),
+        )
+        return _pools_from_rows(rows).get(team_name, OutcomePool())
+
+    def rebuild_pools(self, game_id: int) -> dict[str, OutcomePool]:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM outcome_pools WHERE game_id = ?", (game_id,))
+            conn.execute(
+                POOLS_FROM_TICKETS.format(where="WHERE game_id = ?"), (game_id,)
+            )
+        return self.load_pools(game_id)
+
+    def settle_teams(
+        self, game_id: int, scores: dict[str, tuple[int, int]]
+    ) -> dict[str, int]:
+        with self._transaction() as conn:
+            # 別プロセスが先に精算したteamを、書き込みのロックを取ってから飛ばす
+            settled = self._settled(conn, game_id)
+            scores = {t: s for t, s in scores.items() if t not in settled}
+            team_coins = {}
+            for team_name, (paid, rewarded) in scores.items():
+                team_coins[team_name] = (
+                    self._latest_coins(conn, team_name) + rewarded - paid
+                )
+            self._insert_coins(conn, team_coins, None)
+            conn.executemany(
+                "INSERT INTO settlements (game_id, team_name, paid, reward) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (game_id, team_name, paid, rewarded)
+                    for team_name, (paid, rewarded) in scores.items()
+                ],
+            )
+        return team_coins
+
+    def settle_team_part(
+        self,
+        team_name: str,
+        game_id: int,
+        paid: int | None = None,
+        rewarded: int | None = None,
+    ) -> int | None:
+        with self._transaction() as conn:
+            done = self._settled(conn, game_id).get(team_name, (None, None))
+            if (paid is not None and done[0] is not None) or (
+                rewarded is not None and done[1] is not None
+            ):
+                return None
+            team_coins = (
+                self._latest_coins(conn, team_name) + (rewarded or 0) - (paid or 0)
+            )
+            self._insert_coins(conn, {team_name: team_coins}, None)
+            conn.execute(
+                "INSERT INTO settlements (game_id, team_name, paid, reward) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (game_id, team_name) DO UPDATE SET "
+                "paid = COALESCE(paid, excluded.paid), "
+                "reward = COALESCE(reward, excluded.reward)",
+                (game_id, team_name, paid, rewarded),
+            )
+        return team_coins
+
+    def load_settled(self, game_id: int) -> dict[str, tuple[int | None, int | None]]:
+        return self._settled(self._conn(), game_id)
+
+    @staticmethod
+    def _settled(
+        conn: sqlite3.Connection, game_id: int
+    ) -> dict[str, tuple[int | None, int | None]]:
+        rows = conn.execute(
+            "SELECT team_name, paid, reward FROM settlements WHERE game_id = ?",
+            (game_id,),
+        )
+        return {team_name: (paid, rewarded) for team_name, paid, rewarded in rows}
+
+    def save_final_odds(self, game_id: int, odds: dict) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO final_odds (game_id, odds) VALUES (?, ?)",
+                (game_id, json.dumps(odds)),
+            )
+
+    def load_final_odds(self, game_id: int) -> dict | None:
+        row = (
+            self._conn()
+            .execute("SELECT odds FROM final_odds WHERE game_id = ?", (game_id,))
+            .fetchone()
+        )
+        return None if row is None else json.loads(row[0])
+
+    def save_result(self, game_id: int, result: list[int]) -> None:
+        KEIMA_NUM_PLAYERS = int(os.getenv("KEIMA_NUM_PLAYERS", "4"))
+        if len(result) != KEIMA_NUM_PLAYERS:
+            raise InvalidPlayerCountError(
+                f"result must contain {KEIMA_NUM_PLAYERS} player numbers"
+            )
+        with self._transaction() as conn:
+            # CSVと同じく、同じgame_idでは最初に保存した結果を使う
+            conn.execute(
+                "INSERT OR IGNORE INTO race_results (game_id, result) VALUES (?, ?)",
+                (game_id, json.dumps([int(r) for r in result])),
+            )
+
+    def load_result(self, game_id: int) -> list[int]:
+        row = (
+            self._conn()
+            .execute("SELECT result FROM race_results WHERE game_id = ?", (game_id,))
+            .fetchone()
+        )
+        if row is None:
+            raise ValueError(f"No results found for game_id {game_id}")
+        return json.loads(row[0])
+
+    def load_results(self, game_ids: list[int]) -> dict[int, list[int]]:
+        game_ids = [int(game_id) for game_id in game_ids]
+        rows = (
+            self._conn()
+            .execute(
+                "SELECT game_id, result FROM race_results "
+                f"WHERE game_id IN ({', '.join('?' * len(game_ids))})",
+                game_ids,
+            )
+            .fetchall()
+        )
+        return {game_id: json.loads(result) for game_id, result in rows}
+
+    def __getstate__(self) -> dict:
+        # 別プロセスに渡すときは接続を渡さず、渡した先で開き直す
+        return {"db_path": self.db_path}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["db_path"])
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _insert_coins(
+        self,
+        conn: sqlite3.Connection,
+        team_coins: dict[str, int],
+        game_id: int | None,
+    ) -> None:
+        rows = []
+        for team_name, coins in team_coins.items():
+            team_game_id = game_id
+            if team_game_id is None:
+                (max_game_id,) = conn.execute(
+                    "SELECT MAX(game_id) FROM coins WHERE team_name = ?",
+                    (team_name,),
+                ).fetchone()
+                team_game_id = 0 if max_game_id is None else max_game_id + 1
+            rows.append((team_name, int(coins), int(team_game_id)))
+        conn.executemany(
+            "INSERT INTO coins (team_name, coins, game_id) VALUES (?, ?, ?)", rows
+        )
+
+    def _insert_tickets(
+        self,
+        conn: sqlite3.Connection,
+        team_name: str,
+        game_id: int,
+        tickets: TicketBatch,
+    ) -> None:
+        self._insert_teams_tickets(conn, game_id, {team_name: tickets})
+
+    def _insert_teams_tickets(
+        self,
+        conn: sqlite3.Connection,
+        game_id: int,
+        team_tickets: dict[str, TicketBatch],
+    ) -> None:
+        conn.executemany(
+            "INSERT INTO tickets "
+            "(team_name, game_id, ticket_type, one, two, three, unit) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (team_name, game_id, *ticket)
+                for team_name, tickets in team_tickets.items()
+                for ticket in tickets.records()
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO reserved_coins (team_name, game_id, units) VALUES (?, ?, ?) "
+            "ON CONFLICT (team_name, game_id) "
+            "DO UPDATE SET units = units + excluded.units",
+            (
+                (team_name, game_id, tickets.units)
+                for team_name, tickets in team_tickets.items()
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO outcome_pools "
+            "(team_name, game_id, ticket_type, one, two, three, units) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (game_id, team_name, ticket_type, one, two, three) "
+            "DO UPDATE SET units = units + excluded.units",
+            (
+                (team_name, game_id, TICKET_TYPES[ticket_type], one, two, three, unit)
+                for team_name, tickets in team_tickets.items()
+                for (ticket_type, one, two, three), unit in OutcomePool.from_tickets(
+                    tickets
+                ).items()
+            ),
+        )
+
+    def _teams_latest_coins(
+        self, conn: sqlite3.Connection, team_names: list[str]
+    ) -> dict[str, int]:
+        # _latest_coins と同じく、最大のgame_idの最初の行を team ごとに選ぶ
+        coins = {}
+        for i in range(0, len(team_names), SQL_VARIABLES):
+            chunk = team_names[i : i + SQL_VARIABLES]
+            rows = conn.execute(
+                "SELECT team_name, coins FROM ("
+                "SELECT team_name, coins, ROW_NUMBER() OVER ("
+                "PARTITION BY team_name ORDER BY game_id DESC, id ASC) AS n "
+                f"FROM coins WHERE team_name IN ({', '.join('?' * len(chunk))})"
+                ") WHERE n = 1",
+                chunk,
+            )
+            coins.update(rows)
+        return coins
+
+    def _latest_coins(self, conn: sqlite3.Connection, team_name: str) -> int:
+        row = conn.execute(
+            "SELECT coins FROM coins WHERE team_name = ? "
+            "ORDER BY game_id DESC, id ASC LIMIT 1",
+            (team_name,),
+        ).fetchone()
+        if row is None:
+            raise NoCoinsDataError(f"No coins data available for team: {team_name}")
+        return row[0]
+
+    def _has_coins(self, conn: sqlite3.Connection, team_name: str) -> bool:
+        row = conn.execute(
+            "SELECT 1 FROM coins WHERE team_name = ? LIMIT 1", (team_name,)
+        ).fetchone()
+        return row is not None
+
+
+def _pools_from_rows(rows: Iterable[tuple]) -> dict[str, OutcomePool]:
+    units: dict[str, dict] = {}
+    for team_name, ticket_type, one, two, three, unit in rows:
+        key = (TICKET_TYPES.index(ticket_type), one, two, three)
+        units.setdefault(team_name, {})[key] = unit
+    return {
+        team_name: OutcomePool(team_units) for team_name, team_units in units.items()
+    }
@@ -0,0 +1,70 @@
+from collections.abc import Iterator
+
+import pandas as pd
+
+from keima.backend.metrics.metrics import metrics
+from keima.backend.storage.layout import game_ticket_paths, ticket_path
+from keima.backend.tickets.reserved import reserved_units
+
+
+def load_tickets(team_name: str, game_id: int, dir_path: str) -> pd.DataFrame:
+    """teamのチケットを読み込む。
+
+    Parameters
+    ----------
+    team_name : str
+        teamの名前
+    game_id : int
+        ゲームID
+    dir_path : str
+        チケットファイルのディレクトリパス
+
+    Returns
+    -------
+    pd.DataFrame
+        チケット情報のDataFrame
+    """
+    df = pd.read_csv(ticket_path(team_name, game_id, dir_path))
+    metrics.record_io("tickets", "read", len(df))
+    return df
+
+
+def get_reserved_coins(team_name: str, game_id: int, dir_path: str) -> int:
+    """teamがレースで購入済みのチケットのunitの合計を返す。
+
+    Parameters
+    ----------
+    team_name : str
+        teamの名前
+    game_id : int
+        ゲームID
+    dir_path : str
+        チケットファイルのディレクトリパス
+
+    Returns
+    -------
+    int
+        購入済みのunitの合計。チケットがないときは0
+    """
+    return reserved_units.get(str(ticket_path(team_name, game_id, dir_path)))
+
+
+def iter_game_tickets(
+    game_id: int, dir_path: str
+) -> Iterator[tuple[str, pd.DataFrame]]:
+    """game_idのチケットファイルを1チームずつ読み込む。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    dir_path : str
+        チケットファイルのディレクトリパス
+
+    Yields
+    ------
+    tuple[str, pd.DataFrame]
+        team_nameとそのチームのチケット情報のDataFrame
+    """
+    for team_name, path in game_ticket_paths(game_id, dir_path).items():
+        yield team_name, pd.read_csv(path)
@@ -0,0 +1,123 @@
+from collections.abc import ItemsView
+
+import numpy as np
+
+from keima.backend.tickets.ticket_batch import NO_PLAYER, TRIFECTA, WIN, TicketBatch
+
+# (ticket_type, one, two, three)。ticket_type は TICKET_TYPES の番号
+OutcomeKey = tuple[int, int, int, int]
+
+_KEY_FIELDS = ["ticket_type", "one", "two", "three"]
+
+
+class OutcomePool:
+    """1チーム1レース分のチケットを、的中条件ごとのunitの合計にまとめたもの
+
+    キーは (ticket_type, one, two, three) で、得点計算に使わない値は NO_PLAYER にする。
+    'win' は two と three、'exacta' は three を使わない。
+    組み合わせの数はプレイヤー数だけで決まるため、チケットが何枚あっても
+    レース結果からの得点計算は Reward.reward_pool で定数回の参照で済む。
+
+    Parameters
+    ----------
+    units : dict[OutcomeKey, int] | None, optional
+        キーとunitの合計の辞書, by default None
+    """
+
+    def __init__(self, units: dict[OutcomeKey, int] | None = None) -> None:
+        self._units: dict[OutcomeKey, int] = {}
+        self.total = 0
+        for key, unit in (units or {}).items():
+            self._add(key, unit)
+
+    @classmethod
+    def from_tickets(cls, tickets: TicketBatch) -> "OutcomePool":
+        """チケットを集計して作る
+
+        Parameters
+        ----------
+        tickets : TicketBatch
+            集計するチケット
+
+        Returns
+        -------
+        OutcomePool
+            集計結果
+        """
+        pool = cls()
+        pool.add(tickets)
+        return pool
+
+    def add(self, tickets: TicketBatch) -> None:
+        """チケットのunitを加える
+
+        Parameters
+        ----------
+        tickets : TicketBatch
+            加えるチケット
+        """
+        if len(tickets) == 0:
+            return
+        array = tickets.array
+        keys = array[_KEY_FIELDS].copy()
+        keys["two"][array["ticket_type"] == WIN] = NO_PLAYER
+        keys["three"][array["ticket_type"] != TRIFECTA] = NO_PLAYER
+        unique, inverse = np.unique(keys, return_inverse=True)
+        sums = np.zeros(len(unique), dtype=np.int64)
+        np.add.at(sums, inverse.ravel(), array["unit"])
+        for key, unit in zip(unique.tolist(), sums.tolist(), strict=True):
+            self._add(key, unit)
+
+    def merge(self, other: "OutcomePool") -> None:
+        """別の集計結果を加える
+
+        Parameters
+        ----------
+        other : OutcomePool
+            加える集計結果
+        """
+        for key, unit in other.items():
+            self._add(key, unit)
+
+    def get(
+        self,
+        ticket_type: int,
+        one: int,
+        two: int = NO_PLAYER,
+        three: int = NO_PLAYER,
+    ) -> int:
+        """的中条件のunitの合計を返す。チケットがないときは0
+
+        Parameters
+        ----------
+        ticket_type : int
+            TICKET_TYPES の番号
+        one : int
+            1着のプレイヤー番号
+        two : int, optional
+            2着のプレイヤー番号, by default NO_PLAYER
+        three : int, optional
+            3着のプレイヤー番号, by default NO_PLAYER
+
+        Returns
+        -------
+        int
+            unitの合計
+        """
+        return self._units.get((ticket_type, one, two, three), 0)
+
+    def items(self) -> ItemsView[OutcomeKey, int]:
+        """キーとunitの合計の組を返す"""
+        return self._units.items()
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, OutcomePool):
+            return NotImplemented
+        return self._units == other._units
+
+    def __repr__(self) -> str:
+        return f"OutcomePool({self._units!r})"
+
+    def _add(self, key: OutcomeKey, unit: int) -> None:
+        self._units[key] = self._units.get(key, 0) + unit
+        self.total += unit
@@ -0,0 +1,224 @@
+import argparse
+import csv
+import io
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from keima.backend.tickets.load_tickets import game_ticket_paths, load_tickets
+from keima.backend.tickets.outcome_pool import OutcomePool
+from keima.backend.tickets.reserved import reserved_units
+from keima.backend.tickets.ticket_batch import TICKET_TYPES, TicketBatch
+
+POOL_COLUMNS = ["team_name", "ticket_type", "one", "two", "three", "unit"]
+
+
+def pool_path(game_id: int, dir_path: str) -> Path:
+    """レースの集計ファイルのパスを返す。
+
+    ファイル名は"race_{game_id}_pools.csv"とする。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    dir_path : str
+        チケットファイルのディレクトリパス
+
+    Returns
+    -------
+    Path
+        集計ファイルのパス
+    """
+    return Path(dir_path) / f"race_{game_id}_pools.csv"
+
+
+def append_pool(
+    team_name: str, game_id: int, tickets: TicketBatch, dir_path: str
+) -> None:
+    """購入したチケットの集計をレースの集計ファイルに追記する。
+
+    集計ファイルはヘッダーなしで POOL_COLUMNS の順に書き、
+    1回の購入につき的中条件ごとに1行を追記する。
+    複数のteamが同時に追記しても行が混ざらないよう、1回の write で書き込む。
+
+    Parameters
+    ----------
+    team_name : str
+        teamの名前
+    game_id : int
+        ゲームID
+    tickets : TicketBatch
+        購入したチケット
+    dir_path : str
+        チケットファイルのディレクトリパス
+    """
+    append_pools(game_id, {team_name: tickets}, dir_path)
+
+
+def append_pools(
+    game_id: int, team_tickets: dict[str, TicketBatch], dir_path: str
+) -> None:
+    """複数teamの購入したチケットの集計を、まとめて1回で追記する。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    team_tickets : dict[str, TicketBatch]
+        team_nameと購入したチケットの辞書
+    dir_path : str
+        チケットファイルのディレクトリパス
+    """
+    buf = io.StringIO()
+    for team_name, tickets in team_tickets.items():
+        _write_pool(buf, team_name, OutcomePool.from_tickets(tickets))
+    fd = os.open(pool_path(game_id, dir_path), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, buf.getvalue().encode())
+    finally:
+        os.close(fd)
+
+
+def load_pools(game_id: int, dir_path: str) -> dict[str, OutcomePool]:
+    """レースの全teamの集計を読み込む。
+
+    各teamの集計の合計がチケットファイルのunitの合計と一致しないとき
+    (チケットの追記後、集計の追記前に止まったときなど) は、
+    チケットファイルからメモリ上で集計し直す。
+    購入の受付中にも呼ばれるため、集計ファイルは書き換えない。
+    集計ファイルは締め切り後に rebuild_pools で作り直す。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    dir_path : str
+        チケットファイルのディレクトリパス
+
+    Returns
+    -------
+    dict[str, OutcomePool]
+        team_nameと集計の辞書
+    """
+    path = pool_path(game_id, dir_path)
+    pools = {}
+    if path.exists() and path.stat().st_size > 0:
+        df = pd.read_csv(path, names=POOL_COLUMNS, dtype={"team_name": str})
+        pools = {
+            str(team_name): OutcomePool.from_tickets(TicketBatch.from_frame(team_df))
+            for team_name, team_df in df.groupby("team_name", sort=True)
+        }
+
+    reserved = {
+        team_name: reserved_units.get(str(ticket_path))
+        for team_name, ticket_path in game_ticket_paths(game_id, dir_path).items()
+    }
+    if reserved != {team_name: pool.total for team_name, pool in pools.items()}:
+        return count_pools(game_id, dir_path)
+    return pools
+
+
+def load_pool(team_name: str, game_id: int, dir_path: str) -> OutcomePool:
+    """teamの集計を、そのteamのチケットファイルだけから作る。
+
+    レースの集計ファイルは全teamの行を含むため、teamごとに報酬を払うときに
+    読み直すと、teamの数の2乗に比例して時間がかかる。
+
+    Parameters
+    ----------
+    team_name : str
+        teamの名前
+    game_id : int
+        ゲームID
+    dir_path : str
+        チケットファイルのディレクトリパス
+
+    Returns
+    -------
+    OutcomePool
+        teamの集計。チケットがないときは空の集計
+    """
+    try:
+        df = load_tickets(team_name, game_id, dir_path)
+    except FileNotFoundError:
+        return OutcomePool()
+    return OutcomePool.from_tickets(TicketBatch.from_frame(df))
+
+
+def count_pools(game_id: int, dir_path: str) -> dict[str, OutcomePool]:
+    """チケットファイルからレースの全teamの集計を作る。集計ファイルは読み書きしない。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    dir_path : str
+        チケットファイルのディレクトリパス
+
+    Returns
+    -------
+    dict[str, OutcomePool]
+        team_nameと集計の辞書
+    """
+    return {
+        team_name: OutcomePool.from_tickets(
+            TicketBatch.from_frame(pd.read_csv(ticket_path))
+        )
+        for team_name, ticket_path in game_ticket_paths(game_id, dir_path).items()
+    }
+
+
+def rebuild_pools(game_id: int, dir_path: str) -> dict[str, OutcomePool]:
+    """チケットファイルからレースの集計ファイルを作り直す。
+
+    作り直している間に同じレースのチケットが追記されると、その分は集計に入らない。
+    チケットの購入を締め切ってから呼ぶこと。
+
+    Parameters
+    ----------
+    game_id : int
+        ゲームID
+    dir_path : str
+        チケットファイルのディレクトリパス
+
+    Returns
+    -------
+    dict[str, OutcomePool]
+        team_nameと集計の辞書
+    """
+    pools = count_pools(game_id, dir_path)
+    buf = io.StringIO()
+    for team_name, pool in pools.items():
+        _write_pool(buf, team_name, pool)
+
+    path = pool_path(game_id, dir_path)
+    tmp_path = path.with_suffix(".csv.tmp")
+    tmp_path.write_text(buf.getvalue())
+    os.replace(tmp_path, path)
+    return pools
+
+
+def _write_pool(buf: io.StringIO, team_name: str, pool: OutcomePool) -> None:
+    # two, three の NO_PLAYER はチケットファイルと同じく空欄にする
+    csv.writer(buf, lineterminator="\n").writerows(
+        [team_name, TICKET_TYPES[ticket_type], one, two or "", three or "", unit]
+        for (ticket_type, one, two, three), unit in pool.items()
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="チケットの集計ファイルを作り直す")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("dir_path", help="チケットファイルのディレクトリパス")
+    parser.add_argument("game_id", type=int, nargs="+", help="対象のゲームID")
+    args = parser.parse_args()
+
+    for game_id in args.game_id:
+        pools = rebuild_pools(game_id, args.dir_path)
+        print(f"rebuilt game {game_id}: {len(pools)} teams")
+
+
+if __name__ == "__main__":
+    main()
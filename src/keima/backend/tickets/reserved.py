@@ -0,0 +1,88 @@
+import os
+import threading
+
+import pandas as pd
+
+
+class ReservedUnits:
+    """チケットファイルごとの購入済みunitの合計
+
+    チケットファイルへの追記と一緒に合計を更新し、購入時のcoinの確認で
+    ファイルを読み直さずに済むようにする。
+    合計はファイルサイズと組で記録しておき、記録と異なるサイズのファイル
+    (プロセスの再起動後や、外部から書き換えられたとき) は1回だけ読み直す。
+    """
+
+    def __init__(self) -> None:
+        # path -> (unitの合計, ファイルサイズ)
+        self._totals: dict[str, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> int:
+        """チケットファイルのunitの合計を返す。ファイルがないときは0
+
+        Parameters
+        ----------
+        path : str
+            チケットファイルのパス
+
+        Returns
+        -------
+        int
+            unitの合計
+        """
+        size = _size(path)
+        with self._lock:
+            total, known_size = self._totals.get(path, (0, -1))
+            if known_size == size:
+                return total
+        total = (
+            0 if size == 0 else int(pd.read_csv(path, usecols=["unit"])["unit"].sum())
+        )
+        with self._lock:
+            self._totals[path] = (total, size)
+        return total
+
+    def add(self, path: str, units: int, size_before: int) -> None:
+        """追記したunitを合計に加える
+
+        Parameters
+        ----------
+        path : str
+            チケットファイルのパス
+        units : int
+            追記したunitの合計
+        size_before : int
+            追記前のファイルサイズ
+        """
+        with self._lock:
+            total, known_size = self._totals.get(path, (0, -1))
+            if known_size != size_before:
+                # 追記前の合計が分からないので、次回の参照時に読み直す
+                self._totals.pop(path, None)
+                return
+            self._totals[path] = (total + units, _size(path))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._totals.clear()
+
+    def snapshot(self) -> dict[str, tuple[int, int]]:
+        """チェックポイント用に、パスと (unitの合計, ファイルサイズ) の辞書を返す"""
+        with self._lock:
+            return dict(self._totals)
+
+    def restore(self, path: str, total: int, size: int) -> None:
+        """チェックポイントから読み込んだ合計を追加する"""
+        with self._lock:
+            self._totals[path] = (total, size)
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+reserved_units = ReservedUnits()
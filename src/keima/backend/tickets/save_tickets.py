@@ -0,0 +1,45 @@
+import csv
+import os
+
+from keima.backend.metrics.metrics import metrics
+from keima.backend.storage.layout import register_ticket_file, ticket_path
+from keima.backend.tickets.reserved import reserved_units
+from keima.backend.tickets.ticket_batch import TicketBatch
+
+TICKET_COLUMNS = ["ticket_type", "one", "two", "three", "unit"]
+
+
+def append_tickets(
+    team_name: str, game_id: int, tickets: TicketBatch, dir_path: str
+) -> None:
+    """teamのチケットを追記する。
+
+    ファイルの置き場所は keima.backend.storage.layout.ticket_path による。
+    同じレースで何回購入しても、それまでのチケットは残したまま末尾に追記するため、
+    1回の購入のコストは購入したチケットの数だけに比例する。
+
+    Parameters
+    ----------
+    team_name : str
+        teamの名前
+    game_id : int
+        ゲームID
+    tickets : TicketBatch
+        購入したチケット
+    dir_path : str
+        チケットファイルのディレクトリパス
+    """
+    path = str(ticket_path(team_name, game_id, dir_path))
+    size_before = os.path.getsize(path) if os.path.exists(path) else 0
+    if size_before == 0:
+        register_ticket_file(team_name, game_id, dir_path)
+    with open(path, "a", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        if size_before == 0:
+            writer.writerow(TICKET_COLUMNS)
+        # csv.writer は None を空欄として書き込む
+        writer.writerows(tickets.records())
+    reserved_units.add(path, tickets.units, size_before)
+    if metrics.enabled:
+        num_bytes = os.path.getsize(path) - size_before
+        metrics.record_io("tickets", "write", len(tickets), num_bytes)
@@ -0,0 +1,149 @@
+from collections.abc import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+# ticket_type の文字列と、配列に格納する番号の対応。番号は並び順
+TICKET_TYPES = ("win", "exacta", "trifecta")
+WIN, EXACTA, TRIFECTA = range(len(TICKET_TYPES))
+
+# two, three を指定しないチケットに入れる値。プレイヤー番号は1から始まる
+NO_PLAYER = 0
+
+TICKET_DTYPE = np.dtype(
+    [
+        ("ticket_type", np.uint8),
+        ("one", np.int16),
+        ("two", np.int16),
+        ("three", np.int16),
+        ("unit", np.int32),
+    ]
+)
+
+
+class TicketBatch:
+    """1回の購入で受け取ったチケットを、列ごとに詰めて持つ
+
+    チケット1枚は TICKET_DTYPE の構造化配列の1要素 (11 byte) で表し、
+    ticket_type は TICKET_TYPES の番号で持つ。
+    DataFrame を作らずに、unitの合計、Reward での得点計算、保存用の行を求められる。
+
+    Parameters
+    ----------
+    array : np.ndarray
+        TICKET_DTYPE の構造化配列
+    """
+
+    def __init__(self, array: np.ndarray) -> None:
+        if array.dtype != TICKET_DTYPE:
+            raise TypeError(f"array dtype must be {TICKET_DTYPE}")
+        self.array = array
+
+    @classmethod
+    def from_tickets(cls, tickets: Iterable) -> "TicketBatch":
+        """TicketInfo のリストから作る
+
+        Parameters
+        ----------
+        tickets : Iterable
+            TicketInfo のように ticket_type, one, two, three, unit を属性に持つ
+            オブジェクトの列
+
+        Returns
+        -------
+        TicketBatch
+            チケットの配列
+        """
+        return cls(
+            np.array(
+                [
+                    (
+                        TICKET_TYPES.index(t.ticket_type),
+                        t.one,
+                        NO_PLAYER if t.two is None else t.two,
+                        NO_PLAYER if t.three is None else t.three,
+                        t.unit,
+                    )
+                    for t in tickets
+                ],
+                dtype=TICKET_DTYPE,
+            )
+        )
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "TicketBatch":
+        """load_tickets などが返すチケット情報のDataFrameから作る
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            "ticket_type", "one", "two", "three", "unit" 列を持つDataFrame
+
+        Returns
+        -------
+        TicketBatch
+            チケットの配列
+
+        Raises
+        ------
+        ValueError
+            ticket_type が TICKET_TYPES にない行があるとき
+        """
+        array = np.empty(len(df), dtype=TICKET_DTYPE)
+        unknown = ~df["ticket_type"].isin(TICKET_TYPES)
+        if unknown.any():
+            types = sorted(set(df["ticket_type"][unknown].astype(str)))
+            raise ValueError(f"Unknown ticket_type: {types}")
+        array["ticket_type"] = pd.Categorical(
+            df["ticket_type"], categories=TICKET_TYPES
+        ).codes
+        for column in ("one", "two", "three"):
+            array[column] = df[column].fillna(NO_PLAYER).to_numpy()
+        array["unit"] = df["unit"].to_numpy()
+        return cls(array)
+
+    @classmethod
+    def concat(cls, batches: Iterable["TicketBatch"]) -> "TicketBatch":
+        """複数の購入のチケットをつなげる
+
+        Parameters
+        ----------
+        batches : Iterable[TicketBatch]
+            チケットの配列の列
+
+        Returns
+        -------
+        TicketBatch
+            順につなげたチケットの配列
+        """
+        arrays = [batch.array for batch in batches]
+        if not arrays:
+            return cls(np.empty(0, dtype=TICKET_DTYPE))
+        return cls(np.concatenate(arrays))
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    @property
+    def units(self) -> int:
+        """unitの合計"""
+        return int(self.array["unit"].sum(dtype=np.int64))
+
+    def records(self) -> Iterator[tuple[str, int, int | None, int | None, int]]:
+        """保存用に、1枚ずつ (ticket_type, one, two, three, unit) を返す
+
+        ticket_type は文字列に戻し、指定されていない two, three は None にする。
+
+        Yields
+        ------
+        tuple[str, int, int | None, int | None, int]
+            チケット1枚の値
+        """
+        for ticket_type, one, two, three, unit in self.array.tolist():
+            yield (
+                TICKET_TYPES[ticket_type],
+                one,
+                None if two == NO_PLAYER else two,
+                None if three == NO_PLAYER else three,
+                unit,
+            )
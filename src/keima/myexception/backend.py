@@ -8,3 +8,15 @@ class InvalidPlayerCountError(Exception):
     """Exception raised when the number of players is invalid."""
 
     pass
+
+
+class TicketBuyClosedError(Exception):
+    """Exception raised when tickets are bought after purchasing has closed."""
+
+
+class SettlementJobExistsError(Exception):
+    """Exception raised when a settlement job for the race is already submitted."""
+
+
+class IdempotencyKeyReusedError(Exception):
+    """Exception raised when an idempotency key is reused for a different request."""
@@ -0,0 +1,48 @@
+import pytest
+
+import app.app as app_module
+from keima.backend.admission.limits import Admission
+from keima.backend.app_class.app_class import RaceStateService
+from keima.backend.broadcast.broadcaster import Broadcaster
+from keima.backend.checkpoint.checkpoint import CHECKPOINT_FILE, Checkpointer
+from keima.backend.coins.cache import coin_cache
+from keima.backend.idempotency.cache import ADMIN_IDEMPOTENCY_FILE, IdempotencyCache
+from keima.backend.odds.odds import OddsBook
+from keima.backend.settlement.jobs import SettlementJobQueue
+from keima.backend.storage.factory import create_storage
+
+
+@pytest.fixture(autouse=True, params=["csv", "sqlite"])
+def dir_path(request, tmp_path, monkeypatch):
+    """各テストのデータ保存先を一時ディレクトリに切り替える"""
+    monkeypatch.setenv("KEIMA_STORAGE", request.param)
+    storage = create_storage(str(tmp_path))
+    monkeypatch.setattr(app_module, "DIR_PATH", str(tmp_path))
+    monkeypatch.setattr(app_module, "storage", storage)
+    monkeypatch.setattr(app_module, "odds_book", OddsBook(app_module.load_race_pool))
+    monkeypatch.setattr(app_module, "race_state_service", RaceStateService())
+    monkeypatch.setattr(app_module, "race_state_broadcaster", Broadcaster())
+    monkeypatch.setattr(
+        app_module,
+        "settlement_jobs",
+        SettlementJobQueue(
+            app_module.storage_executor.run,
+            on_settled=app_module.notify_settled,
+            locks=app_module.team_locks,
+        ),
+    )
+    monkeypatch.setattr(
+        app_module,
+        "checkpointer",
+        Checkpointer(str(tmp_path / CHECKPOINT_FILE), str(tmp_path)),
+    )
+    monkeypatch.setattr(app_module, "buy_idempotency", IdempotencyCache("buy_ticket"))
+    monkeypatch.setattr(
+        app_module,
+        "admin_idempotency",
+        IdempotencyCache("admin", path=str(tmp_path / ADMIN_IDEMPOTENCY_FILE)),
+    )
+    monkeypatch.setattr(app_module, "admission", Admission())
+    coin_cache.clear()
+    yield tmp_path
+    storage.close()
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.app as app_module
+from app.app import app
+from keima.backend.admission.limits import Admission
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def open_race(client: TestClient) -> None:
+    for team_name in ["A", "B"]:
+        client.post("/admin/set_coins", json={"team_name": team_name, "coins": 100})
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": 1, "ticket_buy": True, "ticket_paid": False},
+    )
+
+
+def buy(client: TestClient, team_name: str = "A", key: str | None = None):
+    headers = {} if key is None else {"Idempotency-Key": key}
+    return client.post(
+        "/buy_ticket",
+        json={
+            "team_name": team_name,
+            "game_id": 1,
+            "tickets": [{"ticket_type": "win", "one": 1, "unit": 1}],
+        },
+        headers=headers,
+    )
+
+
+def test_buy_ticket_rate_limit(client: TestClient, monkeypatch) -> None:
+    open_race(client)
+    monkeypatch.setattr(app_module, "admission", Admission({"buy_ticket": (0.1, 2)}))
+    assert buy(client, key="k1").status_code == 200
+    assert buy(client).status_code == 200
+    response = buy(client)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "10"
+    # teamごとのバケット
+    assert buy(client, "B").status_code == 200
+    # 保存した結果を返す再送は制限しない
+    response = buy(client, key="k1")
+    assert response.status_code == 200
+    assert response.headers["Idempotent-Replayed"] == "true"
+
+    metrics = client.get("/admin/metrics").text
+    assert 'keima_admission_rejected_total{endpoint="buy_ticket",reason="rate"}' in (
+        metrics
+    )
+
+
+def test_get_race_state_rate_limit(client: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(
+        app_module, "admission", Admission({"get_race_state": (0.5, 1)})
+    )
+    assert client.get("/get_race_state").status_code == 200
+    response = client.get("/get_race_state")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+
+
+def test_overload(client: TestClient, monkeypatch) -> None:
+    open_race(client)
+    admission = Admission(max_concurrent=2, admin_reserved=1)
+    monkeypatch.setattr(app_module, "admission", admission)
+    # 他のリクエストが一般の枠を使い切っている
+    assert admission.acquire("buy_ticket")
+
+    response = buy(client)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(app_module.OVERLOAD_RETRY_AFTER)
+    # /admin/* は予約された枠を使える
+    response = client.post("/admin/set_coins", json={"team_name": "A", "coins": 50})
+    assert response.status_code == 200
+    assert admission.in_use == 1
+
+    admission.release()
+    # 503のときは購入していない
+    response = client.get("/get_coins", params={"team_name": "A", "game_id": 1})
+    assert response.json()["coins"] == 50
+    assert buy(client).status_code == 200
+    assert admission.in_use == 0
+
+
+def test_slot_released_on_error(client: TestClient, monkeypatch) -> None:
+    admission = Admission(max_concurrent=1)
+    monkeypatch.setattr(app_module, "admission", admission)
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            async with app_module.storage_slot("buy_ticket"):
+                raise RuntimeError
+
+    asyncio.run(main())
+    assert admission.in_use == 0
@@ -0,0 +1,191 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app.app as app_module
+from app.app import app
+from keima.backend.admission.limits import Admission
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def set_race(client: TestClient, game_id: int, ticket_buy: bool) -> None:
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": game_id, "ticket_buy": ticket_buy, "ticket_paid": False},
+    )
+
+
+def purchase(team_name: str, game_id: int, unit: int, one: int = 1) -> dict:
+    return {
+        "team_name": team_name,
+        "game_id": game_id,
+        "tickets": [{"ticket_type": "win", "one": one, "unit": unit}],
+    }
+
+
+def test_buy_tickets(client: TestClient) -> None:
+    for team_name, coins in [("A", 5), ("B", 10)]:
+        client.post("/admin/set_coins", json={"team_name": team_name, "coins": coins})
+    set_race(client, 2, False)
+    set_race(client, 1, True)
+
+    response = client.post(
+        "/buy_tickets",
+        json=[
+            purchase("A", 1, 3),
+            purchase("B", 1, 4, one=2),
+            purchase("A", 1, 3),
+            purchase("A", 1, 2),
+            purchase("C", 1, 1),
+            purchase("B", 2, 1),
+            purchase("B", 3, 1),
+        ],
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["accepted"] == 3
+    assert body["results"] == [
+        {
+            "team_name": "A",
+            "game_id": 1,
+            "accepted": True,
+            "purchased_tickets_coins": 3,
+        },
+        {
+            "team_name": "B",
+            "game_id": 1,
+            "accepted": True,
+            "purchased_tickets_coins": 4,
+        },
+        {
+            "team_name": "A",
+            "game_id": 1,
+            "accepted": False,
+            "error": "Not enough coins to purchase tickets.",
+        },
+        {
+            "team_name": "A",
+            "game_id": 1,
+            "accepted": True,
+            "purchased_tickets_coins": 2,
+        },
+        {
+            "team_name": "C",
+            "game_id": 1,
+            "accepted": False,
+            "error": "Not enough coins to purchase tickets.",
+        },
+        {
+            "team_name": "B",
+            "game_id": 2,
+            "accepted": False,
+            "error": "Ticket purchasing is currently closed.",
+        },
+        {
+            "team_name": "B",
+            "game_id": 3,
+            "accepted": False,
+            "error": "Race 3 is not found.",
+        },
+    ]
+
+    # 1件ずつの購入と同じく、coinの確認とオッズに反映される
+    response = client.post("/buy_ticket", json=purchase("A", 1, 1))
+    assert response.json() == {"error": "Not enough coins to purchase tickets."}
+    odds = client.get("/get_odds", params={"game_id": 1}).json()
+    assert odds["totals"]["win"] == 9
+    assert odds["units"]["win"] == {"1": 5, "2": 4}
+
+
+def test_buy_tickets_idempotent(client: TestClient) -> None:
+    client.post("/admin/set_coins", json={"team_name": "A", "coins": 5})
+    set_race(client, 1, True)
+    headers = {"Idempotency-Key": "bulk-1"}
+
+    first = client.post("/buy_tickets", json=[purchase("A", 1, 3)], headers=headers)
+    second = client.post("/buy_tickets", json=[purchase("A", 1, 3)], headers=headers)
+
+    assert second.json() == first.json()
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert (
+        client.post("/buy_tickets", json=[purchase("A", 1, 3)]).json()["accepted"] == 0
+    )
+
+
+def test_buy_tickets_limits(client: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(app_module, "BULK_BUY_MAX", 2)
+    response = client.post("/buy_tickets", json=[purchase("A", 1, 1)] * 3)
+    assert response.status_code == 422
+
+    monkeypatch.setattr(app_module, "admission", Admission(max_concurrent=1))
+    assert app_module.admission.acquire("buy_ticket")
+    response = client.post("/buy_tickets", json=[purchase("A", 1, 1)])
+    assert response.status_code == 503
+
+
+def test_buy_tickets_invalid_item(client: TestClient) -> None:
+    client.post("/admin/set_coins", json={"team_name": "A", "coins": 5})
+    set_race(client, 1, True)
+
+    response = client.post(
+        "/buy_tickets",
+        json=[purchase("A", 1, 1, one=40000), purchase("A", 1, 2)],
+    )
+
+    assert response.status_code == 200
+    first, second = response.json()["results"]
+    assert first["accepted"] is False
+    assert first["error"].startswith("tickets.0.one:")
+    assert second["accepted"] is True
+
+
+def test_buy_tickets_team_rate_limit(client: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(app_module, "admission", Admission({"buy_ticket": (0.001, 1)}))
+    for team_name in ["A", "B"]:
+        client.post("/admin/set_coins", json={"team_name": team_name, "coins": 10})
+    set_race(client, 1, True)
+
+    response = client.post(
+        "/buy_tickets",
+        json=[purchase("A", 1, 1), purchase("A", 1, 1), purchase("B", 1, 1)],
+    )
+
+    results = response.json()["results"]
+    assert [result["accepted"] for result in results] == [True, False, True]
+    assert results[1]["error"] == "Too many requests."
+
+
+def test_buy_tickets_partial_failure(client: TestClient, monkeypatch) -> None:
+    for team_name in ["A", "B"]:
+        client.post("/admin/set_coins", json={"team_name": team_name, "coins": 10})
+    set_race(client, 1, True)
+    set_race(client, 2, True)
+    reserve = app_module.storage.reserve_teams_tickets
+
+    def fail_game_2(game_id, purchases, other_game_ids=()):
+        if game_id == 2:
+            raise OSError("disk full")
+        return reserve(game_id, purchases, other_game_ids)
+
+    monkeypatch.setattr(app_module.storage, "reserve_teams_tickets", fail_game_2)
+    headers = {"Idempotency-Key": "bulk-partial"}
+    reqs = [purchase("A", 1, 3), purchase("B", 2, 3)]
+
+    first = client.post("/buy_tickets", json=reqs, headers=headers)
+    assert first.status_code == 200
+    results = first.json()["results"]
+    assert results[0]["accepted"] is True
+    assert results[1] == {
+        "team_name": "B",
+        "game_id": 2,
+        "accepted": False,
+        "error": "Failed to save tickets: OSError",
+    }
+    # 再送しても保存済みのレースを買い直さない
+    second = client.post("/buy_tickets", json=reqs, headers=headers)
+    assert second.json() == first.json()
+    assert app_module.storage.get_reserved_coins("A", 1) == 3
@@ -97,3 +97,86 @@ def test_buyticket(
     # assert (
     #     reward_response.json()["team_coins"] == 1000 - purchased_coins + expected_reward
     # )
+
+
+def test_buyticket_accumulates(client: TestClient) -> None:
+    client.post("/admin/set_coins", json={"team_name": "D", "coins": 10, "game_id": 1})
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": 1, "ticket_buy": True, "ticket_paid": False},
+    )
+
+    for unit in [3, 4]:
+        response = client.post(
+            "/buy_ticket",
+            json={
+                "team_name": "D",
+                "game_id": 1,
+                "tickets": [{"ticket_type": "win", "one": 1, "unit": unit}],
+            },
+        )
+        assert response.json() == {"team_name": "D", "purchased_tickets_coins": unit}
+
+    # 購入済みの7と合わせるとcoinを超える
+    response = client.post(
+        "/buy_ticket",
+        json={
+            "team_name": "D",
+            "game_id": 1,
+            "tickets": [{"ticket_type": "win", "one": 2, "unit": 4}],
+        },
+    )
+    assert response.json() == {"error": "Not enough coins to purchase tickets."}
+
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": 1, "ticket_buy": False, "ticket_paid": False},
+    )
+    pay_response = client.post(
+        "/admin/pay_tickets", params={"team_name": "D", "game_id": 1}
+    )
+    assert pay_response.json()["team_coins"] == 3
+
+
+@pytest.mark.parametrize(
+    "ticket",
+    [
+        {"ticket_type": "win", "one": 40000, "unit": 1},
+        {"ticket_type": "win", "one": 5, "unit": 1},
+        {"ticket_type": "exacta", "one": 1, "two": 0, "unit": 1},
+        {"ticket_type": "win", "one": 1, "unit": 3_000_000_000},
+        {"ticket_type": "win", "one": 1, "unit": 0},
+    ],
+)
+def test_buyticket_out_of_range(client: TestClient, ticket: dict) -> None:
+    client.post("/admin/set_coins", json={"team_name": "E", "coins": 10, "game_id": 1})
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": 1, "ticket_buy": True, "ticket_paid": False},
+    )
+
+    response = client.post(
+        "/buy_ticket", json={"team_name": "E", "game_id": 1, "tickets": [ticket]}
+    )
+    assert response.status_code == 422
+
+
+def test_buyticket_player_range_follows_env(client: TestClient, monkeypatch) -> None:
+    client.post("/admin/set_coins", json={"team_name": "E", "coins": 10, "game_id": 1})
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": 1, "ticket_buy": True, "ticket_paid": False},
+    )
+    ticket = {"ticket_type": "win", "one": 6, "unit": 1}
+
+    response = client.post(
+        "/buy_ticket", json={"team_name": "E", "game_id": 1, "tickets": [ticket]}
+    )
+    assert response.status_code == 422
+
+    # 選手数は起動後に変えても、次のリクエストから反映される
+    monkeypatch.setenv("KEIMA_NUM_PLAYERS", "6")
+    response = client.post(
+        "/buy_ticket", json={"team_name": "E", "game_id": 1, "tickets": [ticket]}
+    )
+    assert response.status_code == 200
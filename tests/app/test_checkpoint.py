@@ -0,0 +1,49 @@
+from fastapi.testclient import TestClient
+
+import app.app as app_module
+from app.app import app
+from keima.backend.app_class.app_class import RaceStateService
+from keima.backend.coins.cache import coin_cache
+from keima.backend.tickets.reserved import reserved_units
+
+
+def test_race_state_survives_restart(monkeypatch) -> None:
+    with TestClient(app) as client:
+        client.post(
+            "/admin/set_race_state",
+            json={"game_id": 1, "ticket_buy": True, "ticket_paid": False},
+        )
+        client.post(
+            "/admin/set_race_state",
+            json={"game_id": 2, "ticket_buy": False, "ticket_paid": True},
+        )
+
+    # 再起動と同じく、メモリ上の状態を捨てる
+    monkeypatch.setattr(app_module, "race_state_service", RaceStateService())
+    coin_cache.clear()
+    reserved_units.clear()
+    with TestClient(app) as client:
+        response = client.get("/get_race_state")
+        assert response.json() == {
+            "game_id": 2,
+            "ticket_buy": False,
+            "ticket_paid": True,
+        }
+        response = client.get("/get_race_state", params={"game_id": 1})
+        assert response.json()["ticket_buy"] is True
+        metrics = client.get("/admin/metrics").text
+    assert "keima_startup_seconds " in metrics
+
+
+def test_race_state_replayed_from_journal(monkeypatch) -> None:
+    # チェックポイントを書き出す前に落ちたときも、journalから戻す
+    TestClient(app).post(
+        "/admin/set_race_state",
+        json={"game_id": 3, "ticket_buy": True, "ticket_paid": False},
+    )
+    assert not app_module.checkpointer.path.exists()
+
+    monkeypatch.setattr(app_module, "race_state_service", RaceStateService())
+    with TestClient(app) as client:
+        response = client.get("/get_race_state")
+    assert response.json() == {"game_id": 3, "ticket_buy": True, "ticket_paid": False}
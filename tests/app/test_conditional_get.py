@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import Request, Response
+from fastapi.testclient import TestClient
+
+import app.app as app_module
+from app.app import app
+from keima.backend.app_class.app_class import RaceState
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def test_race_state_etag(client: TestClient) -> None:
+    response = client.get("/get_race_state")
+    etag = response.headers["ETag"]
+
+    response = client.get("/get_race_state", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": 2, "ticket_buy": True, "ticket_paid": False},
+    )
+    response = client.get("/get_race_state", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["game_id"] == 2
+    assert response.headers["ETag"] != etag
+
+
+def test_coins_etag(client: TestClient) -> None:
+    client.post("/admin/set_coins", json={"team_name": "A", "coins": 10, "game_id": 0})
+    params = {"team_name": "A", "game_id": 0}
+    response = client.get("/get_coins", params=params)
+    etag = response.headers["ETag"]
+
+    response = client.get("/get_coins", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    start = time.perf_counter()
+    response = client.get(
+        "/get_coins",
+        params={**params, "wait": 0.2},
+        headers={"If-None-Match": etag},
+    )
+    assert response.status_code == 304
+    assert time.perf_counter() - start >= 0.2
+
+    client.post("/admin/set_coins", json={"team_name": "A", "coins": 20, "game_id": 0})
+    response = client.get("/get_coins", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_coins_etag_per_game_and_cached(client: TestClient, monkeypatch) -> None:
+    client.post("/admin/set_coins", json={"team_name": "A", "coins": 10, "game_id": 0})
+    client.post("/admin/set_coins", json={"team_name": "A", "coins": 20, "game_id": 1})
+    etags = [
+        client.get("/get_coins", params={"team_name": "A", "game_id": g}).headers[
+            "ETag"
+        ]
+        for g in [0, 1]
+    ]
+    assert etags[0] != etags[1]
+
+    if app_module.storage.get_cached_coins("A", 0) is None:
+        return
+
+    # キャッシュにあるときは、ETagのために保存先に問い合わせない
+    def fail(team_name):
+        raise AssertionError("get_coins_version must not be called")
+
+    monkeypatch.setattr(app_module.storage, "get_coins_version", fail)
+    response = client.get(
+        "/get_coins",
+        params={"team_name": "A", "game_id": 0},
+        headers={"If-None-Match": etags[0]},
+    )
+    assert response.status_code == 304
+
+
+def test_race_state_long_poll() -> None:
+    service = app_module.race_state_service
+    etag = app_module.race_state_etag(service)
+
+    async def main():
+        poll = asyncio.create_task(
+            app_module.get_race_state(
+                Request({"type": "http", "client": ("testclient", 0)}),
+                Response(),
+                30,
+                etag,
+                service,
+            )
+        )
+        await asyncio.sleep(0.05)
+        assert not poll.done()
+        start = time.perf_counter()
+        await app_module.set_race_state(RaceState(game_id=9), service)
+        result = await asyncio.wait_for(poll, 1)
+        return result, time.perf_counter() - start
+
+    result, elapsed = asyncio.run(main())
+    assert result["game_id"] == 9
+    assert elapsed < 0.5
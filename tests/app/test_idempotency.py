@@ -0,0 +1,129 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app.app as app_module
+from app.app import app
+from keima.backend.idempotency.cache import ADMIN_IDEMPOTENCY_FILE, IdempotencyCache
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def open_race(client: TestClient, game_id: int = 1) -> None:
+    client.post("/admin/set_coins", json={"team_name": "A", "coins": 100})
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": game_id, "ticket_buy": True, "ticket_paid": False},
+    )
+
+
+def close_race(client: TestClient, game_id: int = 1) -> None:
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": game_id, "ticket_buy": False, "ticket_paid": False},
+    )
+
+
+def buy(client: TestClient, key: str | None, unit: int = 30, team_name: str = "A"):
+    headers = {} if key is None else {"Idempotency-Key": key}
+    return client.post(
+        "/buy_ticket",
+        json={
+            "team_name": team_name,
+            "game_id": 1,
+            "tickets": [{"ticket_type": "win", "one": 1, "unit": unit}],
+        },
+        headers=headers,
+    )
+
+
+def reserved() -> int:
+    return app_module.storage.get_reserved_coins("A", 1)
+
+
+def test_buy_ticket_retry(client: TestClient) -> None:
+    open_race(client)
+    first = buy(client, "key-1")
+    retry = buy(client, "key-1")
+    assert retry.json() == first.json()
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert reserved() == 30
+
+    buy(client, "key-2")
+    buy(client, None)
+    assert reserved() == 90
+
+
+def test_buy_ticket_key_reused_for_different_request(client: TestClient) -> None:
+    open_race(client)
+    buy(client, "key-1", unit=10)
+    response = buy(client, "key-1", unit=20)
+    assert response.status_code == 422
+
+
+def test_key_scoped_by_team(client: TestClient) -> None:
+    open_race(client)
+    client.post("/admin/set_coins", json={"team_name": "B", "coins": 100})
+    buy(client, "key-1", unit=10)
+    # 別のteamが同じキーを使っても、Aの結果は返さずに購入する
+    response = buy(client, "key-1", unit=20, team_name="B")
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
+    assert app_module.storage.get_reserved_coins("B", 1) == 20
+
+
+def test_admin_key_scoped_by_path(client: TestClient) -> None:
+    open_race(client)
+    client.post("/admin/set_coins", json={"team_name": "B", "coins": 100})
+    buy(client, None, unit=10)
+    close_race(client)
+    headers = {"Idempotency-Key": "admin-1"}
+    params = {"team_name": "A", "game_id": 1}
+    client.post("/admin/pay_tickets", params=params, headers=headers)
+
+    # 別のteamの支払いに同じキーを使うと、内容が異なるので422
+    params = {"team_name": "B", "game_id": 1}
+    response = client.post("/admin/pay_tickets", params=params, headers=headers)
+    assert response.status_code == 422
+
+    # 別のエンドポイントでは、同じキーでも支払いの結果を返さない
+    client.post("/admin/save_race_result", params={"game_id": 1}, json=[1, 2, 3, 4])
+    response = client.post(
+        "/admin/reward_tickets/A", params={"game_id": 1}, headers=headers
+    )
+    assert response.json() == {"team_name": "A", "team_coins": 130}
+    assert "Idempotent-Replayed" not in response.headers
+
+
+def test_pay_and_reward_retry(client: TestClient, dir_path, monkeypatch) -> None:
+    open_race(client)
+    buy(client, None, unit=10)
+    close_race(client)
+    headers = {"Idempotency-Key": "pay-1"}
+    params = {"team_name": "A", "game_id": 1}
+    first = client.post("/admin/pay_tickets", params=params, headers=headers)
+    retry = client.post("/admin/pay_tickets", params=params, headers=headers)
+    assert first.json() == retry.json() == {"team_name": "A", "team_coins": 90}
+
+    client.post("/admin/save_race_result", params={"game_id": 1}, json=[1, 2, 3, 4])
+    headers = {"Idempotency-Key": "reward-1"}
+    first = client.post(
+        "/admin/reward_tickets/A", params={"game_id": 1}, headers=headers
+    )
+    assert first.json() == {"team_name": "A", "team_coins": 130}
+
+    # 再起動後の再送も、ファイルに保存した結果を返す
+    monkeypatch.setattr(
+        app_module,
+        "admin_idempotency",
+        IdempotencyCache("admin", path=str(dir_path / ADMIN_IDEMPOTENCY_FILE)),
+    )
+    retry = client.post(
+        "/admin/reward_tickets/A", params={"game_id": 1}, headers=headers
+    )
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert app_module.storage.get_team_coins("A") == 130
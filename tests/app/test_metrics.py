@@ -0,0 +1,54 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app.app as app_module
+from app.app import app
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def test_metrics_endpoint(client: TestClient) -> None:
+    client.post("/admin/set_coins", json={"team_name": "A", "coins": 100})
+    client.get("/get_coins", params={"team_name": "A", "game_id": 0})
+    client.get("/admin/settlement_jobs/unknown")
+
+    response = client.get("/admin/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert (
+        'keima_http_request_duration_seconds_count{route="/get_coins",method="GET"}'
+        in text
+    )
+    # パスパラメーターの値ではなくテンプレートをラベルにする
+    assert 'route="/admin/settlement_jobs/{job_id}"' in text
+    assert 'route="/admin/settlement_jobs/unknown"' not in text
+    assert 'keima_http_requests_in_flight{route="/get_coins",method="GET"} 0' in text
+    # 処理中の /admin/metrics 自身も route のテンプレートで数える
+    assert (
+        'keima_http_requests_in_flight{route="/admin/metrics",method="GET"} 1' in text
+    )
+
+
+def sample(text: str, name: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0
+
+
+def test_metrics_counts_errors(client: TestClient) -> None:
+    name = 'keima_http_requests_total{route="/get_coins",method="GET",status="422"}'
+    before = sample(client.get("/admin/metrics").text, name)
+    # game_id がないので 422 になる
+    client.get("/get_coins", params={"team_name": "A"})
+    assert sample(client.get("/admin/metrics").text, name) == before + 1
+
+
+def test_metrics_disabled(client: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(app_module.metrics, "enabled", False)
+    response = client.get("/admin/metrics")
+    assert response.status_code == 404
@@ -0,0 +1,95 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app.app as app_module
+from app.app import app
+from keima.backend.race_state.partition import RacePartition
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def set_race_state(client: TestClient, game_id: int, ticket_buy: bool) -> None:
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": game_id, "ticket_buy": ticket_buy, "ticket_paid": False},
+    )
+
+
+def buy(client: TestClient, game_id: int, unit: int):
+    return client.post(
+        "/buy_ticket",
+        json={
+            "team_name": "A",
+            "game_id": game_id,
+            "tickets": [{"ticket_type": "win", "one": 1, "unit": unit}],
+        },
+    )
+
+
+def test_concurrent_races(client: TestClient) -> None:
+    client.post("/admin/set_coins", json={"team_name": "A", "coins": 10, "game_id": 0})
+    set_race_state(client, 1, True)
+    set_race_state(client, 2, True)
+
+    assert buy(client, 1, 4).json()["purchased_tickets_coins"] == 4
+    assert buy(client, 2, 4).json()["purchased_tickets_coins"] == 4
+    # 同時に受付中の他のレースで購入済みのunitも含めてcoinを確認する
+    assert "error" in buy(client, 1, 4).json()
+    assert buy(client, 3, 1).status_code == 404
+
+    set_race_state(client, 1, False)
+    assert buy(client, 1, 1).status_code == 403
+    assert buy(client, 2, 1).status_code == 200
+    assert client.get("/get_race_state", params={"game_id": 1}).json() == {
+        "game_id": 1,
+        "ticket_buy": False,
+        "ticket_paid": False,
+    }
+    assert client.get("/get_race_state").json()["game_id"] == 1
+
+    response = client.post(
+        "/admin/save_race_result", params={"game_id": 2}, json=[1, 2, 3, 4]
+    )
+    assert response.status_code == 403
+    response = client.post(
+        "/admin/save_race_result", params={"game_id": 1}, json=[1, 2, 3, 4]
+    )
+    assert response.json() == {"game_id": 1, "result": [1, 2, 3, 4]}
+
+    response = client.post("/admin/settle_race", params={"game_id": 1})
+    assert response.json()["teams"]["A"] == {"paid": 4, "reward": 16, "team_coins": 22}
+    assert client.post("/admin/settle_race", params={"game_id": 2}).status_code == 403
+
+
+def test_race_partition(client: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(app_module, "race_partition", RacePartition(1, 2))
+    set_race_state(client, 1, True)
+    assert client.get("/get_race_state").json()["game_id"] == 1
+
+    response = client.post(
+        "/admin/set_race_state",
+        json={"game_id": 2, "ticket_buy": True, "ticket_paid": False},
+    )
+    assert response.status_code == 421
+    assert buy(client, 2, 1).status_code == 421
+
+
+def test_closed_race_counts_until_settled(client: TestClient) -> None:
+    client.post("/admin/set_coins", json={"team_name": "A", "coins": 10, "game_id": 0})
+    set_race_state(client, 1, True)
+    assert buy(client, 1, 8).json()["purchased_tickets_coins"] == 8
+    set_race_state(client, 1, False)
+    set_race_state(client, 2, True)
+
+    # 締め切った race 1 の8はまだ支払っていないため、coinから引いて確認する
+    assert "error" in buy(client, 2, 8).json()
+    assert buy(client, 2, 2).json()["purchased_tickets_coins"] == 2
+
+    client.post("/admin/save_race_result", params={"game_id": 1}, json=[2, 1, 3, 4])
+    response = client.post("/admin/settle_race", params={"game_id": 1})
+    assert response.json()["teams"]["A"]["team_coins"] == 2
+    # 精算した race 1 の分は除き、race 2 の2だけを引いて確認する
+    assert "error" in buy(client, 2, 1).json()
@@ -0,0 +1,71 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app.app as app_module
+from app.app import app
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def buy(client: TestClient, team_name: str, tickets: list[dict]) -> None:
+    client.post(
+        "/admin/set_coins",
+        json={"team_name": team_name, "coins": 100, "game_id": 5},
+    )
+    response = client.post(
+        "/buy_ticket",
+        json={"team_name": team_name, "game_id": 5, "tickets": tickets},
+    )
+    assert response.status_code == 200
+
+
+def test_odds(client: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(app_module, "REWARD_MODE", "odds")
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": 5, "ticket_buy": True, "ticket_paid": False},
+    )
+    buy(client, "A", [{"ticket_type": "win", "one": 2, "unit": 2}])
+    buy(client, "B", [{"ticket_type": "win", "one": 1, "unit": 6}])
+
+    response = client.get("/get_odds")
+    assert response.json()["final"] is False
+    assert response.json()["odds"]["win"] == {"1": 1.3333, "2": 4.0}
+
+    buy(client, "C", [{"ticket_type": "win", "one": 2, "unit": 2}])
+    assert client.get("/get_odds").json()["odds"]["win"]["2"] == 2.5
+
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": 5, "ticket_buy": False, "ticket_paid": False},
+    )
+    response = client.get("/get_odds", params={"game_id": 5})
+    assert response.json()["final"] is True
+    assert response.json()["totals"]["win"] == 10
+
+    client.post("/admin/save_race_result", json=[2, 1, 3, 4])
+    response = client.post("/admin/settle_race", params={"game_id": 5})
+    assert response.json()["teams"] == {
+        "A": {"paid": 2, "reward": 5, "team_coins": 103},
+        "B": {"paid": 6, "reward": 0, "team_coins": 94},
+        "C": {"paid": 2, "reward": 5, "team_coins": 103},
+    }
+
+
+def test_odds_unknown_race(client: TestClient) -> None:
+    response = client.get("/get_odds", params={"game_id": 999})
+    assert response.status_code == 404
+    assert app_module.storage.load_final_odds(999) is None
+    assert app_module.odds_book.final(999) is None
+
+    # 購入を受け付けないまま締め切ったレースは、最終オッズを作らずに集計を返す
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": 7, "ticket_buy": False, "ticket_paid": False},
+    )
+    response = client.get("/get_odds", params={"game_id": 7})
+    assert response.json()["final"] is False
+    assert app_module.storage.load_final_odds(7) is None
@@ -1,7 +1,12 @@
+import threading
+
 import pytest
 from fastapi.testclient import TestClient
 
+import app.app as app_module
 from app.app import app
+from keima.backend.app_class.app_class import RaceState
+from keima.backend.race_state.sqlite_race_state import SqliteRaceStateService
 
 
 @pytest.fixture
@@ -33,3 +38,52 @@ def test_set_race_state(
     response_get = client.get("/get_race_state")
     assert response_get.status_code == 200
     assert response_get.json() == expected_response
+
+
+def test_race_state_shared_across_workers(client: TestClient, tmp_path, monkeypatch):
+    db_path = str(tmp_path / "race_state.sqlite3")
+    monkeypatch.setattr(
+        app_module, "race_state_service", SqliteRaceStateService(db_path)
+    )
+    other_worker = SqliteRaceStateService(db_path)
+
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": 4, "ticket_buy": True, "ticket_paid": False},
+    )
+    assert other_worker.race_state == RaceState(game_id=4, ticket_buy=True)
+
+    other_worker.update(RaceState(game_id=4, ticket_buy=False))
+    response = client.post(
+        "/buy_ticket",
+        json={
+            "team_name": "A",
+            "game_id": 4,
+            "tickets": [{"ticket_type": "win", "one": 1, "unit": 1}],
+        },
+    )
+    assert response.status_code == 403
+    assert client.get("/get_race_state").json()["ticket_buy"] is False
+
+
+def test_sqlite_race_state_update_off_event_loop(
+    client: TestClient, tmp_path, monkeypatch
+):
+    service = SqliteRaceStateService(str(tmp_path / "race_state.sqlite3"))
+    monkeypatch.setattr(app_module, "race_state_service", service)
+    threads = []
+    update = service.update
+
+    def record_thread(race_state: RaceState) -> RaceState:
+        threads.append(threading.current_thread().name)
+        return update(race_state)
+
+    monkeypatch.setattr(service, "update", record_thread)
+    response = client.post(
+        "/admin/set_race_state",
+        json={"game_id": 3, "ticket_buy": True, "ticket_paid": False},
+    )
+    assert response.status_code == 200
+    assert len(threads) == 1
+    assert threads[0].startswith("keima-storage")
+    assert service.get(3) == RaceState(game_id=3, ticket_buy=True)
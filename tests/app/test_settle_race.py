@@ -0,0 +1,115 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app.app as app_module
+from app.app import app
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("settle_workers", [0, 1])
+def test_settle_race(client: TestClient, monkeypatch, settle_workers: int) -> None:
+    monkeypatch.setattr(app_module, "SETTLE_WORKERS", settle_workers)
+    game_id = 3
+    tickets = {
+        "A": [{"ticket_type": "win", "one": 2, "unit": 2}],
+        "B": [{"ticket_type": "exacta", "one": 2, "two": 1, "unit": 3}],
+        "C": [
+            {"ticket_type": "trifecta", "one": 1, "two": 2, "three": 3, "unit": 1},
+            {"ticket_type": "win", "one": 4, "unit": 5},
+        ],
+    }
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": game_id, "ticket_buy": True, "ticket_paid": False},
+    )
+    for team_name, team_tickets in tickets.items():
+        client.post(
+            "/admin/set_coins",
+            json={"team_name": team_name, "coins": 100, "game_id": game_id},
+        )
+        client.post(
+            "/buy_ticket",
+            json={"team_name": team_name, "game_id": game_id, "tickets": team_tickets},
+        )
+
+    response = client.post("/admin/settle_race", params={"game_id": game_id})
+    assert response.status_code == 403
+
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": game_id, "ticket_buy": False, "ticket_paid": False},
+    )
+    client.post("/admin/save_race_result", json=[2, 1, 3, 4])
+
+    response = client.post("/admin/settle_race", params={"game_id": game_id})
+    assert response.status_code == 200
+    assert response.json() == {
+        "game_id": game_id,
+        "teams": {
+            "A": {"paid": 2, "reward": 8, "team_coins": 106},
+            "B": {"paid": 3, "reward": 36, "team_coins": 133},
+            "C": {"paid": 6, "reward": 0, "team_coins": 94},
+        },
+    }
+    for team_name, coins in [("A", 106), ("B", 133), ("C", 94)]:
+        response = client.get(
+            "/get_coins", params={"team_name": team_name, "game_id": game_id + 1}
+        )
+        assert response.json()["coins"] == coins
+
+
+def test_pay_and_reward_are_settled(client: TestClient) -> None:
+    game_id = 5
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": game_id, "ticket_buy": True, "ticket_paid": False},
+    )
+    client.post(
+        "/admin/set_coins",
+        json={"team_name": "A", "coins": 100, "game_id": game_id},
+    )
+    client.post(
+        "/buy_ticket",
+        json={
+            "team_name": "A",
+            "game_id": game_id,
+            "tickets": [{"ticket_type": "win", "one": 2, "unit": 10}],
+        },
+    )
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": game_id, "ticket_buy": False, "ticket_paid": False},
+    )
+    client.post("/admin/save_race_result", json=[2, 1, 3, 4])
+
+    params = {"team_name": "A", "game_id": game_id}
+    response = client.post("/admin/pay_tickets", params=params)
+    assert response.json()["team_coins"] == 90
+    assert client.post("/admin/pay_tickets", params=params).status_code == 409
+    response = client.post("/admin/reward_tickets/A", params={"game_id": game_id})
+    assert response.json()["team_coins"] == 130
+    response = client.post("/admin/reward_tickets/A", params={"game_id": game_id})
+    assert response.status_code == 409
+
+    # 支払いと報酬を済ませたteamは、まとめての精算で二重に反映しない
+    response = client.post("/admin/settle_race", params={"game_id": game_id})
+    assert response.json() == {"game_id": game_id, "teams": {}}
+    assert app_module.storage.get_team_coins("A") == 130
+
+
+def test_settle_race_rejected_while_job_active(client: TestClient, monkeypatch) -> None:
+    game_id = 6
+    client.post(
+        "/admin/set_race_state",
+        json={"game_id": game_id, "ticket_buy": False, "ticket_paid": False},
+    )
+    monkeypatch.setattr(
+        app_module.settlement_jobs, "active", lambda gid: gid == game_id
+    )
+
+    response = client.post("/admin/settle_race", params={"game_id": game_id})
+    assert response.status_code == 409
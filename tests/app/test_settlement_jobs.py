@@ -0,0 +1,62 @@
+import time
+
+from fastapi.testclient import TestClient
+
+from app.app import app
+
+
+def wait_for_job(client: TestClient, job_id: str) -> dict:
+    for _ in range(100):
+        job = client.get(f"/admin/settlement_jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+def test_settlement_job() -> None:
+    game_id = 4
+    with TestClient(app) as client:
+        client.post(
+            "/admin/set_race_state",
+            json={"game_id": game_id, "ticket_buy": True, "ticket_paid": False},
+        )
+        for team_name, one in [("A", 2), ("B", 1)]:
+            client.post(
+                "/admin/set_coins",
+                json={"team_name": team_name, "coins": 100, "game_id": game_id},
+            )
+            client.post(
+                "/buy_ticket",
+                json={
+                    "team_name": team_name,
+                    "game_id": game_id,
+                    "tickets": [{"ticket_type": "win", "one": one, "unit": 3}],
+                },
+            )
+
+        response = client.post("/admin/settlement_jobs", params={"game_id": game_id})
+        assert response.status_code == 403
+
+        client.post(
+            "/admin/set_race_state",
+            json={"game_id": game_id, "ticket_buy": False, "ticket_paid": False},
+        )
+        client.post("/admin/save_race_result", json=[2, 1, 3, 4])
+        response = client.post("/admin/settlement_jobs", params={"game_id": game_id})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+
+        job = wait_for_job(client, job_id)
+        assert job["status"] == "done"
+        assert job["processed_teams"] == 2
+        assert (job["coins_paid"], job["coins_rewarded"]) == (6, 12)
+
+        response = client.post("/admin/settlement_jobs", params={"game_id": game_id})
+        assert response.status_code == 409
+        assert client.get("/admin/settlement_jobs/unknown").status_code == 404
+
+        response = client.get(
+            "/get_coins", params={"team_name": "A", "game_id": game_id + 1}
+        )
+        assert response.json()["coins"] == 109
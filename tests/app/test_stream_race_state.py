@@ -0,0 +1,30 @@
+import asyncio
+import json
+
+import app.app as app_module
+from keima.backend.app_class.app_class import RaceState
+
+
+def parse(event: str) -> tuple[int, dict]:
+    fields = dict(line.split(": ", 1) for line in event.strip().splitlines())
+    assert fields["event"] == "race_state"
+    return int(fields["id"]), json.loads(fields["data"])
+
+
+def test_stream_race_state() -> None:
+    async def main():
+        response = await app_module.stream_race_state()
+        events = response.body_iterator
+        snapshot = parse(await anext(events))
+
+        new_state = RaceState(game_id=8, ticket_buy=True)
+        await app_module.set_race_state(new_state, app_module.race_state_service)
+        pushed = parse(await asyncio.wait_for(anext(events), 1))
+        assert app_module.race_state_broadcaster.subscribers == 1
+        await events.aclose()
+        return snapshot, pushed
+
+    snapshot, pushed = asyncio.run(main())
+    assert pushed[0] == snapshot[0] + 1
+    assert pushed[1] == {"game_id": 8, "ticket_buy": True, "ticket_paid": False}
+    assert app_module.race_state_broadcaster.subscribers == 0
@@ -0,0 +1,92 @@
+import pytest
+
+from keima.backend.admission import limits
+from keima.backend.admission.limits import Admission, TokenBucket
+
+
+class Clock:
+    """time.monotonic の代わりに進める時計"""
+
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(limits.time, "monotonic", clock)
+    return clock
+
+
+def test_token_bucket_burst_and_refill(clock: Clock) -> None:
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.acquire("A") for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire("A") == pytest.approx(0.5)
+    # 他のキーは別のバケット
+    assert bucket.acquire("B") == 0
+    clock.now += 0.5
+    assert bucket.acquire("A") == 0
+    assert bucket.acquire("A") > 0
+    # 補充は burst で止まる
+    clock.now += 100
+    assert [bucket.acquire("A") for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire("A") > 0
+
+
+def test_token_bucket_max_keys(clock: Clock) -> None:
+    bucket = TokenBucket(rate=1, burst=1, max_keys=2)
+    for key in ["A", "B", "C"]:
+        bucket.acquire(key)
+    assert list(bucket._buckets) == ["B", "C"]
+    # 捨てたキーは満杯のバケットから始まる
+    assert bucket.acquire("A") == 0
+
+
+def test_token_bucket_invalid() -> None:
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, burst=1)
+
+
+def test_check_rate(clock: Clock) -> None:
+    admission = Admission({"buy_ticket": (0.5, 1)})
+    assert admission.check_rate("buy_ticket", "A") == 0
+    assert admission.check_rate("buy_ticket", "A") == 2
+    # 制限を指定していないエンドポイントは常に受け付ける
+    assert all(admission.check_rate("get_coins", "A") == 0 for _ in range(100))
+
+
+def test_admin_reserved_slots() -> None:
+    admission = Admission(max_concurrent=3, admin_reserved=1)
+    assert admission.acquire("buy_ticket")
+    assert admission.acquire("buy_ticket")
+    assert not admission.acquire("buy_ticket")
+    assert admission.acquire("settle_race", admin=True)
+    assert not admission.acquire("settle_race", admin=True)
+    admission.release()
+    assert not admission.acquire("buy_ticket")
+    admission.release()
+    assert admission.acquire("buy_ticket")
+    assert admission.in_use == 2
+
+
+def test_unlimited() -> None:
+    admission = Admission()
+    assert all(admission.acquire("buy_ticket") for _ in range(1000))
+
+
+def test_from_env(monkeypatch) -> None:
+    monkeypatch.setenv("KEIMA_RATE_LIMITS", "buy_ticket=10/20, get_coins=5")
+    monkeypatch.setenv("KEIMA_MAX_CONCURRENT", "32")
+    monkeypatch.setenv("KEIMA_ADMIN_RESERVED", "4")
+    admission = Admission.from_env()
+    assert {k: (b.rate, b.burst) for k, b in admission.buckets.items()} == {
+        "buy_ticket": (10, 20),
+        "get_coins": (5, 5),
+    }
+    assert (admission.max_concurrent, admission.admin_reserved) == (32, 4)
+    monkeypatch.setenv("KEIMA_ADMIN_RESERVED", "32")
+    with pytest.raises(ValueError):
+        Admission.from_env()
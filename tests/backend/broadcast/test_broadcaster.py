@@ -0,0 +1,43 @@
+import asyncio
+
+from keima.backend.broadcast.broadcaster import EVICTED, Broadcaster, format_event
+
+
+def test_publish_fans_out_once_per_version() -> None:
+    async def main():
+        broadcaster = Broadcaster(queue_size=4)
+        queues = [broadcaster.subscribe() for _ in range(3)]
+        broadcaster.publish(1, "a")
+        broadcaster.publish(1, "a")
+        broadcaster.publish(2, "b")
+        broadcaster.unsubscribe(queues[2])
+        broadcaster.publish(3, "c")
+        return [[q.get_nowait() for _ in range(q.qsize())] for q in queues]
+
+    received = asyncio.run(main())
+    assert received[0] == [(1, "a"), (2, "b"), (3, "c")]
+    assert received[1] == received[0]
+    assert received[2] == [(1, "a"), (2, "b")]
+
+
+def test_slow_subscriber_evicted() -> None:
+    async def main():
+        broadcaster = Broadcaster(queue_size=2)
+        slow = broadcaster.subscribe()
+        fast = broadcaster.subscribe()
+        for version in range(1, 4):
+            broadcaster.publish(version, str(version))
+            await fast.get()
+        return broadcaster, slow
+
+    broadcaster, slow = asyncio.run(main())
+    assert slow.get_nowait() is EVICTED
+    assert slow.empty()
+    assert broadcaster.subscribers == 1
+    assert broadcaster.evicted == 1
+
+
+def test_format_event() -> None:
+    assert (
+        format_event("race_state", "{}", 3) == "id: 3\nevent: race_state\ndata: {}\n\n"
+    )
@@ -0,0 +1,178 @@
+import json
+
+import pytest
+
+from keima.backend.app_class.app_class import RaceState, RaceStateService, TicketInfo
+from keima.backend.checkpoint.checkpoint import MAGIC, Checkpointer
+from keima.backend.coins import get_coins
+from keima.backend.coins.cache import coin_cache
+from keima.backend.coins.get_coins import get_team_coins
+from keima.backend.coins.set_coins import set_team_coins
+from keima.backend.race_result import result_store
+from keima.backend.race_result.load_result import load_result
+from keima.backend.race_result.save_result import save_result
+from keima.backend.tickets import reserved
+from keima.backend.tickets.load_tickets import ticket_path
+from keima.backend.tickets.reserved import reserved_units
+from keima.backend.tickets.save_tickets import append_tickets
+from keima.backend.tickets.ticket_batch import TicketBatch
+
+
+def win_tickets(*units: int) -> TicketBatch:
+    return TicketBatch.from_tickets(
+        [TicketInfo(ticket_type="win", one=1, unit=unit) for unit in units]
+    )
+
+
+def restart(monkeypatch) -> None:
+    """プロセスの再起動と同じく、メモリ上の状態を捨てる"""
+    coin_cache.clear()
+    reserved_units.clear()
+    monkeypatch.setattr(result_store, "_stores", {})
+
+
+def forbid_read_csv(monkeypatch) -> None:
+    def read_csv(*args, **kwargs):
+        raise AssertionError("should be served from the checkpoint")
+
+    monkeypatch.setattr(get_coins.pd, "read_csv", read_csv)
+    monkeypatch.setattr(reserved.pd, "read_csv", read_csv)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    coin_cache.clear()
+    reserved_units.clear()
+    yield
+    coin_cache.clear()
+    reserved_units.clear()
+
+
+@pytest.fixture
+def checkpointer(tmp_path) -> Checkpointer:
+    return Checkpointer(str(tmp_path / "checkpoint.bin"), str(tmp_path))
+
+
+@pytest.fixture
+def season(tmp_path) -> str:
+    dir_path = str(tmp_path)
+    set_team_coins("A", 100, dir_path, 0)
+    set_team_coins("A", 80, dir_path, 1)
+    append_tickets("A", 1, win_tickets(2, 3), dir_path)
+    save_result(0, [1, 2, 3, 4], dir_path)
+    # 参照してメモリ上に載せる
+    get_team_coins("A", dir_path)
+    reserved_units.get(str(ticket_path("A", 1, dir_path)))
+    load_result(0, dir_path)
+    return dir_path
+
+
+def test_restore(season, checkpointer, monkeypatch) -> None:
+    service = RaceStateService()
+    service.update(RaceState(game_id=1, ticket_buy=True))
+    service.update(RaceState(game_id=2))
+    assert checkpointer.save(checkpointer.capture_races(service)) > 0
+
+    restart(monkeypatch)
+    restored = RaceStateService()
+    stats = checkpointer.restore(restored)
+    assert stats == {"coins": 1, "reserved": 1, "results": 1, "races": 3, "replayed": 0}
+    assert restored.load() == (RaceState(game_id=2), 2)
+    assert restored.open_races() == [1]
+
+    forbid_read_csv(monkeypatch)
+    assert get_team_coins("A", season) == 80
+    assert get_team_coins("A", season, 0) == 100
+    assert reserved_units.get(str(ticket_path("A", 1, season))) == 5
+    assert load_result(0, season) == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("storage", ["csv", "ledger"])
+def test_replay_after_checkpoint(season, checkpointer, monkeypatch, storage) -> None:
+    monkeypatch.setenv("KEIMA_COINS_STORAGE", storage)
+    service = RaceStateService()
+    checkpointer.save(checkpointer.capture_races(service))
+
+    # チェックポイントの後の変更
+    set_team_coins("A", 70, season, 2)
+    append_tickets("A", 1, win_tickets(4), season)
+    save_result(1, [4, 3, 2, 1], season)
+    race_state = RaceState(game_id=1, ticket_buy=True)
+    service.update(race_state)
+    checkpointer.record_race_state(race_state, service.version)
+
+    restart(monkeypatch)
+    restored = RaceStateService()
+    stats = checkpointer.restore(restored)
+    assert stats["replayed"] == 3
+    assert restored.open_races() == [1]
+
+    forbid_read_csv(monkeypatch)
+    assert get_team_coins("A", season) == 70
+    assert reserved_units.get(str(ticket_path("A", 1, season))) == 9
+    assert load_result(1, season) == [4, 3, 2, 1]
+
+
+def test_checkpoint_is_json(season, checkpointer) -> None:
+    service = RaceStateService()
+    service.update(RaceState(game_id=1, ticket_buy=True))
+    checkpointer.save(checkpointer.capture_races(service))
+
+    payload = json.loads(checkpointer.path.read_bytes()[len(MAGIC) + 4 :])
+    assert payload["races"] == [[[0, False, False], [1, True, False]], 1, 1]
+    assert payload["results"][0] == [[0, [1, 2, 3, 4]]]
+
+
+def test_replay_quoted_team_name(tmp_path, checkpointer, monkeypatch) -> None:
+    monkeypatch.setenv("KEIMA_COINS_STORAGE", "ledger")
+    dir_path = str(tmp_path)
+    set_team_coins("B,C", 100, dir_path, 0)
+    get_team_coins("B,C", dir_path)
+    checkpointer.save()
+
+    # csv.writer が引用符で囲んだteam名の行
+    set_team_coins("B,C", 70, dir_path, 1)
+
+    restart(monkeypatch)
+    assert checkpointer.restore()["replayed"] == 1
+    forbid_read_csv(monkeypatch)
+    assert get_team_coins("B,C", dir_path) == 70
+
+
+def test_journal_trimmed_by_checkpoint(checkpointer) -> None:
+    service = RaceStateService()
+    race_state = RaceState(game_id=1, ticket_buy=True)
+    service.update(race_state)
+    checkpointer.record_race_state(race_state, service.version)
+    checkpointer.save(checkpointer.capture_races(service))
+    assert not checkpointer.journal_path.exists()
+
+
+def test_rewritten_file_is_read_again(season, checkpointer, monkeypatch) -> None:
+    checkpointer.save()
+    with open(f"{season}/A_coins.csv", "w") as f:
+        f.write("team_name,coins,game_id\nA,5,0\nA,6,1\nA,7,2\n")
+
+    restart(monkeypatch)
+    assert checkpointer.restore()["coins"] == 0
+    assert get_team_coins("A", season) == 7
+
+
+@pytest.mark.parametrize("data", [b"", b"KEIMACP2", b"broken checkpoint"])
+def test_broken_checkpoint(season, checkpointer, monkeypatch, data) -> None:
+    checkpointer.save()
+    if data:
+        data += checkpointer.path.read_bytes()[len(data) :]
+    checkpointer.path.write_bytes(data[:-1] if data else data)
+
+    restart(monkeypatch)
+    stats = checkpointer.restore()
+    assert stats == dict.fromkeys(stats, 0)
+    assert get_team_coins("A", season) == 80
+
+
+def test_no_checkpoint(checkpointer) -> None:
+    service = RaceStateService()
+    stats = checkpointer.restore(service)
+    assert stats == dict.fromkeys(stats, 0)
+    assert service.load() == (RaceState(), 0)
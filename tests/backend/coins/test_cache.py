@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+from keima.backend.coins import get_coins
+from keima.backend.coins.cache import CoinCache, coin_cache, file_stat
+from keima.backend.coins.get_coins import get_team_coins
+from keima.backend.coins.set_coins import set_team_coins, set_teams_coins
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    coin_cache.clear()
+    yield
+    coin_cache.clear()
+
+
+def forbid_read_csv(monkeypatch) -> None:
+    def read_csv(*args, **kwargs):
+        raise AssertionError("coins file should be served from the cache")
+
+    monkeypatch.setattr(get_coins.pd, "read_csv", read_csv)
+
+
+@pytest.mark.parametrize("storage", ["csv", "ledger"])
+def test_write_through(tmp_path, monkeypatch, storage) -> None:
+    monkeypatch.setenv("KEIMA_COINS_STORAGE", storage)
+    dir_path = str(tmp_path)
+    set_team_coins("A", 100, dir_path, 1)
+    assert get_team_coins("A", dir_path) == 100
+
+    set_team_coins("A", 90, dir_path)
+    set_team_coins("A", 80, dir_path, 1)
+    set_teams_coins({"A": 70}, dir_path)
+
+    forbid_read_csv(monkeypatch)
+    assert get_team_coins("A", dir_path) == 70
+    assert get_team_coins("A", dir_path, 1) == 100
+    assert get_team_coins("A", dir_path, 2) == 90
+    assert get_team_coins("A", dir_path, 9) == 0
+
+
+def test_external_change_invalidates(tmp_path) -> None:
+    dir_path = str(tmp_path)
+    set_team_coins("A", 100, dir_path)
+    assert get_team_coins("A", dir_path) == 100
+
+    pd.DataFrame({"team_name": ["A"], "coins": [5], "game_id": [3]}).to_csv(
+        tmp_path / "A_coins.csv", index=False
+    )
+    assert get_team_coins("A", dir_path) == 5
+
+    (tmp_path / "A_coins.csv").unlink()
+    with pytest.raises(FileNotFoundError):
+        get_team_coins("A", dir_path)
+
+
+def test_lru_eviction(tmp_path) -> None:
+    cache = CoinCache(maxsize=2)
+    df = pd.DataFrame({"team_name": ["A"], "coins": [1], "game_id": [0]})
+    paths = [str(tmp_path / f"{team_name}_coins.csv") for team_name in "ABC"]
+    for path in paths:
+        df.to_csv(path, index=False)
+
+    cache.load(paths[0], df, file_stat(paths[0]))
+    cache.load(paths[1], df, file_stat(paths[1]))
+    assert cache.lookup(paths[0]) is not None
+    cache.load(paths[2], df, file_stat(paths[2]))
+
+    assert cache.lookup(paths[0]) is not None
+    assert cache.lookup(paths[1]) is None
+    assert cache.lookup(paths[2]) is not None
+
+
+def test_load_skips_changed_file(tmp_path) -> None:
+    cache = CoinCache()
+    path = str(tmp_path / "A_coins.csv")
+    df = pd.DataFrame({"team_name": ["A"], "coins": [1], "game_id": [0]})
+    df.to_csv(path, index=False)
+    stat = file_stat(path)
+
+    # 読み込みの後、キャッシュに入れる前に書き換えられた
+    pd.concat([df, df.assign(coins=2, game_id=1)]).to_csv(path, index=False)
+    assert cache.load(path, df, stat).coins() == 1
+    assert cache.lookup(path) is None
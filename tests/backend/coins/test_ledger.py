@@ -0,0 +1,118 @@
+import threading
+
+import pytest
+
+from keima.backend.coins.get_coins import get_team_coins
+from keima.backend.coins.ledger import (
+    COINS_JOURNAL,
+    CoinLedger,
+    journal_lock,
+    write_journal,
+)
+from keima.backend.coins.set_coins import (
+    recover_team_coins,
+    set_team_coins,
+    set_teams_coins,
+)
+
+UPDATES = [(100, 0), (90, None), (80, 1), (70, None), (60, 5), (50, None)]
+
+
+def apply_updates(dir_path: str) -> None:
+    for coins, game_id in UPDATES:
+        set_team_coins("A", coins, dir_path, game_id)
+    set_teams_coins({"A": 40, "B": 30}, dir_path)
+
+
+@pytest.mark.parametrize("game_id", [None, 0, 1, 2, 5, 6, 7, 8])
+def test_ledger_matches_csv(tmp_path, monkeypatch, game_id) -> None:
+    csv_dir = tmp_path / "csv"
+    ledger_dir = tmp_path / "ledger"
+    csv_dir.mkdir()
+    ledger_dir.mkdir()
+
+    apply_updates(str(csv_dir))
+    monkeypatch.setenv("KEIMA_COINS_STORAGE", "ledger")
+    apply_updates(str(ledger_dir))
+
+    assert (csv_dir / "A_coins.csv").read_text() == (
+        ledger_dir / "A_coins.csv"
+    ).read_text()
+    assert get_team_coins("A", str(ledger_dir), game_id) == get_team_coins(
+        "A", str(csv_dir), game_id
+    )
+
+
+def test_ledger_tracks_external_changes(tmp_path) -> None:
+    dir_path = str(tmp_path)
+    ledger = CoinLedger()
+    assert ledger.append("A", 100, dir_path) == 0
+    assert ledger.append("A", 90, dir_path) == 1
+
+    # ledgerを通さずにファイルを書き換える
+    set_team_coins("A", 80, dir_path, 10)
+    assert ledger.append("A", 70, dir_path) == 11
+
+
+@pytest.mark.parametrize("game_id", [None, 0, 1, 2, 5, 6])
+def test_compact(tmp_path, game_id) -> None:
+    dir_path = str(tmp_path)
+    for coins, update_game_id in [(100, 0), (90, 1), (80, 1), (70, 5), (60, 5)]:
+        set_team_coins("A", coins, dir_path, update_game_id)
+    expected = get_team_coins("A", dir_path, game_id)
+
+    ledger = CoinLedger()
+    ledger.compact("A", dir_path)
+
+    assert (tmp_path / "A_coins.csv").read_text().count("\n") == 4
+    assert get_team_coins("A", dir_path, game_id) == expected
+    assert ledger.append("A", 50, dir_path) == 6
+
+
+def test_compact_waits_for_journal_lock(tmp_path) -> None:
+    dir_path = str(tmp_path)
+    set_team_coins("A", 100, dir_path, 0)
+    set_team_coins("A", 90, dir_path, 0)
+
+    ledger = CoinLedger()
+    compacted = threading.Event()
+
+    def compact() -> None:
+        ledger.compact("A", dir_path)
+        compacted.set()
+
+    with journal_lock.hold(dir_path):
+        thread = threading.Thread(target=compact)
+        thread.start()
+        assert not compacted.wait(0.2)
+        set_team_coins("A", 80, dir_path, 1)
+    thread.join()
+
+    # ロックを取っている間に設定したcoinも残る
+    assert (tmp_path / "A_coins.csv").read_text().count("\n") == 3
+    assert get_team_coins("A", dir_path, 1) == 80
+
+
+def test_recover_append_journal(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("KEIMA_COINS_STORAGE", "ledger")
+    dir_path = str(tmp_path)
+    set_team_coins("A", 100, dir_path)
+    set_team_coins("B", 100, dir_path)
+    a_path = f"{dir_path}/A_coins.csv"
+    b_path = f"{dir_path}/B_coins.csv"
+    a_size = (tmp_path / "A_coins.csv").stat().st_size
+    b_size = (tmp_path / "B_coins.csv").stat().st_size
+    # Aの追記だけが終わった状態で落ちたことを再現する
+    write_journal(
+        dir_path,
+        {"append": [[a_path, a_size, "A,90,1\n"], [b_path, b_size, "B,80,1\n"]]},
+    )
+    with open(a_path, "a") as f:
+        f.write("A,90,1\n")
+
+    recover_team_coins(dir_path)
+
+    assert get_team_coins("A", dir_path) == 90
+    assert get_team_coins("B", dir_path) == 80
+    assert (tmp_path / "A_coins.csv").read_text().count("A,90,1") == 1
+    assert not (tmp_path / COINS_JOURNAL).exists()
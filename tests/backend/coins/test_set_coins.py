@@ -0,0 +1,110 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from keima.backend.coins.get_coins import get_team_coins
+from keima.backend.coins.set_coins import (
+    COINS_JOURNAL,
+    recover_team_coins,
+    set_team_coins,
+    set_teams_coins,
+)
+
+
+def test_set_teams_coins(tmp_path) -> None:
+    dir_path = str(tmp_path)
+    set_team_coins("A", 100, dir_path)
+    set_teams_coins({"A": 90, "B": 50}, dir_path)
+
+    assert get_team_coins("A", dir_path) == 90
+    assert get_team_coins("A", dir_path, 1) == 90
+    assert get_team_coins("B", dir_path, 0) == 50
+    assert not (tmp_path / COINS_JOURNAL).exists()
+
+
+def test_recover_committed_journal(tmp_path) -> None:
+    dir_path = str(tmp_path)
+    set_team_coins("A", 100, dir_path)
+    set_team_coins("B", 100, dir_path)
+    # Bの置き換えの前に落ちた状態を再現する
+    (tmp_path / "B_coins.csv.tmp").write_text(
+        "team_name,coins,game_id\nB,100,0\nB,70,1\n"
+    )
+    (tmp_path / COINS_JOURNAL).write_text(
+        json.dumps(
+            {
+                "replace": [
+                    [f"{dir_path}/A_coins.csv.tmp", f"{dir_path}/A_coins.csv"],
+                    [f"{dir_path}/B_coins.csv.tmp", f"{dir_path}/B_coins.csv"],
+                ]
+            }
+        )
+    )
+
+    recover_team_coins(dir_path)
+
+    assert get_team_coins("A", dir_path) == 100
+    assert get_team_coins("B", dir_path) == 70
+    assert not (tmp_path / COINS_JOURNAL).exists()
+
+
+def test_recover_uncommitted_batch(tmp_path) -> None:
+    dir_path = str(tmp_path)
+    set_team_coins("A", 100, dir_path)
+    (tmp_path / "A_coins.csv.tmp").write_text("team_name,coins,game_id\nA,1,0\n")
+
+    recover_team_coins(dir_path)
+
+    assert get_team_coins("A", dir_path) == 100
+    assert not (tmp_path / "A_coins.csv.tmp").exists()
+
+
+def test_recover_journal_records(tmp_path) -> None:
+    dir_path = str(tmp_path)
+    set_team_coins("A", 100, dir_path)
+    settled_path = tmp_path / "race_1_settled.csv"
+    settled_path.write_text("B,2,0\n")
+    # Aの置き換えは完了し、記録の追記の前に落ちた状態を再現する
+    (tmp_path / COINS_JOURNAL).write_text(
+        json.dumps(
+            {
+                "replace": [[f"{dir_path}/A_coins.csv.tmp", f"{dir_path}/A_coins.csv"]],
+                "records": [[str(settled_path), 6, "A,2,8\n"]],
+            }
+        )
+    )
+
+    recover_team_coins(dir_path)
+    recover_team_coins(dir_path)
+
+    assert settled_path.read_text() == "B,2,0\nA,2,8\n"
+    assert not (tmp_path / COINS_JOURNAL).exists()
+
+
+def test_concurrent_batches(tmp_path) -> None:
+    dir_path = str(tmp_path)
+    team_sets = [["A1", "A2", "A3"], ["B1", "B2", "B3"]]
+
+    def run(team_names: list[str]) -> None:
+        for coins in range(1, 31):
+            set_teams_coins(dict.fromkeys(team_names, coins), dir_path)
+
+    with ThreadPoolExecutor(2) as executor:
+        # 例外があればここで送出される
+        list(executor.map(run, team_sets))
+
+    for team_names in team_sets:
+        for team_name in team_names:
+            assert get_team_coins(team_name, dir_path) == 30
+            assert get_team_coins(team_name, dir_path, 29) == 30
+    assert not (tmp_path / COINS_JOURNAL).exists()
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_batch_keeps_tmp_files_of_others(tmp_path) -> None:
+    dir_path = str(tmp_path)
+    # 他のワーカーが書き出し中の一時ファイルは、一括更新では消さない
+    (tmp_path / "B_coins.csv.tmp").write_text("team_name,coins,game_id\nB,1,0\n")
+
+    set_teams_coins({"A": 10}, dir_path)
+
+    assert (tmp_path / "B_coins.csv.tmp").exists()
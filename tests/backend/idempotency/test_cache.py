@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from keima.backend.idempotency.cache import IdempotencyCache
+from keima.myexception.backend import IdempotencyKeyReusedError
+
+
+class Handler:
+    """呼ばれた回数を数えるリクエストの処理"""
+
+    def __init__(self, delay: float = 0) -> None:
+        self.calls = 0
+        self.delay = delay
+
+    async def __call__(self) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"calls": self.calls}
+
+
+def test_replay() -> None:
+    async def main():
+        cache = IdempotencyCache("test")
+        handler = Handler()
+        first = await cache.run("k", "req", handler)
+        second = await cache.run("k", "req", handler)
+        other = await cache.run("other", "req", handler)
+        return first, second, other, handler.calls
+
+    first, second, other, calls = asyncio.run(main())
+    assert first == ({"calls": 1}, False)
+    assert second == ({"calls": 1}, True)
+    assert other == ({"calls": 2}, False)
+    assert calls == 2
+
+
+def test_different_request_with_same_key() -> None:
+    async def main():
+        cache = IdempotencyCache("test")
+        await cache.run("k", "req", Handler())
+        await cache.run("k", "another req", Handler())
+
+    with pytest.raises(IdempotencyKeyReusedError):
+        asyncio.run(main())
+
+
+def test_concurrent_requests_run_once() -> None:
+    async def main():
+        cache = IdempotencyCache("test")
+        handler = Handler(delay=0.01)
+        results = await asyncio.gather(
+            *[cache.run("k", "req", handler) for _ in range(5)]
+        )
+        return results, handler.calls
+
+    results, calls = asyncio.run(main())
+    assert calls == 1
+    assert [result for result, _ in results] == [{"calls": 1}] * 5
+    assert sorted(replayed for _, replayed in results) == [False] + [True] * 4
+
+
+def test_failure_is_not_stored() -> None:
+    async def fail() -> dict:
+        raise RuntimeError("storage error")
+
+    async def main():
+        cache = IdempotencyCache("test")
+        with pytest.raises(RuntimeError):
+            await cache.run("k", "req", fail)
+        return await cache.run("k", "req", Handler())
+
+    assert asyncio.run(main()) == ({"calls": 1}, False)
+
+
+def test_ttl_and_maxsize(monkeypatch) -> None:
+    now = [1000.0]
+    monkeypatch.setattr("keima.backend.idempotency.cache.time.time", lambda: now[0])
+    cache = IdempotencyCache("test", maxsize=2, ttl=10)
+    cache.put("a", "req", {})
+    cache.put("b", "req", {})
+    cache.put("c", "req", {})
+    assert cache.get("a") is None
+    assert cache.get("b") == ("req", {})
+    assert len(cache) == 2
+
+    now[0] += 10
+    assert cache.get("b") is None
+    cache.put("d", "req", {})
+    assert len(cache) == 1
+
+
+def test_persisted(tmp_path) -> None:
+    path = str(tmp_path / "idempotency.jsonl")
+
+    async def main(cache, handler):
+        return await cache.run("k", "req", handler)
+
+    handler = Handler()
+    assert asyncio.run(main(IdempotencyCache("test", path=path), handler))[1] is False
+    # 再起動後もファイルから同じ結果を返す
+    restarted = IdempotencyCache("test", path=path)
+    assert asyncio.run(main(restarted, handler)) == ({"calls": 1}, True)
+    assert handler.calls == 1
+
+
+def test_compact(tmp_path) -> None:
+    path = tmp_path / "idempotency.jsonl"
+    cache = IdempotencyCache("test", maxsize=2, path=str(path))
+    for key in "abcde":
+        cache._append(cache.put(key, "req", {"key": key}))
+    assert len(path.read_text().splitlines()) <= 4
+
+    restarted = IdempotencyCache("test", maxsize=2, path=str(path))
+    assert restarted.get("e") == ("req", {"key": "e"})
+    assert restarted.get("a") is None
+
+
+def test_compact_keeps_other_workers(tmp_path) -> None:
+    path = tmp_path / "idempotency.jsonl"
+    # 同じファイルを共有する2つのワーカー
+    worker_a = IdempotencyCache("test", maxsize=4, path=str(path))
+    worker_b = IdempotencyCache("test", maxsize=4, path=str(path))
+    for key in "acdefghi":
+        worker_a._append(worker_a.put(key, "req", {"key": key}))
+    worker_b._append(worker_b.put("b", "req", {"key": "b"}))
+    # worker_a の追記で詰め直しても、worker_b の結果は残る
+    worker_a._append(worker_a.put("z", "req", {"key": "z"}))
+    assert len(path.read_text().splitlines()) == 4
+
+    restarted = IdempotencyCache("test", maxsize=4, path=str(path))
+    assert restarted.get("b") == ("req", {"key": "b"})
+    assert restarted.get("z") == ("req", {"key": "z"})
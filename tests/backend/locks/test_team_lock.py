@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from keima.backend.locks.team_lock import TeamLockManager
+
+
+async def hold(locks: TeamLockManager, team_name: str, active: dict, peak: dict):
+    async with locks.lock(team_name):
+        active[team_name] = active.get(team_name, 0) + 1
+        active["all"] = active.get("all", 0) + 1
+        peak[team_name] = max(peak.get(team_name, 0), active[team_name])
+        peak["all"] = max(peak.get("all", 0), active["all"])
+        await asyncio.sleep(0.01)
+        active[team_name] -= 1
+        active["all"] -= 1
+
+
+@pytest.mark.parametrize("mode", ["process", "file"])
+def test_same_team_serialized_other_teams_concurrent(tmp_path, mode) -> None:
+    locks = TeamLockManager(mode, str(tmp_path / "locks"))
+    active: dict = {}
+    peak: dict = {}
+
+    async def main():
+        await asyncio.gather(
+            *(hold(locks, team_name, active, peak) for team_name in "AAABBC")
+        )
+
+    asyncio.run(main())
+
+    assert peak["A"] == 1
+    assert peak["B"] == 1
+    assert peak["all"] == 3
+    # 待っている処理がなくなったロックは捨てる
+    assert locks._locks == {}
+
+
+def test_file_lock_blocks_other_manager(tmp_path) -> None:
+    # 別ワーカーのプロセスを、別の TeamLockManager で再現する
+    lock_dir = str(tmp_path / "locks")
+    first = TeamLockManager("file", lock_dir)
+    second = TeamLockManager("file", lock_dir)
+    order = []
+
+    async def worker(locks: TeamLockManager, name: str, delay: float):
+        await asyncio.sleep(delay)
+        async with locks.lock("A"):
+            order.append(f"{name} start")
+            await asyncio.sleep(0.02)
+            order.append(f"{name} end")
+
+    async def main():
+        await asyncio.gather(worker(first, "first", 0), worker(second, "second", 0.005))
+
+    asyncio.run(main())
+
+    assert order == ["first start", "first end", "second start", "second end"]
+
+
+def test_lock_many_in_name_order() -> None:
+    locks = TeamLockManager()
+    order = []
+
+    async def bulk(name: str, team_names: list[str]):
+        async with locks.lock_many(team_names):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        # 逆の順で渡しても名前順に取るため、互いに待ち合わない
+        await asyncio.wait_for(
+            asyncio.gather(
+                bulk("first", ["A", "B", "A"]),
+                bulk("second", ["B", "A"]),
+                hold(locks, "C", {}, {}),
+            ),
+            1,
+        )
+
+    asyncio.run(main())
+
+    assert order == ["first", "second"]
+    assert locks._locks == {}
@@ -0,0 +1,72 @@
+import pytest
+
+from keima.backend.metrics.metrics import Metrics
+
+
+def test_counter_and_gauge_render() -> None:
+    metrics = Metrics()
+    counter = metrics.counter("test_total", "Test counter.", ("name",))
+    gauge = metrics.gauge("test_in_flight", "Test gauge.")
+    counter.inc("a")
+    counter.inc("a", amount=2)
+    counter.inc('b"')
+    gauge.inc()
+    gauge.inc(amount=-1)
+
+    text = metrics.render()
+    assert "# TYPE test_total counter" in text
+    assert 'test_total{name="a"} 3' in text
+    assert 'test_total{name="b\\""} 1' in text
+    assert "test_in_flight 0" in text
+    assert counter.get("a") == 3
+
+
+def test_histogram_buckets_are_cumulative() -> None:
+    metrics = Metrics()
+    histogram = metrics.histogram("test_seconds", "Test histogram.", ("name",))
+    for value in [0.0001, 0.003, 0.003, 20.0]:
+        histogram.observe(value, "a")
+
+    lines = metrics.render().splitlines()
+    assert 'test_seconds_bucket{name="a",le="0.0005"} 1' in lines
+    assert 'test_seconds_bucket{name="a",le="0.005"} 3' in lines
+    assert 'test_seconds_bucket{name="a",le="10.0"} 3' in lines
+    assert 'test_seconds_bucket{name="a",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{name="a"} 4' in lines
+    assert histogram.count("a") == 4
+
+
+def test_timed_records_duration_and_errors() -> None:
+    metrics = Metrics()
+
+    @metrics.timed("double")
+    def double(x: int) -> int:
+        if x < 0:
+            raise ValueError(x)
+        return x * 2
+
+    assert double(2) == 4
+    with pytest.raises(ValueError):
+        double(-1)
+    assert metrics.function_seconds.count("double") == 2
+    assert metrics.function_errors.get("double") == 1
+
+
+def test_disabled_records_nothing() -> None:
+    metrics = Metrics(enabled=False)
+
+    @metrics.timed("double")
+    def double(x: int) -> int:
+        return x * 2
+
+    assert double(2) == 4
+    metrics.record_io("coins", "read", 1, 10)
+    assert metrics.function_seconds.count("double") == 0
+    assert metrics.io_rows.get("coins", "read") == 0
+
+
+def test_register_twice() -> None:
+    metrics = Metrics()
+    metrics.counter("test_total", "Test counter.")
+    with pytest.raises(ValueError):
+        metrics.counter("test_total", "Test counter.")
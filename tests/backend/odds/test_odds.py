@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from keima.backend.app_class.app_class import TicketInfo
+from keima.backend.odds.odds import OddsBook, RaceOdds
+from keima.backend.tickets.outcome_pool import OutcomePool
+from keima.backend.tickets.ticket_batch import EXACTA, WIN, TicketBatch
+from keima.myexception.backend import TicketBuyClosedError
+
+
+def batch(*tickets: dict) -> TicketBatch:
+    return TicketBatch.from_tickets([TicketInfo(**t) for t in tickets])
+
+
+def test_race_odds() -> None:
+    pool = OutcomePool({(WIN, 1, 0, 0): 6, (WIN, 2, 0, 0): 2, (EXACTA, 1, 2, 0): 5})
+    odds = RaceOdds(pool, takeout=0.25)
+
+    assert odds.payout((WIN, 1, 0, 0)) == 0.75 * 8 / 6
+    assert odds.payout((WIN, 2, 0, 0)) == 0.75 * 8 / 2
+    assert odds.payout((EXACTA, 1, 2, 0)) == 0.75
+    assert odds.payout((WIN, 3, 0, 0)) == 0.0
+
+    data = odds.to_dict()
+    assert data["totals"] == {"win": 8, "exacta": 5, "trifecta": 0}
+    assert data["units"] == {
+        "win": {"1": 6, "2": 2},
+        "exacta": {"1-2": 5},
+        "trifecta": {},
+    }
+    assert data["odds"]["win"]["2"] == 3.0
+    assert RaceOdds.from_dict(data).pool == pool
+
+
+def test_odds_book_close_waits_for_purchases() -> None:
+    stored = OutcomePool()
+
+    async def loader(game_id: int) -> OutcomePool:
+        pool = OutcomePool()
+        pool.merge(stored)
+        return pool
+
+    book = OddsBook(loader)
+    tickets = batch({"ticket_type": "win", "one": 1, "unit": 3})
+
+    async def buy() -> None:
+        async with book.purchase(1):
+            await asyncio.sleep(0.01)
+            stored.add(tickets)
+            book.add(1, tickets)
+
+    async def main() -> tuple[RaceOdds, RaceOdds]:
+        live, final = await book.odds(1)
+        assert not final
+        assert live.totals[WIN] == 0
+
+        task = asyncio.create_task(buy())
+        await asyncio.sleep(0)
+        # 受付中の購入が終わってから最終オッズを作る
+        final_odds = await book.close(1)
+        await task
+        with pytest.raises(TicketBuyClosedError):
+            async with book.purchase(1):
+                pass
+        return final_odds, (await book.odds(1))[0]
+
+    final_odds, after = asyncio.run(main())
+    assert final_odds.totals[WIN] == 3
+    assert after is final_odds
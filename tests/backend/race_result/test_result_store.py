@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from keima.backend.race_result.load_result import load_result, load_results
+from keima.backend.race_result.result_store import ResultStore
+from keima.backend.race_result.save_result import save_result
+from keima.myexception.backend import InvalidPlayerCountError
+
+
+def test_save_and_load(tmp_path) -> None:
+    dir_path = str(tmp_path)
+    save_result(1, [2, 1, 3, 4], dir_path)
+    save_result(2, [4, 3, 2, 1], dir_path)
+    save_result(1, [1, 2, 3, 4], dir_path)
+
+    assert load_result(1, dir_path) == [2, 1, 3, 4]
+    assert load_results([1, 2, 3], dir_path) == {1: [2, 1, 3, 4], 2: [4, 3, 2, 1]}
+    with pytest.raises(ValueError):
+        load_result(3, dir_path)
+    with pytest.raises(InvalidPlayerCountError):
+        save_result(3, [1, 2, 3], dir_path)
+
+    df = pd.read_csv(tmp_path / "race_results.csv")
+    assert df.columns.tolist() == [
+        "game_id",
+        "racer_1",
+        "racer_2",
+        "racer_3",
+        "racer_4",
+    ]
+    assert df["game_id"].tolist() == [1, 2, 1]
+
+
+def test_reads_rows_appended_by_other_process(tmp_path) -> None:
+    store = ResultStore(str(tmp_path))
+    store.save(1, [2, 1, 3, 4])
+    other = ResultStore(str(tmp_path))
+    assert other.load(1) == [2, 1, 3, 4]
+
+    store.save(2, [4, 3, 2, 1])
+    with open(tmp_path / "race_results.csv", "a") as f:
+        # 書き込み途中の行は読まない
+        f.write("3,1,2")
+    assert other.load_many([2, 3]) == {2: [4, 3, 2, 1]}
+
+    with open(tmp_path / "race_results.csv", "a") as f:
+        f.write(",3,4\n")
+    assert other.load(3) == [1, 2, 3, 4]
+
+
+def test_reads_legacy_file(tmp_path) -> None:
+    pd.DataFrame(
+        [{"game_id": 1, "racer_1": 3, "racer_2": 1, "racer_3": 2, "racer_4": 4}]
+    ).to_csv(tmp_path / "race_result.csv", index=False)
+    store = ResultStore(str(tmp_path))
+    store.save(2, [2, 1, 3, 4])
+
+    assert store.load_many([1, 2]) == {1: [3, 1, 2, 4], 2: [2, 1, 3, 4]}
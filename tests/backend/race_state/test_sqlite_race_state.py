@@ -0,0 +1,45 @@
+from keima.backend.app_class.app_class import RaceState
+from keima.backend.race_state.sqlite_race_state import SqliteRaceStateService
+
+
+def test_shared_between_services(tmp_path) -> None:
+    # 別ワーカーのプロセスを、同じファイルを開く別のサービスで再現する
+    db_path = str(tmp_path / "race_state.sqlite3")
+    worker1 = SqliteRaceStateService(db_path)
+    worker2 = SqliteRaceStateService(db_path)
+    assert worker2.load() == (RaceState(), 0)
+
+    opened = RaceState(game_id=3, ticket_buy=True)
+    assert worker1.update(opened) == RaceState(game_id=3)
+    assert worker1.load() == (opened, 1)
+    assert worker2.load() == (opened, 1)
+
+    closed = RaceState(game_id=3, ticket_buy=False)
+    worker2.race_state = closed
+    assert worker1.race_state == closed
+    assert worker1.version == 2
+
+    worker1.close()
+    worker2.close()
+    assert SqliteRaceStateService(db_path).load() == (closed, 2)
+
+
+def test_races(tmp_path) -> None:
+    db_path = str(tmp_path / "race_state.sqlite3")
+    worker1 = SqliteRaceStateService(db_path)
+    worker2 = SqliteRaceStateService(db_path)
+
+    worker1.update(RaceState(game_id=1, ticket_buy=True))
+    worker2.update(RaceState(game_id=2, ticket_buy=True))
+    assert sorted(worker1.open_races()) == [1, 2]
+    assert worker1.race_state.game_id == 2
+
+    previous = worker1.update(RaceState(game_id=1, ticket_buy=False))
+    assert previous == RaceState(game_id=1, ticket_buy=True)
+    assert worker2.get(1) == RaceState(game_id=1)
+    assert worker2.get(2) == RaceState(game_id=2, ticket_buy=True)
+    assert worker2.get(3) is None
+    assert worker2.open_races() == [2]
+
+    worker1.close()
+    worker2.close()
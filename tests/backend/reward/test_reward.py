@@ -2,6 +2,8 @@ import pandas as pd
 import pytest
 
 from keima.backend.reward.reward import Reward
+from keima.backend.tickets.outcome_pool import OutcomePool
+from keima.backend.tickets.ticket_batch import TicketBatch
 from keima.myexception.backend import InvalidPlayerCountError
 
 
@@ -190,3 +192,43 @@ def test_no_tickets():
     result = [2, 1, 3, 4]
     reward = Reward()
     assert reward.reward_point(df, result, 1) == 0
+
+
+def test_reward_point_without_game_id_column():
+    df = make_df(
+        [
+            {"ticket_type": "win", "unit": 2, "one": 2, "two": None, "three": None},
+            {"ticket_type": "exacta", "unit": 1, "one": 2, "two": 1, "three": None},
+        ]
+    )
+    assert Reward().reward_point(df, [2, 1, 3, 4]) == 4 * 2 + 12
+
+
+def test_reward_pool_matches_reward_point():
+    df = make_df(
+        [
+            {"ticket_type": "win", "unit": 2, "one": 2, "two": 4, "three": None},
+            {"ticket_type": "win", "unit": 5, "one": 1, "two": None, "three": None},
+            {"ticket_type": "exacta", "unit": 1, "one": 2, "two": 1, "three": 4},
+            {"ticket_type": "exacta", "unit": 2, "one": 2, "two": 1, "three": None},
+            {"ticket_type": "trifecta", "unit": 3, "one": 2, "two": 1, "three": 3},
+            {"ticket_type": "trifecta", "unit": 1, "one": 2, "two": 1, "three": 4},
+        ]
+    )
+    result = [2, 1, 3, 4]
+    reward = Reward()
+    pool = OutcomePool.from_tickets(TicketBatch.from_frame(df))
+    assert pool.total == 14
+    assert reward.reward_pool(pool, result) == reward.reward_point(df, result)
+    assert reward.reward_pool(OutcomePool(), result) == 0
+
+
+def test_from_frame_rejects_unknown_ticket_type():
+    df = make_df(
+        [
+            {"ticket_type": "win", "unit": 1, "one": 1, "two": None, "three": None},
+            {"ticket_type": "place", "unit": 1, "one": 1, "two": None, "three": None},
+        ]
+    )
+    with pytest.raises(ValueError, match="place"):
+        TicketBatch.from_frame(df)
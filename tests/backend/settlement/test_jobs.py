@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from keima.backend.app_class.app_class import TicketInfo
+from keima.backend.coins.cache import coin_cache
+from keima.backend.reward.reward import Reward
+from keima.backend.settlement.jobs import DONE, FAILED, SettlementJobQueue
+from keima.backend.storage.csv_storage import CsvStorage
+from keima.backend.storage.sqlite_storage import SqliteStorage
+from keima.backend.tickets.ticket_batch import TicketBatch
+from keima.myexception.backend import SettlementJobExistsError
+
+
+async def run(func, *args):
+    return func(*args)
+
+
+@pytest.fixture(params=["csv", "sqlite"])
+def storage(request, tmp_path):
+    coin_cache.clear()
+    if request.param == "csv":
+        storage = CsvStorage(str(tmp_path))
+    else:
+        storage = SqliteStorage(str(tmp_path / "keima.sqlite3"))
+    teams = [f"team{i}" for i in range(5)]
+    storage.set_teams_coins(dict.fromkeys(teams, 100))
+    for i, team_name in enumerate(teams):
+        tickets = TicketBatch.from_tickets(
+            [TicketInfo(ticket_type="win", one=i % 2 + 1, unit=2)]
+        )
+        storage.append_tickets(team_name, 1, tickets)
+    yield storage
+    storage.close()
+
+
+def test_settlement_job(storage) -> None:
+    storage.save_result(1, [1, 2, 3, 4])
+    settled = []
+    queue = SettlementJobQueue(run, chunk_size=2, on_settled=settled.append)
+
+    async def main():
+        job = queue.submit(1, storage, Reward())
+        assert queue.active(1) and not queue.active(2)
+        with pytest.raises(SettlementJobExistsError):
+            queue.submit(1, storage, Reward())
+        await queue.join()
+        assert not queue.active(1)
+        with pytest.raises(SettlementJobExistsError):
+            queue.submit(1, storage, Reward())
+        return job
+
+    job = asyncio.run(main())
+    assert queue.get(job.job_id) is job
+    assert job.to_dict() == {
+        "job_id": job.job_id,
+        "game_id": 1,
+        "status": DONE,
+        "total_teams": 5,
+        "skipped_teams": 0,
+        "processed_teams": 5,
+        "coins_paid": 10,
+        "coins_rewarded": 24,
+        "error": None,
+    }
+    assert [len(settlement) for settlement in settled] == [2, 2, 1]
+    assert storage.get_team_coins("team0") == 106
+    assert storage.get_team_coins("team1") == 98
+    assert storage.load_settled(1)["team0"] == (2, 8)
+
+
+def test_resume_failed_job(storage) -> None:
+    queue = SettlementJobQueue(run)
+    # 前回のジョブが team0, team1 を精算した後に止まった状態
+    storage.settle_teams(1, {"team0": (2, 8), "team1": (2, 0)})
+
+    async def submit():
+        job = queue.submit(1, storage, Reward())
+        await queue.join()
+        return job
+
+    failed = asyncio.run(submit())
+    assert failed.status == FAILED
+    assert failed.error is not None
+
+    storage.save_result(1, [1, 2, 3, 4])
+    job = asyncio.run(submit())
+    assert job.status == DONE
+    assert (job.skipped_teams, job.processed_teams) == (2, 3)
+    assert storage.get_team_coins("team0") == 106
+    assert storage.get_team_coins("team4") == 106
+    assert len(storage.load_settled(1)) == 5
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from keima.backend.coins.cache import coin_cache
+from keima.backend.odds.odds import RaceOdds
+from keima.backend.reward.reward import Reward
+from keima.backend.settlement.parallel import (
+    create_settle_executor,
+    settle_tickets_parallel,
+)
+from keima.backend.settlement.settle import settle_tickets
+from keima.backend.storage.csv_storage import CsvStorage
+from keima.backend.storage.sqlite_storage import SqliteStorage
+from keima.backend.tickets.outcome_pool import OutcomePool
+from keima.backend.tickets.ticket_batch import TICKET_DTYPE, TicketBatch
+
+RESULT = [2, 1, 3, 4]
+
+
+def make_storage(kind: str, dir_path) -> CsvStorage | SqliteStorage:
+    dir_path.mkdir()
+    if kind == "csv":
+        return CsvStorage(str(dir_path))
+    return SqliteStorage(str(dir_path / "keima.sqlite3"))
+
+
+def random_tickets(rng: np.random.Generator, size: int) -> TicketBatch:
+    array = np.zeros(size, dtype=TICKET_DTYPE)
+    array["ticket_type"] = rng.integers(0, 3, size)
+    picks = np.array([rng.permutation(4)[:3] + 1 for _ in range(size)])
+    array["one"] = picks[:, 0]
+    array["two"] = np.where(array["ticket_type"] >= 1, picks[:, 1], 0)
+    array["three"] = np.where(array["ticket_type"] == 2, picks[:, 2], 0)
+    array["unit"] = rng.integers(1, 5, size)
+    return TicketBatch(array)
+
+
+@pytest.fixture(params=["csv", "sqlite"])
+def storages(request, tmp_path):
+    """同じデータを持つ2つの保存先 (逐次の精算用と並列の精算用)"""
+    coin_cache.clear()
+    rng = np.random.default_rng(0)
+    batches = {f"team{i}": random_tickets(rng, 50) for i in range(7)}
+    pair = [make_storage(request.param, tmp_path / name) for name in ("a", "b")]
+    for storage in pair:
+        storage.set_teams_coins(dict.fromkeys(batches, 1000))
+        for team_name, tickets in batches.items():
+            storage.append_tickets(team_name, 1, tickets)
+        storage.save_result(1, RESULT)
+    yield pair
+    for storage in pair:
+        storage.close()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_matches_serial(storages, workers) -> None:
+    serial, parallel = storages
+    expected = settle_tickets(1, serial, Reward())
+
+    settlement = settle_tickets_parallel(
+        1, parallel, Reward(), workers=workers, chunk_size=3
+    )
+    assert settlement == expected
+    assert parallel.get_team_coins("team0") == serial.get_team_coins("team0")
+
+
+def test_matches_serial_odds(storages) -> None:
+    serial, parallel = storages
+    race_pool = OutcomePool()
+    for pool in serial.load_pools(1).values():
+        race_pool.merge(pool)
+    odds = RaceOdds(race_pool, takeout=0.2)
+    expected = settle_tickets(1, serial, Reward(), odds)
+
+    with create_settle_executor(2) as executor:
+        settlement = settle_tickets_parallel(
+            1, parallel, Reward(), odds, chunk_size=2, executor=executor
+        )
+    assert settlement == expected
+
+
+def test_no_tickets(tmp_path) -> None:
+    storage = CsvStorage(str(tmp_path))
+    storage.save_result(1, RESULT)
+    assert settle_tickets_parallel(1, storage, Reward(), workers=2) == {}
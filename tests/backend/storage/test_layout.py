@@ -0,0 +1,107 @@
+import pytest
+
+from keima.backend.app_class.app_class import TicketInfo
+from keima.backend.coins.cache import coin_cache
+from keima.backend.storage.csv_storage import CsvStorage
+from keima.backend.storage.layout import (
+    MANIFEST_FILE,
+    coins_path,
+    game_dir,
+    game_ticket_paths,
+    migrate_to_sharded,
+    register_ticket_file,
+    team_shard,
+    ticket_path,
+)
+from keima.backend.tickets.reserved import reserved_units
+from keima.backend.tickets.ticket_batch import TicketBatch
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    coin_cache.clear()
+    reserved_units.clear()
+    yield
+    coin_cache.clear()
+    reserved_units.clear()
+
+
+def win_tickets(unit: int) -> TicketBatch:
+    return TicketBatch.from_tickets([TicketInfo(ticket_type="win", one=1, unit=unit)])
+
+
+def fill(storage: CsvStorage) -> None:
+    storage.set_teams_coins({"A": 100, "B_1": 50})
+    storage.append_tickets("A", 1, win_tickets(2))
+    storage.append_tickets("A", 1, win_tickets(3))
+    storage.append_tickets("B_1", 1, win_tickets(4))
+    storage.append_tickets("A", 2, win_tickets(5))
+
+
+def check(storage: CsvStorage) -> None:
+    assert storage.get_team_coins("A") == 100
+    assert storage.get_team_coins("B_1") == 50
+    assert storage.game_teams(1) == ["A", "B_1"]
+    assert storage.game_teams(2) == ["A"]
+    assert storage.get_reserved_coins("A", 1) == 5
+    assert storage.get_reserved_coins("B_1", 1) == 4
+    assert storage.load_tickets("A", 2)["unit"].tolist() == [5]
+
+
+def test_sharded_paths(tmp_path, monkeypatch) -> None:
+    dir_path = str(tmp_path)
+    assert coins_path("A", dir_path) == f"{dir_path}/A_coins.csv"
+    assert ticket_path("A", 1, dir_path) == tmp_path / "A_1_tickets.csv"
+
+    monkeypatch.setenv("KEIMA_LAYOUT", "sharded")
+    shard = team_shard("A")
+    assert len(shard) == 2
+    assert coins_path("A", dir_path) == f"{dir_path}/coins/{shard}/A_coins.csv"
+    assert ticket_path("A", 1, dir_path) == (
+        tmp_path / "games" / "1" / shard / "A_tickets.csv"
+    )
+
+
+def test_sharded_storage(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("KEIMA_LAYOUT", "sharded")
+    storage = CsvStorage(str(tmp_path))
+    fill(storage)
+    check(storage)
+    assert not list(tmp_path.glob("*_coins.csv"))
+    manifest = game_dir(1, str(tmp_path)) / MANIFEST_FILE
+    assert manifest.read_text() == "A\nB_1\n"
+
+
+def test_manifest_skips_missing_ticket_file(tmp_path, monkeypatch) -> None:
+    # manifestに追記した後、チケットファイルを作る前に落ちたとき
+    monkeypatch.setenv("KEIMA_LAYOUT", "sharded")
+    register_ticket_file("A", 1, str(tmp_path))
+    assert game_ticket_paths(1, str(tmp_path)) == {}
+
+
+def test_migrate(tmp_path, monkeypatch) -> None:
+    fill(CsvStorage(str(tmp_path)))
+    coin_cache.clear()
+    reserved_units.clear()
+
+    assert migrate_to_sharded(str(tmp_path)) == (2, 3)
+    assert migrate_to_sharded(str(tmp_path)) == (0, 0)
+    monkeypatch.setenv("KEIMA_LAYOUT", "sharded")
+    check(CsvStorage(str(tmp_path)))
+
+
+def test_migrate_resumes(tmp_path, monkeypatch) -> None:
+    fill(CsvStorage(str(tmp_path)))
+    coin_cache.clear()
+    reserved_units.clear()
+    # 1レース分のチケットだけ移して、manifestを作る前に止まったとき
+    for team_name in ["A", "B_1"]:
+        target = game_dir(1, str(tmp_path)) / team_shard(team_name)
+        target.mkdir(parents=True)
+        (tmp_path / f"{team_name}_1_tickets.csv").rename(
+            target / f"{team_name}_tickets.csv"
+        )
+
+    assert migrate_to_sharded(str(tmp_path)) == (2, 1)
+    monkeypatch.setenv("KEIMA_LAYOUT", "sharded")
+    check(CsvStorage(str(tmp_path)))
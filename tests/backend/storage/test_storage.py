@@ -0,0 +1,283 @@
+import pytest
+
+from keima.backend.app_class.app_class import TicketInfo
+from keima.backend.coins.cache import coin_cache
+from keima.backend.storage.csv_storage import CsvStorage
+from keima.backend.storage.sqlite_storage import SqliteStorage
+from keima.backend.tickets.outcome_pool import OutcomePool
+from keima.backend.tickets.save_tickets import append_tickets
+from keima.backend.tickets.ticket_batch import EXACTA, WIN, TicketBatch
+from keima.myexception.backend import NoCoinsDataError
+
+
+@pytest.fixture(params=["csv", "csv-sharded", "sqlite"])
+def storage(request, tmp_path, monkeypatch):
+    coin_cache.clear()
+    if request.param.startswith("csv"):
+        if request.param == "csv-sharded":
+            monkeypatch.setenv("KEIMA_LAYOUT", "sharded")
+        storage = CsvStorage(str(tmp_path))
+    else:
+        storage = SqliteStorage(str(tmp_path / "keima.sqlite3"))
+    yield storage
+    storage.close()
+
+
+def test_coins(storage) -> None:
+    storage.set_team_coins("A", 100, 1)
+    storage.set_team_coins("A", 90)
+    storage.set_team_coins("A", 80, 2)
+    storage.set_teams_coins({"A": 70, "B": 50})
+
+    assert storage.get_team_coins("A") == 70
+    assert storage.get_team_coins("A", 1) == 100
+    assert storage.get_team_coins("A", 2) == 90
+    assert storage.get_team_coins("A", 5) == 0
+    assert storage.get_team_coins("B", 0) == 50
+
+
+def test_add_teams_coins(storage) -> None:
+    storage.set_teams_coins({"A": 100, "B": 50})
+
+    assert storage.add_teams_coins({"A": -10, "B": 20}) == {"A": 90, "B": 70}
+    assert storage.get_team_coins("A") == 90
+    assert storage.get_team_coins("B", 1) == 70
+
+
+def test_tickets(storage) -> None:
+    win = TicketInfo(ticket_type="win", one=1, unit=2)
+    trifecta = TicketInfo(ticket_type="trifecta", one=1, two=2, three=3, unit=1)
+    storage.append_tickets("A", 1, TicketBatch.from_tickets([win, trifecta]))
+    storage.append_tickets("B", 1, TicketBatch.from_tickets([win]))
+    storage.append_tickets("A", 2, TicketBatch.from_tickets([trifecta]))
+    storage.append_tickets("A", 1, TicketBatch.from_tickets([win]))
+
+    loaded = storage.load_tickets("A", 1)
+    assert loaded["unit"].tolist() == [2, 1, 2]
+    assert loaded["ticket_type"].tolist() == ["win", "trifecta", "win"]
+    assert loaded["three"].isna().tolist() == [True, False, True]
+    assert [(team, len(df)) for team, df in storage.iter_game_tickets(1)] == [
+        ("A", 3),
+        ("B", 1),
+    ]
+    assert storage.get_reserved_coins("A", 1) == 5
+    assert storage.get_reserved_coins("A", 2) == 1
+    assert storage.get_reserved_coins("A", 3) == 0
+
+
+def test_pools(storage) -> None:
+    win = TicketInfo(ticket_type="win", one=1, two=3, unit=2)
+    exacta = TicketInfo(ticket_type="exacta", one=1, two=2, three=4, unit=1)
+    storage.append_tickets("A", 1, TicketBatch.from_tickets([win, exacta]))
+    storage.append_tickets("A", 1, TicketBatch.from_tickets([win]))
+    storage.append_tickets("B", 1, TicketBatch.from_tickets([exacta]))
+
+    expected = {
+        "A": OutcomePool({(WIN, 1, 0, 0): 4, (EXACTA, 1, 2, 0): 1}),
+        "B": OutcomePool({(EXACTA, 1, 2, 0): 1}),
+    }
+    assert storage.load_pools(1) == expected
+    assert storage.load_pool("A", 1) == expected["A"]
+    assert storage.load_pool("C", 1) == OutcomePool()
+    assert storage.load_pools(2) == {}
+    assert storage.rebuild_pools(1) == expected
+    assert storage.load_pools(1) == expected
+
+
+def test_csv_pools_rebuilt_when_behind_tickets(tmp_path) -> None:
+    storage = CsvStorage(str(tmp_path))
+    win = TicketInfo(ticket_type="win", one=1, unit=2)
+    storage.append_tickets("A", 1, TicketBatch.from_tickets([win]))
+    # 集計の追記前に止まった状態
+    append_tickets("A", 1, TicketBatch.from_tickets([win]), str(tmp_path))
+    pools = tmp_path / "race_1_pools.csv"
+    before = pools.read_text()
+
+    assert storage.load_pools(1) == {"A": OutcomePool({(WIN, 1, 0, 0): 4})}
+    assert storage.load_pools(1) == {"A": OutcomePool({(WIN, 1, 0, 0): 4})}
+    # 読み込みでは集計ファイルを書き換えない
+    assert pools.read_text() == before
+
+    assert storage.rebuild_pools(1) == {"A": OutcomePool({(WIN, 1, 0, 0): 4})}
+    assert pools.read_text() != before
+
+
+def test_csv_load_pool_reads_team_only(tmp_path) -> None:
+    storage = CsvStorage(str(tmp_path))
+    win = TicketInfo(ticket_type="win", one=1, unit=2)
+    storage.append_tickets("A", 1, TicketBatch.from_tickets([win]))
+    storage.append_tickets("B", 1, TicketBatch.from_tickets([win]))
+    pools = tmp_path / "race_1_pools.csv"
+    pools.unlink()
+
+    # レースの集計ファイルを読まず、作り直しもしない
+    assert storage.load_pool("A", 1) == OutcomePool({(WIN, 1, 0, 0): 2})
+    assert not pools.exists()
+
+
+def test_sqlite_pools_backfilled(tmp_path) -> None:
+    db_path = str(tmp_path / "keima.sqlite3")
+    storage = SqliteStorage(db_path)
+    win = TicketInfo(ticket_type="win", one=1, unit=2)
+    storage.append_tickets("A", 1, TicketBatch.from_tickets([win, win]))
+    storage._conn().execute("DROP TABLE outcome_pools")
+    storage.close()
+
+    storage = SqliteStorage(db_path)
+    assert storage.load_pools(1) == {"A": OutcomePool({(WIN, 1, 0, 0): 4})}
+    storage.close()
+
+
+def test_results(storage) -> None:
+    storage.save_result(1, [2, 1, 3, 4])
+    storage.save_result(2, [4, 3, 2, 1])
+    storage.save_result(1, [1, 2, 3, 4])
+
+    assert storage.load_result(1) == [2, 1, 3, 4]
+    assert storage.load_results([1, 2, 3]) == {1: [2, 1, 3, 4], 2: [4, 3, 2, 1]}
+    with pytest.raises(ValueError):
+        storage.load_result(3)
+
+
+def test_sqlite_no_coins(tmp_path) -> None:
+    storage = SqliteStorage(str(tmp_path / "keima.sqlite3"))
+    with pytest.raises(NoCoinsDataError):
+        storage.get_team_coins("A")
+    storage.close()
+
+
+def test_reserve_tickets(storage) -> None:
+    storage.set_team_coins("A", 3)
+
+    def tickets(unit: int) -> TicketBatch:
+        return TicketBatch.from_tickets(
+            [TicketInfo(ticket_type="win", one=1, unit=unit)]
+        )
+
+    assert storage.reserve_tickets("A", 1, tickets(2))
+    assert not storage.reserve_tickets("A", 1, tickets(2))
+    assert storage.reserve_tickets("A", 1, tickets(1))
+    assert not storage.reserve_tickets("A", 2, tickets(4))
+    assert storage.load_tickets("A", 1)["unit"].tolist() == [2, 1]
+    assert storage.get_reserved_coins("A", 1) == 3
+    assert [team for team, _ in storage.iter_game_tickets(2)] == []
+
+
+def test_reserve_tickets_other_games(storage) -> None:
+    storage.set_team_coins("A", 5)
+    tickets = TicketBatch.from_tickets([TicketInfo(ticket_type="win", one=1, unit=3)])
+
+    assert storage.reserve_tickets("A", 1, tickets)
+    assert storage.reserve_tickets("A", 2, tickets)
+    assert not storage.reserve_tickets("A", 3, tickets, other_game_ids=[1, 2])
+    assert not storage.reserve_tickets("A", 2, tickets, other_game_ids=[1])
+    assert storage.get_reserved_coins("A", 3) == 0
+
+
+def test_reserve_tickets_excludes_paid_games(storage) -> None:
+    storage.set_team_coins("A", 10)
+    tickets = TicketBatch.from_tickets([TicketInfo(ticket_type="win", one=1, unit=8)])
+    assert storage.reserve_tickets("A", 1, tickets)
+    assert not storage.reserve_tickets("A", 2, tickets, [1])
+    assert storage.reserve_teams_tickets(2, [("A", tickets)], [1]) == [False]
+
+    # 支払いを記録すると、coinから引いた分は購入済みunitに数えない
+    storage.settle_team_part("A", 1, paid=8)
+    assert not storage.reserve_tickets("A", 2, tickets, [1])
+    storage.set_team_coins("A", 10)
+    assert storage.reserve_tickets("A", 2, tickets, [1])
+
+
+def test_reserve_teams_tickets(storage) -> None:
+    storage.set_teams_coins({"A": 5, "B": 10, "C": 1})
+    storage.reserve_tickets(
+        "B", 2, TicketBatch.from_tickets([TicketInfo(ticket_type="win", one=1, unit=8)])
+    )
+
+    def tickets(unit: int, one: int = 1) -> TicketBatch:
+        return TicketBatch.from_tickets(
+            [TicketInfo(ticket_type="win", one=one, unit=unit)]
+        )
+
+    accepted = storage.reserve_teams_tickets(
+        1,
+        [
+            ("A", tickets(3)),
+            ("B", tickets(3)),
+            # 同じteamの購入は、前に受け付けた分も含めて確認する
+            ("A", tickets(3)),
+            ("A", tickets(2, one=2)),
+            # coinのないteam
+            ("D", tickets(1)),
+            ("C", tickets(1)),
+        ],
+        other_game_ids=[2],
+    )
+
+    assert accepted == [True, False, False, True, False, True]
+    assert storage.load_tickets("A", 1)["unit"].tolist() == [3, 2]
+    assert storage.get_reserved_coins("A", 1) == 5
+    assert storage.get_reserved_coins("B", 1) == 0
+    assert storage.get_reserved_coins("C", 1) == 1
+    assert storage.game_teams(1) == ["A", "C"]
+    assert storage.load_pools(1) == {
+        "A": OutcomePool({(WIN, 1, 0, 0): 3, (WIN, 2, 0, 0): 2}),
+        "C": OutcomePool({(WIN, 1, 0, 0): 1}),
+    }
+    assert storage.reserve_teams_tickets(1, []) == []
+
+
+def test_settle_teams(storage) -> None:
+    storage.set_teams_coins({"A": 100, "B": 50})
+
+    assert storage.load_settled(1) == {}
+    assert storage.settle_teams(1, {"A": (10, 30), "B": (5, 0)}) == {
+        "A": 120,
+        "B": 45,
+    }
+    assert storage.get_team_coins("A") == 120
+    assert storage.load_settled(1) == {"A": (10, 30), "B": (5, 0)}
+    assert storage.load_settled(2) == {}
+
+
+def test_settle_teams_skips_settled(storage) -> None:
+    storage.set_teams_coins({"A": 100, "B": 50})
+    storage.settle_teams(1, {"A": (10, 30)})
+
+    # 別の精算が先にコミットしたteamは飛ばす
+    assert storage.settle_teams(1, {"A": (10, 30), "B": (5, 0)}) == {"B": 45}
+    assert storage.get_team_coins("A") == 120
+
+
+def test_settle_team_part(storage) -> None:
+    storage.set_teams_coins({"A": 100})
+
+    assert storage.settle_team_part("A", 1, paid=10) == 90
+    assert storage.load_settled(1) == {"A": (10, None)}
+    assert storage.settle_team_part("A", 1, paid=10) is None
+    assert storage.settle_team_part("A", 1, rewarded=30) == 120
+    assert storage.settle_team_part("A", 1, rewarded=30) is None
+    assert storage.load_settled(1) == {"A": (10, 30)}
+    # 支払いか報酬を記録したteamは、まとめての精算では飛ばす
+    assert storage.settle_teams(1, {"A": (10, 30)}) == {}
+    assert storage.get_team_coins("A") == 120
+
+
+def test_sqlite_settlements_migrated(tmp_path) -> None:
+    db_path = str(tmp_path / "keima.sqlite3")
+    storage = SqliteStorage(db_path)
+    conn = storage._conn()
+    conn.execute("DROP TABLE settlements")
+    conn.execute(
+        "CREATE TABLE settlements (game_id INTEGER NOT NULL, team_name TEXT NOT NULL, "
+        "paid INTEGER NOT NULL, reward INTEGER NOT NULL, "
+        "PRIMARY KEY (game_id, team_name))"
+    )
+    conn.execute("INSERT INTO settlements VALUES (1, 'A', 10, 30)")
+    storage.close()
+
+    storage = SqliteStorage(db_path)
+    storage.set_teams_coins({"B": 50})
+    assert storage.settle_team_part("B", 1, paid=5) == 45
+    assert storage.load_settled(1) == {"A": (10, 30), "B": (5, None)}
+    storage.close()